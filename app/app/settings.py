@@ -12,20 +12,41 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 
 import os
 
+from django.core.exceptions import ImproperlyConfigured
+
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 
-# Quick-start development settings - unsuitable for production
+# Settings differ by environment, set with DJANGO_ENV
+# > 'development' (the default) for runserver: DEBUG on, the built in
+#   secret key and SQL logging available with DJANGO_LOG_SQL=1
+# > 'production' for gunicorn, see gunicorn.conf.py: DEBUG off, so
+#   queries are neither recorded nor logged, and the secret key
+#   and allowed hosts must come from the environment
 # See https://docs.djangoproject.com/en/3.0/howto/deployment/checklist/
+DJANGO_ENV = os.environ.get('DJANGO_ENV', 'development')
+PRODUCTION = DJANGO_ENV == 'production'
 
 # SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = "k3j@qpo)zsfm%p1x2mijo55)haxc37xi)4i)c%%7hye=(1+_&="
+SECRET_KEY = os.environ.get('DJANGO_SECRET_KEY')
+if not SECRET_KEY:
+    if PRODUCTION:
+        raise ImproperlyConfigured('DJANGO_SECRET_KEY must be set')
+    SECRET_KEY = "k3j@qpo)zsfm%p1x2mijo55)haxc37xi)4i)c%%7hye=(1+_&="
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = bool(int(os.environ.get('DJANGO_DEBUG', 0 if PRODUCTION else 1)))
+
+# comma separated, e.g. 'api.example.com,localhost'
+ALLOWED_HOSTS = [
+    host for host in os.environ.get('DJANGO_ALLOWED_HOSTS', '').split(',')
+    if host
+]
 
-ALLOWED_HOSTS = []
+# behind the proxy, which sets X-Forwarded-Proto, see proxy/default.conf
+if PRODUCTION:
+    SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 
 
 # Application definition
@@ -50,6 +71,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # first so it measures the whole request, see INSTRUMENTATION_*
+    "core.instrumentation.InstrumentationMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -82,13 +105,41 @@ WSGI_APPLICATION = "app.wsgi.application"
 
 # Database
 # https://docs.djangoproject.com/en/3.0/ref/settings/#databases
+# > DB_POOL_SIZE > 0 keeps up to that many idle connections in a pool
+#   shared by the threads of each process, see core/db/postgresql_pool
+#   connections are then handed back after each request
+#   (CONN_MAX_AGE 0) and reopened after DB_POOL_MAX_LIFETIME seconds
+# > otherwise each thread keeps its connection open DB_CONN_MAX_AGE
+#   seconds, reused by its next requests, 'none' for no limit
+#   and 0 for a new connection per request
+# > DB_CONN_HEALTH_CHECKS=1 checks reused connections with a SELECT 1
+#   so one dropped by the server is replaced before it fails a request
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 0))
+DB_CONN_MAX_AGE = os.environ.get(
+    'DB_CONN_MAX_AGE', '0' if DB_POOL_SIZE else '60'
+)
+DB_CONN_HEALTH_CHECKS = bool(
+    int(os.environ.get('DB_CONN_HEALTH_CHECKS', 0))
+)
 DATABASES = {
     "default": {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': (
+            'core.db.postgresql_pool' if DB_POOL_SIZE
+            else 'django.db.backends.postgresql'
+        ),
         'HOST': os.environ.get('DB_HOST'),
         'NAME': os.environ.get('DB_NAME'),
         'USER': os.environ.get('DB_USER'),
         'PASSWORD': os.environ.get('DB_PASS'),
+        'CONN_MAX_AGE': (
+            None if DB_CONN_MAX_AGE.lower() == 'none'
+            else int(DB_CONN_MAX_AGE)
+        ),
+        'POOL': {
+            'MAX_SIZE': DB_POOL_SIZE,
+            'MAX_LIFETIME': int(os.environ.get('DB_POOL_MAX_LIFETIME', 3600)),
+            'HEALTH_CHECKS': DB_CONN_HEALTH_CHECKS,
+        },
         #       "ENGINE": "django.db.backends.sqlite3",
         #        "NAME": os.path.join(BASE_DIR, "db.sqlite3"),
     }
@@ -151,6 +202,185 @@ STATIC_ROOT = '/vol/web/static'
 # which pulls all the static files and stores them in the static directory
 # e.g. '/vol/web/static'
 
+# Uploaded recipe images are resized by a pool of background threads
+# see core/images.py
+# > set IMAGE_PROCESSING_ASYNC=0 to leave the pending images
+#   to the 'manage.py process_images' worker instead
+IMAGE_PROCESSING_ASYNC = bool(int(os.environ.get('IMAGE_PROCESSING_ASYNC', 1)))
+IMAGE_PROCESSING_WORKERS = int(os.environ.get('IMAGE_PROCESSING_WORKERS', 2))
+
+# Limits on uploaded recipe images, see core/uploadhandlers.py
+# > checked while the upload is streamed to disk, the pixel count
+#   is read from the image header before anything is decoded
+IMAGE_UPLOAD_MAX_BYTES = int(
+    os.environ.get('IMAGE_UPLOAD_MAX_BYTES', 20 * 1024 * 1024)
+)
+IMAGE_UPLOAD_MAX_PIXELS = int(
+    os.environ.get('IMAGE_UPLOAD_MAX_PIXELS', 50 * 1000 * 1000)
+)
+
+# Cache of the users authenticated by each API token
+# see user/authentication.py
+# > entries expire after TTL seconds
+# > set TOKEN_AUTH_CACHE_ALIAS to the name of a CACHES entry
+#   e.g. a memcached or redis cache to share it between processes
+# > without it each process keeps its own copies, and a token revoked
+#   in one process works in the others for up to TTL seconds, so set
+#   it whenever several processes serve the API
+TOKEN_AUTH_CACHE_MAX_SIZE = int(
+    os.environ.get('TOKEN_AUTH_CACHE_MAX_SIZE', 10000)
+)
+TOKEN_AUTH_CACHE_TTL = int(os.environ.get('TOKEN_AUTH_CACHE_TTL', 30))
+TOKEN_AUTH_CACHE_ALIAS = os.environ.get('TOKEN_AUTH_CACHE_ALIAS')
+
+# Cache backends
+# > the default is a per-process memory cache, set CACHE_URL to
+#   a memcached server (host:port) when running several processes
+#   so they share the cached responses and the data versions
+if os.environ.get('CACHE_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.'
+                       'MemcachedCache',
+            'LOCATION': os.environ.get('CACHE_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Cached list responses of the recipe, tag and ingredient endpoints
+# and their ETags, see recipe/cache.py
+# > the cached responses and the data versions invalidating them must
+#   be shared by every process, a per-process memory cache would let
+#   the processes that did not handle a write serve stale lists
+# > so it is on by default only with CACHE_URL, and turning it on
+#   with a per-process cache stops the app from starting
+LIST_CACHE_ENABLED = bool(int(os.environ.get(
+    'LIST_CACHE_ENABLED', 1 if os.environ.get('CACHE_URL') else 0
+)))
+LIST_CACHE_ALIAS = os.environ.get('LIST_CACHE_ALIAS', 'default')
+LIST_CACHE_TIMEOUT = int(os.environ.get('LIST_CACHE_TIMEOUT', 300))
+
+# List endpoints render their rows straight from values() instead of
+# running the serializers for each object, see recipe/fastlist.py
+# > set RECIPE_FAST_LIST=0 to use the serializers again
+RECIPE_FAST_LIST = bool(int(os.environ.get('RECIPE_FAST_LIST', 1)))
+
+# Whole lists can be streamed as a JSON array, see recipe/fastlist.py
+# > clients ask for it with ?stream=1, RECIPE_STREAM_LISTS=1 makes it
+#   the default for every unpaginated JSON list
+# > rows are read and encoded CHUNK_SIZE at a time
+RECIPE_STREAM_LISTS = bool(int(os.environ.get('RECIPE_STREAM_LISTS', 0)))
+RECIPE_STREAM_CHUNK_SIZE = int(
+    os.environ.get('RECIPE_STREAM_CHUNK_SIZE', 2000)
+)
+
+# Recipes imported per batch by ../recipes/import/ and import_recipes
+# > each batch is a handful of bulk queries in one transaction
+RECIPE_IMPORT_BATCH_SIZE = int(
+    os.environ.get('RECIPE_IMPORT_BATCH_SIZE', 1000)
+)
+
+# Tag and ingredient names are unique per user since core 0011
+# > migration 0010 stops if some users have a name twice, merge them
+#   first with 'manage.py merge_duplicate_names' (see --dry-run)
+# > or set this to merge them into the oldest during the migration,
+#   recipes keep all their tags and ingredients either way
+MERGE_DUPLICATE_NAMES_ON_MIGRATE = bool(int(
+    os.environ.get('MERGE_DUPLICATE_NAMES_ON_MIGRATE', 0)
+))
+
+# DRF renderers, the JSON one uses orjson when it is installed
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': (
+        'recipe.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ),
+}
+
+# Delta sync of the recipes, tags and ingredients, see recipe/sync.py
+# > tombstones of deleted objects are kept this many days, clients
+#   that last synced before that get a full sync
+# > a sync token points before the start of every write transaction
+#   still running on PostgreSQL, so rows committed after a sync are
+#   sent by the next one however long their transaction took
+# > rows changed up to GRACE seconds before that are returned again,
+#   which covers the time between stamping a row and writing it and
+#   clock differences between the app and the database
+# > the database role must see the other sessions in
+#   pg_stat_activity, which it does when they use the same role
+SYNC_TOMBSTONE_MAX_AGE_DAYS = int(
+    os.environ.get('SYNC_TOMBSTONE_MAX_AGE_DAYS', 90)
+)
+SYNC_GRACE_SECONDS = int(os.environ.get('SYNC_GRACE_SECONDS', 5))
+
+# Per request profiling, see core/instrumentation.py
+# > off unless INSTRUMENTATION_ENABLED=1, then SAMPLE_RATE of the
+#   requests (0.0 to 1.0) are measured
+# > measured responses get a Server-Timing header and the totals per
+#   view are served to Prometheus by ../metrics/, which requires
+#   'Authorization: Bearer <METRICS_TOKEN>' when a token is set
+#   and is only served to the same host (loopback) without one
+# > a request running the same query REPEATED_QUERY_LIMIT times or
+#   more is logged, it usually means a missing prefetch
+INSTRUMENTATION_ENABLED = bool(
+    int(os.environ.get('INSTRUMENTATION_ENABLED', 0))
+)
+INSTRUMENTATION_SAMPLE_RATE = float(
+    os.environ.get('INSTRUMENTATION_SAMPLE_RATE', 0.1)
+)
+INSTRUMENTATION_SERVER_TIMING = bool(
+    int(os.environ.get('INSTRUMENTATION_SERVER_TIMING', 1))
+)
+INSTRUMENTATION_REPEATED_QUERY_LIMIT = int(
+    os.environ.get('INSTRUMENTATION_REPEATED_QUERY_LIMIT', 5)
+)
+INSTRUMENTATION_METRICS_TOKEN = os.environ.get(
+    'INSTRUMENTATION_METRICS_TOKEN', ''
+)
+# > the totals are kept per process, with several worker processes
+#   set METRICS_DIR to a directory they share (e.g. in /dev/shm) so
+#   ../metrics/ adds up all of them, gunicorn empties it on start
+INSTRUMENTATION_METRICS_DIR = os.environ.get(
+    'INSTRUMENTATION_METRICS_DIR', ''
+)
+
+# Uploaded files in production, see core/views.py
+# > with MEDIA_ACCEL_REDIRECT set to an internal location of the proxy
+#   (e.g. '/protected-media/') Django only answers with an
+#   X-Accel-Redirect header and nginx sends the file itself
+# > otherwise the file is streamed by the app server, with sendfile
+#   when it supports it (gunicorn does)
+# > file names are derived from their content so they can be cached
+MEDIA_ACCEL_REDIRECT = os.environ.get('MEDIA_ACCEL_REDIRECT', '')
+MEDIA_CACHE_MAX_AGE = int(os.environ.get('MEDIA_CACHE_MAX_AGE', 86400))
+
+# Log to the console, the process manager collects it
+# > DJANGO_LOG_SQL=1 logs every query, only with DEBUG on
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'root': {
+        'handlers': ['console'],
+        'level': os.environ.get('DJANGO_LOG_LEVEL', 'INFO'),
+    },
+    'loggers': {
+        'django.db.backends': {
+            'level': (
+                'DEBUG' if DEBUG and os.environ.get('DJANGO_LOG_SQL') == '1'
+                else 'INFO'
+            ),
+        },
+    },
+}
+
 # ADDED FOR USER AUTHENTICATION      ##############
 # core is the name of our app
 # User is the name of the class model in our core app
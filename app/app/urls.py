@@ -15,16 +15,25 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
-from django.conf.urls.static import static
 from django.conf import settings
 
+from core import views as core_views
+
 
 urlpatterns = [
     # pass any request with ..api/user/ to the user.urls.py class to handle
     path('api/user/', include('user.urls')),
     path('api/recipe/', include('recipe.urls')),
     path('admin/', admin.site.urls),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
-# this makes the media url avaliable in our dev server
-# so we can test uploading images for our recipies
-# without having to setup a separate web server for serving these media files
+    # instrumentation metrics for Prometheus, see core/instrumentation.py
+    path('metrics/', core_views.metrics, name='metrics'),
+    # uploaded files, e.g. the recipe images
+    # > served by the dev server too so we can test uploading images
+    #   without having to setup a separate web server
+    # > in production the proxy sends them, see MEDIA_ACCEL_REDIRECT
+    path(
+        settings.MEDIA_URL.lstrip('/') + '<path:path>',
+        core_views.media,
+        name='media'
+    ),
+]
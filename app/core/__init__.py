@@ -0,0 +1,2 @@
+# use CoreConfig so that its ready() hook registers our signals
+default_app_config = 'core.apps.CoreConfig'
@@ -1,5 +1,20 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.signals import request_started
 
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        # register the model signal handlers
+        from core import signals  # noqa: F401
+
+        # fail at startup rather than serve stale cached lists
+        from core.versions import check_shared_cache
+        check_shared_cache()
+
+        # check the reused database connections before each request
+        if settings.DB_CONN_HEALTH_CHECKS:
+            from core.db.health import check_connections
+            request_started.connect(check_connections)
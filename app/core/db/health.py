@@ -0,0 +1,16 @@
+from django.db import connections
+
+
+def check_connections(**kwargs):
+    """Close the persistent connections that stopped working
+
+    Connected to request_started with DB_CONN_HEALTH_CHECKS=1, so a
+    connection dropped by the server (e.g. a restart or an idle
+    timeout) is replaced before the request uses it instead of
+    failing the request.
+    """
+    for conn in connections.all():
+        # is_usable() runs a 'SELECT 1' on PostgreSQL
+        if (conn.connection is not None and not conn.in_atomic_block
+                and not conn.is_usable()):
+            conn.close()
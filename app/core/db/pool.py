@@ -0,0 +1,66 @@
+import threading
+import time
+from collections import deque
+
+
+class ConnectionPool:
+    """Idle database connections kept for reuse by any thread
+
+    Connections are handed out most recently used first, so the ones
+    at the bottom of the pool stay idle and reach MAX_LIFETIME instead
+    of all of them being kept alive by a light load.
+    """
+
+    def __init__(self, max_size, max_lifetime):
+        self.max_size = max_size
+        self.max_lifetime = max_lifetime
+        self._idle = deque()
+        self._lock = threading.Lock()
+
+    def expired(self, created):
+        """Return if a connection opened at created is too old"""
+        return time.monotonic() - created > self.max_lifetime
+
+    def get(self, is_usable=None):
+        """Return an idle (connection, created) or (None, None)
+
+        Connections that are too old, or that is_usable() rejects,
+        are closed and skipped.
+        """
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None, None
+                connection, created = self._idle.pop()
+            if not self.expired(created) and (
+                    is_usable is None or is_usable(connection)):
+                return connection, created
+            self.close(connection)
+
+    def put(self, connection, created):
+        """Keep a connection for reuse, return False if it was not kept"""
+        if self.expired(created):
+            return False
+        with self._lock:
+            if len(self._idle) >= self.max_size:
+                return False
+            self._idle.append((connection, created))
+        return True
+
+    def clear(self):
+        """Close every idle connection"""
+        with self._lock:
+            idle, self._idle = self._idle, deque()
+        for connection, _created in idle:
+            self.close(connection)
+
+    def __len__(self):
+        return len(self._idle)
+
+    @staticmethod
+    def close(connection):
+        try:
+            connection.close()
+        except Exception:
+            # already broken, nothing left to release
+            pass
@@ -0,0 +1,66 @@
+from django.db.models import Count, Min
+from django.utils import timezone
+
+# the models whose names are unique per user, with their recipe relation
+UNIQUE_NAME_MODELS = (('Tag', 'tags'), ('Ingredient', 'ingredients'))
+
+
+def duplicate_groups(Model):
+    """Return the (user, name) of a model given more than once"""
+    return (
+        Model.objects.values('user_id', 'name')
+        .annotate(total=Count('id'), keep=Min('id'))
+        .filter(total__gt=1)
+    )
+
+
+def merge_duplicates(apps, model_name, relation):
+    """Merge the tags or ingredients a user has twice into the oldest
+
+    Takes the app registry so it also runs in migrations, and returns
+    the number of objects merged away.
+    """
+    Model = apps.get_model('core', model_name)
+    Recipe = apps.get_model('core', 'Recipe')
+    Tombstone = apps.get_model('core', 'Tombstone')
+    through = getattr(Recipe, relation).through
+    column = f'{model_name.lower()}_id'
+
+    merged = 0
+    for group in duplicate_groups(Model):
+        extra = list(
+            Model.objects.filter(user_id=group['user_id'], name=group['name'])
+            .exclude(id=group['keep']).values_list('id', flat=True)
+        )
+        # recipes using a duplicate use the kept one instead
+        affected = set(
+            through.objects.filter(**{f'{column}__in': extra})
+            .values_list('recipe_id', flat=True)
+        )
+        recipe_ids = affected - set(
+            through.objects.filter(**{column: group['keep']})
+            .values_list('recipe_id', flat=True)
+        )
+        through.objects.bulk_create([
+            through(recipe_id=recipe_id, **{column: group['keep']})
+            for recipe_id in recipe_ids
+        ])
+        through.objects.filter(**{f'{column}__in': extra}).delete()
+        Model.objects.filter(id__in=extra).delete()
+
+        # the signals of core.signals do not run in migrations
+        # > syncing clients learn about the removed duplicates from
+        #   their tombstones and refetch the recipes that used them
+        Tombstone.objects.bulk_create([
+            Tombstone(
+                user_id=group['user_id'],
+                model=model_name.lower(),
+                object_id=object_id,
+            )
+            for object_id in extra
+        ])
+        Recipe.objects.filter(id__in=affected).update(
+            updated_at=timezone.now()
+        )
+        merged += len(extra)
+    return merged
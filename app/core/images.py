@@ -0,0 +1,205 @@
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageOps, features
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+
+from core.models import Recipe, RecipeImageRendition
+from core.storage import lock_files, release_files
+from core.versions import bump_data_version
+
+
+logger = logging.getLogger(__name__)
+
+# renditions created for every uploaded image
+# > name of the size and the length of its longest edge in pixels
+RENDITION_SIZES = (
+    ('thumb', 150),
+    ('medium', 600),
+    ('full', 1600),
+)
+# > Pillow format name and file extension
+RENDITION_FORMATS = (
+    ('WEBP', 'webp'),
+    ('JPEG', 'jpg'),
+)
+RENDITION_QUALITY = 85
+
+# worker pool shared by the whole process, created on first use
+_executor = None
+
+
+def get_executor():
+    """Return the process wide image worker pool"""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_PROCESSING_WORKERS,
+            thread_name_prefix='recipe-image',
+        )
+    return _executor
+
+
+def enqueue_recipe_image(recipe):
+    """Queue the image of a recipe for processing"""
+    # the pending status is the durable queue entry, if this process
+    # dies before the task runs `manage.py process_images` picks it up
+    Recipe.objects.filter(pk=recipe.pk).update(
+        image_status=Recipe.IMAGE_PENDING
+    )
+    recipe.image_status = Recipe.IMAGE_PENDING
+
+    # hand over to the pool once the new image is committed
+    if settings.IMAGE_PROCESSING_ASYNC:
+        transaction.on_commit(
+            lambda: get_executor().submit(_run_task, recipe.pk)
+        )
+
+
+def _run_task(recipe_id):
+    """Process an image in a pool thread"""
+    try:
+        process_recipe_image(recipe_id)
+    finally:
+        # each thread has its own database connection, close it
+        # rather than leaving it open until the thread exits
+        connection.close()
+
+
+def claim_recipe_image(recipe_id):
+    """Mark a pending image as processing, return False if not pending"""
+    # a single conditional UPDATE so that two workers
+    # can never process the same image
+    return bool(Recipe.objects.filter(
+        pk=recipe_id,
+        image_status=Recipe.IMAGE_PENDING,
+    ).update(image_status=Recipe.IMAGE_PROCESSING))
+
+
+def rendition_name(image_name, size, extension):
+    """Return the storage name of a rendition of an image"""
+    # e.g. uploads/recipe/<name>.jpg => uploads/recipe/<name>_thumb.webp
+    stem = os.path.splitext(image_name)[0]
+    return f'{stem}_{size}.{extension}'
+
+
+def rendition_formats():
+    """Return the rendition formats supported by the installed Pillow"""
+    return [
+        (fmt, extension) for fmt, extension in RENDITION_FORMATS
+        if fmt != 'WEBP' or features.check('webp')
+    ]
+
+
+def load_image(field_file):
+    """Decode an uploaded image, upright and in RGB"""
+    with field_file.open('rb') as image_file:
+        image = Image.open(image_file)
+        # let JPEG decode at a reduced scale when the original
+        # is much larger than our biggest rendition
+        largest = RENDITION_SIZES[-1][1]
+        image.draft('RGB', (largest, largest))
+        image.load()
+    # apply the camera orientation before the exif is dropped
+    image = ImageOps.exif_transpose(image)
+    return image.convert('RGB')
+
+
+def render_image(image, edge, fmt):
+    """Return a resized copy of image encoded as fmt"""
+    copy = image.copy()
+    # thumbnail() keeps the aspect ratio and never upscales
+    copy.thumbnail((edge, edge), Image.LANCZOS)
+    buffer = io.BytesIO()
+    # no exif= argument is passed so the metadata is stripped
+    copy.save(buffer, format=fmt, quality=RENDITION_QUALITY)
+    return copy.size, buffer.getvalue()
+
+
+def create_renditions(recipe, storage, saved):
+    """Render or reuse the renditions of a recipe image, unsaved
+
+    The names of the files written are added to saved.
+    """
+    image = None
+    renditions = []
+    for size, edge in RENDITION_SIZES:
+        for fmt, extension in rendition_formats():
+            name = rendition_name(recipe.image.name, size, extension)
+            if storage.exists(name):
+                # images are stored by content so another recipe
+                # with the same image already rendered this one
+                # > the rendition name is derived from the original
+                with Image.open(storage.path(name)) as rendered:
+                    width, height = rendered.size
+            else:
+                # decode the original once, only if it is needed
+                if image is None:
+                    image = load_image(recipe.image)
+                (width, height), content = render_image(image, edge, fmt)
+                name = storage.save(name, ContentFile(content))
+                saved.append(name)
+            renditions.append(RecipeImageRendition(
+                recipe=recipe,
+                size=size,
+                format=extension,
+                file=name,
+                width=width,
+                height=height,
+            ))
+    return renditions
+
+
+def process_recipe_image(recipe_id):
+    """Create the resized renditions of a recipe image"""
+    if not claim_recipe_image(recipe_id):
+        return
+
+    recipe = Recipe.objects.get(pk=recipe_id)
+    storage = RecipeImageRendition._meta.get_field('file').storage
+    saved = []
+    finished = False
+    try:
+        with transaction.atomic():
+            # a reused rendition file can not be released by another
+            # recipe before the renditions pointing at it are committed
+            lock_files(
+                rendition_name(recipe.image.name, size, extension)
+                for size, _edge in RENDITION_SIZES
+                for _fmt, extension in rendition_formats()
+            )
+            renditions = create_renditions(recipe, storage, saved)
+
+            # if a new image was uploaded while we were busy it is
+            # pending again and its own task will create its renditions
+            finished = Recipe.objects.filter(
+                pk=recipe_id,
+                image=recipe.image.name,
+                image_status=Recipe.IMAGE_PROCESSING,
+            ).update(image_status=Recipe.IMAGE_READY)
+            if not finished:
+                return
+
+            # renditions of the previous image are replaced
+            # > deleting them releases their files (see core.signals)
+            #   which are removed unless other recipes still use them
+            recipe.image_renditions.all().delete()
+            RecipeImageRendition.objects.bulk_create(renditions)
+            # the status was changed with update(), which sends no signal
+            bump_data_version(recipe.user_id)
+    except Exception:
+        logger.exception('Processing image of recipe %s failed', recipe_id)
+        Recipe.objects.filter(pk=recipe_id).update(
+            image_status=Recipe.IMAGE_FAILED
+        )
+
+    if not finished:
+        # the files written for renditions that were not kept
+        # > released rather than deleted as another recipe with the
+        #   same image may have started using them meanwhile
+        release_files(storage, saved)
@@ -0,0 +1,428 @@
+import contextvars
+import json
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+
+
+logger = logging.getLogger(__name__)
+
+# Opt-in per request profiling, see InstrumentationMiddleware
+# > a sampled request records its wall time, its database queries,
+#   the time spent in serializers and in rendering the response
+# > the numbers are sent back in a Server-Timing header and added up
+#   per view in `registry`, exposed to Prometheus by ../metrics/
+# > with INSTRUMENTATION_METRICS_DIR set, every process writes its
+#   totals to a file of that directory and ../metrics/ adds up the
+#   files, so all the gunicorn workers are counted whichever answers
+
+# upper bounds of the request duration histogram, in seconds
+DURATION_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+# prefix of the exported metric names
+METRIC_PREFIX = 'recipe_api'
+
+# metrics of the request being handled, in this thread
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+
+class RequestMetrics:
+    """What was measured while handling one request"""
+
+    def __init__(self):
+        self.view = 'unresolved'
+        self.duration = 0.0
+        self.queries = []
+        # seconds per phase, e.g. 'serializer' or 'render'
+        self.phases = Counter()
+        self._active = set()
+
+    def record_query(self, execute, sql, params, many, context):
+        """Time a query, used as a database execute wrapper"""
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append((sql, time.perf_counter() - start))
+
+    @property
+    def db_duration(self):
+        return sum(duration for _sql, duration in self.queries)
+
+    def repeated_queries(self):
+        """Return how many times each query ran, if more than once"""
+        # the same SQL with different parameters, e.g. the query of
+        # a relation run again for each object of a list
+        counts = Counter(sql for sql, _duration in self.queries)
+        return {sql: count for sql, count in counts.items() if count > 1}
+
+    @property
+    def duplicate_queries(self):
+        return sum(count - 1 for count in self.repeated_queries().values())
+
+    def server_timing(self):
+        """Return the value of the Server-Timing header"""
+        entries = [
+            f'total;dur={self.duration * 1000:.2f}',
+            f'db;dur={self.db_duration * 1000:.2f};'
+            f'desc="{len(self.queries)} queries, '
+            f'{self.duplicate_queries} duplicates"',
+        ]
+        for phase in ('serializer', 'render'):
+            entries.append(f'{phase};dur={self.phases[phase] * 1000:.2f}')
+        return ', '.join(entries)
+
+
+@contextmanager
+def measure(phase):
+    """Add the time spent in the block to a phase of the request
+
+    Does nothing outside of a sampled request, and a phase nested in
+    the same phase (e.g. a serializer rendering another one) is only
+    counted once.
+    """
+    metrics = _current.get()
+    if metrics is None or phase in metrics._active:
+        yield
+        return
+    metrics._active.add(phase)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.phases[phase] += time.perf_counter() - start
+        metrics._active.discard(phase)
+
+
+_serializer_timing_installed = False
+
+
+def install_serializer_timing():
+    """Time the serializers of sampled requests
+
+    Wraps the .data property of every DRF serializer, that is where
+    the objects of a response are serialized.
+    """
+    global _serializer_timing_installed
+    if _serializer_timing_installed:
+        return
+    from rest_framework.serializers import BaseSerializer
+
+    data = BaseSerializer.data
+
+    def timed_data(self):
+        with measure('serializer'):
+            return data.fget(self)
+
+    BaseSerializer.data = property(timed_data)
+    _serializer_timing_installed = True
+
+
+def view_name(view_func, method):
+    """Return a label like 'RecipeViewSet.list' for a view"""
+    cls = getattr(view_func, 'cls', None)
+    if cls is None:
+        return f'{view_func.__module__}.{view_func.__name__}'
+    # viewsets map each HTTP method to an action
+    actions = getattr(view_func, 'actions', None) or {}
+    return f'{cls.__name__}.{actions.get(method, method)}'
+
+
+def escape_label(value):
+    """Escape a Prometheus label value"""
+    return (
+        str(value).replace('\\', r'\\').replace('"', r'\"')
+        .replace('\n', r'\n')
+    )
+
+
+def view_totals():
+    """Return the totals of a view with no request yet"""
+    return {
+        'buckets': [0] * len(DURATION_BUCKETS),
+        'count': 0,
+        'duration': 0.0,
+        'queries': 0,
+        'db_duration': 0.0,
+        'duplicate_queries': 0,
+        'serializer': 0.0,
+        'render': 0.0,
+    }
+
+
+def process_alive(pid):
+    """Return True if a process with this pid is running"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class MetricsRegistry:
+    """Totals of the sampled requests, per view"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (name, kind, description, func) of the values read from
+        # other parts of the app, e.g. the token cache counters
+        self._sources = []
+        # file of this process in INSTRUMENTATION_METRICS_DIR
+        self._file_pid = None
+        self._file_name = None
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._views = {}
+            self._statuses = Counter()
+
+    def add_source(self, name, kind, description, func):
+        """Export the value returned by func, a counter or a gauge"""
+        self._sources.append((name, kind, description, func))
+
+    def observe(self, metrics, status):
+        """Add the metrics of a request"""
+        with self._lock:
+            totals = self._views.get(metrics.view)
+            if totals is None:
+                totals = self._views[metrics.view] = view_totals()
+            for index, bound in enumerate(DURATION_BUCKETS):
+                if metrics.duration <= bound:
+                    totals['buckets'][index] += 1
+            totals['count'] += 1
+            totals['duration'] += metrics.duration
+            totals['queries'] += len(metrics.queries)
+            totals['db_duration'] += metrics.db_duration
+            totals['duplicate_queries'] += metrics.duplicate_queries
+            totals['serializer'] += metrics.phases['serializer']
+            totals['render'] += metrics.phases['render']
+            self._statuses[metrics.view, status] += 1
+        self.save()
+
+    def snapshot(self):
+        """Return the totals of this process"""
+        with self._lock:
+            views = {
+                view: dict(totals, buckets=list(totals['buckets']))
+                for view, totals in self._views.items()
+            }
+            statuses = [
+                [view, status, count]
+                for (view, status), count in self._statuses.items()
+            ]
+        return {
+            'pid': os.getpid(),
+            'views': views,
+            'statuses': statuses,
+            'values': {
+                name: func() for name, _kind, _help, func in self._sources
+            },
+        }
+
+    def file_path(self, directory):
+        """Return the file of this process in directory"""
+        # a new name after a fork, or when a pid is reused, so that
+        # no process ever takes over the counters of another one
+        if self._file_pid != os.getpid():
+            self._file_pid = os.getpid()
+            self._file_name = f'{self._file_pid}-{uuid.uuid4().hex}.json'
+        return os.path.join(directory, self._file_name)
+
+    def save(self):
+        """Write the totals of this process for the other processes"""
+        directory = settings.INSTRUMENTATION_METRICS_DIR
+        if not directory:
+            return
+        os.makedirs(directory, exist_ok=True)
+        path = self.file_path(directory)
+        # written aside then renamed, a reader never sees half a file
+        staging = f'{path}.{threading.get_ident()}.tmp'
+        with open(staging, 'w') as staged:
+            json.dump(self.snapshot(), staged)
+        os.replace(staging, path)
+
+    def snapshots(self):
+        """Return the totals of every process"""
+        directory = settings.INSTRUMENTATION_METRICS_DIR
+        if not directory:
+            return [self.snapshot()]
+
+        self.save()
+        snapshots = []
+        for filename in os.listdir(directory):
+            if not filename.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(directory, filename)) as saved:
+                    snapshots.append(json.load(saved))
+            except (OSError, ValueError):
+                # removed meanwhile, e.g. by a restart
+                continue
+        return snapshots
+
+    def collect(self):
+        """Return the totals added up over every process"""
+        views = {}
+        statuses = Counter()
+        values = Counter()
+        for snapshot in self.snapshots():
+            # the counters of a worker that exited still count, they
+            # must never go down, its gauges are no longer current
+            alive = process_alive(snapshot['pid'])
+            for view, totals in snapshot['views'].items():
+                merged = views.setdefault(view, view_totals())
+                for key, value in totals.items():
+                    if key == 'buckets':
+                        merged[key] = [
+                            a + b for a, b in zip(merged[key], value)
+                        ]
+                    else:
+                        merged[key] += value
+            for view, status, count in snapshot['statuses']:
+                statuses[view, status] += count
+            for name, kind, _help, _func in self._sources:
+                if kind == 'counter' or alive:
+                    values[name] += snapshot['values'].get(name, 0)
+        return views, statuses, values
+
+    def render(self, extra=()):
+        """Return the metrics in the Prometheus text format
+
+        extra are more (name, type, help, value) samples to export.
+        """
+        views, statuses, values = self.collect()
+        lines = []
+
+        def header(name, kind, description):
+            lines.append(f'# HELP {METRIC_PREFIX}_{name} {description}')
+            lines.append(f'# TYPE {METRIC_PREFIX}_{name} {kind}')
+
+        header('requests_total', 'counter', 'Sampled requests.')
+        for (view, status), count in sorted(statuses.items()):
+            lines.append(
+                f'{METRIC_PREFIX}_requests_total{{view="{escape_label(view)}"'
+                f',status="{status}"}} {count}'
+            )
+
+        header('request_duration_seconds', 'histogram',
+               'Wall time of the sampled requests.')
+        for view, totals in sorted(views.items()):
+            label = f'view="{escape_label(view)}"'
+            name = f'{METRIC_PREFIX}_request_duration_seconds'
+            for bound, count in zip(DURATION_BUCKETS, totals['buckets']):
+                lines.append(f'{name}_bucket{{{label},le="{bound}"}} {count}')
+            lines.append(
+                f'{name}_bucket{{{label},le="+Inf"}} {totals["count"]}'
+            )
+            lines.append(f'{name}_sum{{{label}}} {totals["duration"]}')
+            lines.append(f'{name}_count{{{label}}} {totals["count"]}')
+
+        for key, name, description in (
+            ('queries', 'db_queries_total', 'Database queries.'),
+            ('db_duration', 'db_duration_seconds_total',
+             'Time spent in database queries.'),
+            ('duplicate_queries', 'duplicate_queries_total',
+             'Queries repeating an earlier query of the same request.'),
+            ('serializer', 'serializer_duration_seconds_total',
+             'Time spent in serializers.'),
+            ('render', 'render_duration_seconds_total',
+             'Time spent rendering responses.'),
+        ):
+            header(name, 'counter', description)
+            for view, totals in sorted(views.items()):
+                lines.append(
+                    f'{METRIC_PREFIX}_{name}{{view="{escape_label(view)}"}} '
+                    f'{totals[key]}'
+                )
+
+        for name, kind, description, _func in self._sources:
+            header(name, kind, description)
+            lines.append(f'{METRIC_PREFIX}_{name} {values[name]}')
+        for name, kind, description, value in extra:
+            header(name, kind, description)
+            lines.append(f'{METRIC_PREFIX}_{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+class InstrumentationMiddleware:
+    """Profile a sample of the requests
+
+    Turned on with INSTRUMENTATION_ENABLED=1, a request is sampled
+    with a probability of INSTRUMENTATION_SAMPLE_RATE. Requests that
+    are not sampled only cost a random number.
+    """
+
+    def __init__(self, get_response):
+        if not settings.INSTRUMENTATION_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        install_serializer_timing()
+
+    def __call__(self, request):
+        if random.random() >= settings.INSTRUMENTATION_SAMPLE_RATE:
+            return self.get_response(request)
+
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        start = time.perf_counter()
+        try:
+            # every query of this thread goes through the wrapper
+            with ExitStack() as stack:
+                for conn in connections.all():
+                    stack.enter_context(
+                        conn.execute_wrapper(metrics.record_query)
+                    )
+                response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        metrics.duration = time.perf_counter() - start
+
+        registry.observe(metrics, response.status_code)
+        self.warn_repeated_queries(metrics)
+        if settings.INSTRUMENTATION_SERVER_TIMING:
+            response['Server-Timing'] = metrics.server_timing()
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.view = view_name(view_func, request.method.lower())
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered after the middleware has run
+        # > timed from here to the end of their rendering
+        metrics = _current.get()
+        if metrics is not None:
+            start = time.perf_counter()
+
+            def rendered(response):
+                metrics.phases['render'] += time.perf_counter() - start
+
+            response.add_post_render_callback(rendered)
+        return response
+
+    def warn_repeated_queries(self, metrics):
+        """Log the queries run too many times by one request"""
+        limit = settings.INSTRUMENTATION_REPEATED_QUERY_LIMIT
+        for sql, count in metrics.repeated_queries().items():
+            if count >= limit:
+                logger.warning(
+                    '%s ran the same query %d times: %s',
+                    metrics.view, count, sql[:500]
+                )
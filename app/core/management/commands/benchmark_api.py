@@ -0,0 +1,365 @@
+import io
+import json
+import random
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.models import Tag, Ingredient, Recipe
+from core.search import refresh_search_vectors
+
+
+SCENARIOS = ('list', 'detail', 'filter', 'create', 'upload_image')
+
+# measures compared with a baseline, and if higher is better
+COMPARED = (
+    ('p95_ms', False),
+    ('queries_per_request', False),
+    ('throughput_rps', True),
+)
+
+# marks the users created by the benchmark
+EMAIL_PREFIX = 'benchmark-api-'
+
+
+def percentile(values, p):
+    """Return the nearest-rank percentile of sorted values"""
+    if not values:
+        return None
+    rank = max(1, -(-len(values) * p // 100))
+    return values[rank - 1]
+
+
+def summarize(samples, elapsed):
+    """Return the report of a scenario from its (ms, queries, status)"""
+    times = sorted(sample[0] for sample in samples)
+    queries = [sample[1] for sample in samples]
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for sample in samples if sample[2] >= 400),
+        'p50_ms': round(percentile(times, 50), 2),
+        'p95_ms': round(percentile(times, 95), 2),
+        'p99_ms': round(percentile(times, 99), 2),
+        'mean_ms': round(statistics.mean(times), 2),
+        'queries_per_request': round(statistics.mean(queries), 2),
+        'max_queries': max(queries),
+        'throughput_rps': round(len(samples) / elapsed, 1),
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Return the measures of a report worse than the baseline"""
+    regressions = []
+    for name, result in report['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if base is None:
+            continue
+        for measure, higher_is_better in COMPARED:
+            value, reference = result[measure], base.get(measure)
+            if reference is None:
+                continue
+            if measure == 'queries_per_request':
+                # queries are not noisy, any extra query is a regression
+                worse = value > reference
+            elif higher_is_better:
+                worse = value < reference * (1 - tolerance)
+            else:
+                worse = value > reference * (1 + tolerance)
+            if worse:
+                regressions.append(
+                    f'{name} {measure}: {value} (baseline {reference})'
+                )
+    return regressions
+
+
+class Command(BaseCommand):
+    """Django command load testing the recipe API in-process
+    """
+    help = ('Seed synthetic users, tags, ingredients and recipes, '
+            'drive the recipe endpoints concurrently and report latency '
+            'percentiles, queries per request and throughput as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users', type=int, default=10,
+            help='Synthetic users making the requests',
+        )
+        parser.add_argument(
+            '--recipes', type=int, default=200,
+            help='Recipes per user',
+        )
+        parser.add_argument(
+            '--tags', type=int, default=20,
+            help='Tags per user',
+        )
+        parser.add_argument(
+            '--ingredients', type=int, default=40,
+            help='Ingredients per user',
+        )
+        parser.add_argument(
+            '--requests', type=int, default=200,
+            help='Requests per scenario',
+        )
+        parser.add_argument(
+            '--concurrency', type=int, default=4,
+            help='Threads sending requests at the same time',
+        )
+        parser.add_argument(
+            '--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS,
+            help='Endpoints to drive',
+        )
+        parser.add_argument(
+            '--no-cache', action='store_true',
+            help='Do not serve lists from the list cache',
+        )
+        parser.add_argument(
+            '--seed', type=int, default=0,
+            help='Seed of the random requests, runs with the same seed '
+                 'send the same requests',
+        )
+        parser.add_argument(
+            '--output',
+            help='Write the report to this file instead of stdout',
+        )
+        parser.add_argument(
+            '--baseline',
+            help='Report of a previous run, fail if this run is worse',
+        )
+        parser.add_argument(
+            '--tolerance', type=float, default=0.2,
+            help='Allowed slowdown against the baseline, e.g. 0.2 = 20%%',
+        )
+        parser.add_argument(
+            '--keep', action='store_true',
+            help='Keep the seeded data instead of deleting it',
+        )
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as baseline_file:
+                baseline = json.load(baseline_file)
+
+        self.random = random.Random(options['seed'])
+        overrides = {
+            # requests are made with the test client
+            'ALLOWED_HOSTS': [*settings.ALLOWED_HOSTS, 'testserver'],
+            # uploaded images stay pending instead of being processed
+            # by the pool while the other requests are timed
+            'IMAGE_PROCESSING_ASYNC': False,
+        }
+        if options['no_cache']:
+            overrides['CACHES'] = {**settings.CACHES, 'benchmark': {
+                'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
+            }}
+            overrides['LIST_CACHE_ALIAS'] = 'benchmark'
+
+        users = self.seed(options)
+        try:
+            with override_settings(**overrides):
+                report = self.run(users, options)
+        finally:
+            if not options['keep']:
+                get_user_model().objects.filter(
+                    pk__in=[user['user'].pk for user in users]
+                ).delete()
+
+        output = json.dumps(report, indent=2) + '\n'
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(output)
+        else:
+            self.stdout.write(output, ending='')
+
+        if baseline is not None:
+            regressions = compare(report, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError(
+                    'Slower than the baseline:\n' + '\n'.join(regressions)
+                )
+
+    def seed(self, options):
+        """Create the users and their data, return them with ids"""
+        run = uuid.uuid4().hex[:8]
+        users = []
+        for index in range(options['users']):
+            user = get_user_model().objects.create_user(
+                f'{EMAIL_PREFIX}{run}-{index}@example.com'
+            )
+            Tag.objects.bulk_create(
+                Tag(user=user, name=f'Tag {i}')
+                for i in range(options['tags'])
+            )
+            Ingredient.objects.bulk_create(
+                Ingredient(user=user, name=f'Ingredient {i}')
+                for i in range(options['ingredients'])
+            )
+            Recipe.objects.bulk_create(
+                Recipe(
+                    user=user,
+                    title=f'Recipe {i}',
+                    time_minutes=i % 120,
+                    price=Decimal(i % 10000) / 100,
+                )
+                for i in range(options['recipes'])
+            )
+
+            # the ids are read back as sqlite does not return them
+            tag_ids = list(Tag.objects.filter(user=user).values_list(
+                'id', flat=True))
+            ingredient_ids = list(Ingredient.objects.filter(
+                user=user).values_list('id', flat=True))
+            recipe_ids = list(Recipe.objects.filter(user=user).values_list(
+                'id', flat=True))
+            Recipe.tags.through.objects.bulk_create(
+                Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+                for recipe_id in recipe_ids
+                for tag_id in tag_ids[recipe_id % 7:][:3]
+            )
+            Recipe.ingredients.through.objects.bulk_create(
+                Recipe.ingredients.through(
+                    recipe_id=recipe_id, ingredient_id=ingredient_id
+                )
+                for recipe_id in recipe_ids
+                for ingredient_id in ingredient_ids[recipe_id % 11:][:5]
+            )
+            # bulk writes send no signals
+            refresh_search_vectors(recipe_ids)
+
+            users.append({
+                'user': user,
+                'token': Token.objects.create(user=user).key,
+                'tags': tag_ids,
+                'ingredients': ingredient_ids,
+                'recipes': recipe_ids,
+            })
+        return users
+
+    def run(self, users, options):
+        """Drive each scenario and return the report"""
+        image = io.BytesIO()
+        Image.new('RGB', (64, 64), 'orange').save(image, format='JPEG')
+        self.image = image.getvalue()
+
+        report = {
+            'settings': {
+                name: options[name] for name in (
+                    'users', 'recipes', 'tags', 'ingredients',
+                    'requests', 'concurrency', 'no_cache', 'seed',
+                )
+            },
+            'database': connection.vendor,
+            'scenarios': {},
+        }
+        for scenario in options['scenarios']:
+            build = getattr(self, f'request_{scenario}')
+            requests = [
+                build(self.random.choice(users))
+                for _request in range(options['requests'])
+            ]
+            # one untimed request so that first use costs (url
+            # resolution, serializer fields...) are not measured
+            self.send(requests[0])
+
+            start = time.perf_counter()
+            if options['concurrency'] > 1:
+                with ThreadPoolExecutor(options['concurrency']) as pool:
+                    samples = list(pool.map(self.send_in_thread, requests))
+            else:
+                samples = [self.send(request) for request in requests]
+            elapsed = time.perf_counter() - start
+
+            report['scenarios'][scenario] = summarize(samples, elapsed)
+            self.stderr.write(
+                f'{scenario}: '
+                f'p95 {report["scenarios"][scenario]["p95_ms"]}ms'
+            )
+        return report
+
+    def send(self, request):
+        """Send a request, return its time in ms, queries and status"""
+        token, method, url, data, kwargs = request
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        if callable(data):
+            data = data()
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            response = getattr(client, method)(url, data, **kwargs)
+            # streamed responses are only produced while read
+            if response.streaming:
+                b''.join(response.streaming_content)
+            elapsed = time.perf_counter() - start
+        return elapsed * 1000, len(queries), response.status_code
+
+    def send_in_thread(self, request):
+        """Send a request from a pool thread"""
+        try:
+            return self.send(request)
+        finally:
+            # each thread has its own database connection
+            connection.close()
+
+    # each request_<scenario>() returns the request a scenario sends
+    # as (token, method, url, data, client kwargs)
+
+    def request_list(self, user):
+        """List all the recipes of the user"""
+        return (user['token'], 'get', reverse('recipe:recipe-list'),
+                None, {})
+
+    def request_detail(self, user):
+        """Get one recipe with its tags and ingredients"""
+        recipe_id = self.random.choice(user['recipes'])
+        return (user['token'], 'get',
+                reverse('recipe:recipe-detail', args=[recipe_id]), None, {})
+
+    def request_filter(self, user):
+        """List the recipes with two tags or an ingredient"""
+        tags = self.random.sample(user['tags'], min(2, len(user['tags'])))
+        ingredient = self.random.choice(user['ingredients'])
+        return (user['token'], 'get', reverse('recipe:recipe-list'), {
+            'tags': ','.join(map(str, tags)),
+            'ingredients': str(ingredient),
+        }, {})
+
+    def request_create(self, user):
+        """Create a recipe with tags and ingredients"""
+        return (user['token'], 'post', reverse('recipe:recipe-list'), {
+            'title': f'Benchmark {uuid.uuid4().hex[:8]}',
+            'time_minutes': self.random.randint(1, 180),
+            'price': f'{self.random.randint(100, 5000) / 100:.2f}',
+            'tags': self.random.sample(
+                user['tags'], min(2, len(user['tags']))
+            ),
+            'ingredients': self.random.sample(
+                user['ingredients'], min(3, len(user['ingredients']))
+            ),
+        }, {'format': 'json'})
+
+    def request_upload_image(self, user):
+        """Upload a small image to a recipe"""
+        recipe_id = self.random.choice(user['recipes'])
+
+        def data():
+            # a new file for every request, uploads are read once
+            return {'image': SimpleUploadedFile(
+                'benchmark.jpg', self.image, content_type='image/jpeg'
+            )}
+        return (user['token'], 'post',
+                reverse('recipe:recipe-upload-image', args=[recipe_id]),
+                data, {'format': 'multipart'})
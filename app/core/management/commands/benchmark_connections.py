@@ -0,0 +1,79 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.signals import request_finished, request_started
+from django.db import connections
+
+from core.management.commands.benchmark_api import percentile
+
+
+# (label, CONN_MAX_AGE) of the connection handling compared
+MODES = (
+    ('per request', 0),
+    ('persistent', None),
+)
+
+
+class Command(BaseCommand):
+    """Django command timing requests with and without connection reuse
+    """
+    help = ('Time the database work of simulated requests when each '
+            'request opens its own connection and when connections are '
+            'kept open, see DB_CONN_MAX_AGE and DB_POOL_SIZE')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--requests', type=int, default=200,
+            help='Requests simulated per mode',
+        )
+        parser.add_argument(
+            '--database', default='default',
+            help='Database alias to connect to',
+        )
+
+    def handle(self, *args, **options):
+        conn = connections[options['database']]
+        max_age = conn.settings_dict['CONN_MAX_AGE']
+        self.stdout.write(f'engine: {conn.settings_dict["ENGINE"]}')
+        self.stdout.write(f'{"mode":>12} {"p50":>9} {"p95":>9} {"mean":>9}')
+
+        results = {}
+        try:
+            for label, mode_max_age in MODES:
+                # takes effect on the next connection
+                conn.settings_dict['CONN_MAX_AGE'] = mode_max_age
+                conn.close()
+                times = sorted(
+                    self.request(conn) for _request in range(
+                        options['requests']
+                    )
+                )
+                results[label] = times
+                self.stdout.write(
+                    f'{label:>12} '
+                    f'{percentile(times, 50):>7.3f}ms '
+                    f'{percentile(times, 95):>7.3f}ms '
+                    f'{statistics.mean(times):>7.3f}ms'
+                )
+        finally:
+            conn.settings_dict['CONN_MAX_AGE'] = max_age
+            conn.close()
+
+        saving = (
+            statistics.mean(results['per request']) -
+            statistics.mean(results['persistent'])
+        )
+        self.stdout.write(f'saved per request: {saving:.3f}ms')
+
+    def request(self, conn):
+        """Simulate a request running one query, return its time in ms"""
+        start = time.perf_counter()
+        # the signals Django sends around each request close the
+        # connections that are not to be kept, as in a real request
+        request_started.send(sender=self.__class__)
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            cursor.fetchone()
+        request_finished.send(sender=self.__class__)
+        return (time.perf_counter() - start) * 1000
@@ -0,0 +1,166 @@
+import re
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+
+from core.models import Tag, Ingredient, Recipe
+
+
+# a node sorting rows in the plan, e.g. '->  Sort  (cost=...'
+# > 'Sort Key:' lines only describe such a node
+SORT_NODE = re.compile(r'\bSort\s+\(cost')
+
+# fills a table with rows spread evenly over the benchmark users
+INSERT_SQL = {
+    Tag: (
+        "INSERT INTO core_tag (name, user_id, created_at, updated_at) "
+        "SELECT 'tag ' || g, (%(users)s::int[])[1 + g %% %(count)s], "
+        "now(), now() FROM generate_series(1, %(rows)s) g"
+    ),
+    Ingredient: (
+        "INSERT INTO core_ingredient (name, user_id, created_at, updated_at) "
+        "SELECT 'ingredient ' || g, "
+        "(%(users)s::int[])[1 + g %% %(count)s], "
+        "now(), now() FROM generate_series(1, %(rows)s) g"
+    ),
+    Recipe: (
+        "INSERT INTO core_recipe (title, time_minutes, price, link, "
+        "image_status, user_id, created_at, updated_at) "
+        "SELECT 'recipe ' || g, 10, 5.00, '', '', "
+        "(%(users)s::int[])[1 + g %% %(count)s], "
+        "now(), now() FROM generate_series(1, %(rows)s) g"
+    ),
+}
+
+# links the n-th generated recipe to the n-th generated tag and
+# ingredient, which belong to the same user
+# > the list views count the recipes of each tag through these tables
+RELATION_SQL = [
+    (
+        f"INSERT INTO core_recipe_{relation}s (recipe_id, {relation}_id) "
+        "SELECT r.id, a.id FROM ("
+        "SELECT id, row_number() OVER (ORDER BY id) n FROM core_recipe "
+        "WHERE user_id = ANY(%(users)s)"
+        ") r JOIN ("
+        f"SELECT id, row_number() OVER (ORDER BY id) n FROM core_{relation} "
+        "WHERE user_id = ANY(%(users)s)"
+        ") a USING (n)"
+    )
+    for relation in ('tag', 'ingredient')
+]
+
+
+def attr_list(model, user_id):
+    """Return the query of the tag or ingredient list view"""
+    # same as BaseRecipeAttrViewSet.get_queryset
+    return model.objects.filter(user_id=user_id).annotate(
+        recipe_count=Count('recipe')
+    ).order_by('-name')
+
+
+class Command(BaseCommand):
+    """Django command to check the list queries are served by indexes
+    """
+    help = ('Fill the database with generated rows and EXPLAIN the '
+            'queries of the list views, PostgreSQL only')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--rows', type=int, default=10000000,
+            help='Rows generated in each of the recipe, tag and '
+                 'ingredient tables',
+        )
+        parser.add_argument(
+            '--users', type=int, default=10000,
+            help='Users the generated rows are spread over',
+        )
+        parser.add_argument(
+            '--keep', action='store_true',
+            help='Keep the generated rows instead of rolling back',
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('benchmark_indexes needs PostgreSQL')
+
+        failures = []
+        # everything is generated in one transaction
+        # which is rolled back at the end unless --keep is given
+        with transaction.atomic():
+            user_ids = self.generate(options['rows'], options['users'])
+            # a user in the middle of the table, not the first or last
+            user_id = user_ids[len(user_ids) // 2]
+
+            # the queries of the list views and of their first page
+            # > the tag and ingredient lists are grouped to count their
+            #   recipes, so only the user's own rows are sorted after
+            #   the GROUP BY, the recipe lists must come in index order
+            queries = {
+                'tag list': (attr_list(Tag, user_id), False),
+                'tag page': (attr_list(Tag, user_id)[:100], False),
+                'ingredient list': (attr_list(Ingredient, user_id), False),
+                'recipe list': (Recipe.objects.filter(
+                    user_id=user_id).order_by('-id'), True),
+                'recipe page': (Recipe.objects.filter(
+                    user_id=user_id).order_by('-id')[:100], True),
+            }
+            for name, (queryset, ordered) in queries.items():
+                plan = queryset.explain(analyze=True, buffers=True)
+                self.stdout.write(f'\n{name}\n{plan}')
+
+                # served by an index when it neither reads a
+                # whole table nor sorts the rows afterwards
+                if 'Seq Scan' in plan or (
+                        ordered and SORT_NODE.search(plan)):
+                    failures.append(name)
+
+            if not options['keep']:
+                transaction.set_rollback(True)
+
+        if failures:
+            raise CommandError(
+                'Not served by an index scan: ' + ', '.join(failures)
+            )
+        self.stdout.write(self.style.SUCCESS(
+            '\nAll list queries are served by index scans'
+        ))
+
+    def generate(self, rows, users):
+        """Create the benchmark users and their rows"""
+        start = time.monotonic()
+        run = uuid.uuid4().hex[:8]
+        # PostgreSQL returns the ids from bulk_create
+        user_ids = [
+            user.pk for user in get_user_model().objects.bulk_create(
+                get_user_model()(
+                    email=f'benchmark-{run}-{i}@example.com',
+                    password='!',
+                )
+                for i in range(users)
+            )
+        ]
+
+        with connection.cursor() as cursor:
+            for model, sql in INSERT_SQL.items():
+                cursor.execute(sql, {
+                    'users': user_ids,
+                    'count': users,
+                    'rows': rows,
+                })
+            for sql in RELATION_SQL:
+                cursor.execute(sql, {'users': user_ids})
+            # fresh statistics so the planner knows the table sizes
+            cursor.execute(
+                'ANALYZE core_tag, core_ingredient, core_recipe, '
+                'core_recipe_tags, core_recipe_ingredients'
+            )
+
+        self.stdout.write(
+            f'Generated {rows} rows per table for {users} users '
+            f'in {time.monotonic() - start:.1f}s'
+        )
+        return user_ids
@@ -0,0 +1,120 @@
+import time
+import uuid
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from rest_framework.renderers import JSONRenderer
+
+from core.models import Tag, Ingredient, Recipe
+from recipe.fastlist import FastListSerializer
+from recipe.serializers import RecipeSerializer
+from recipe.views import RecipeViewSet
+
+
+class Command(BaseCommand):
+    """Django command comparing the fast list path with the serializers
+    """
+    help = ('Time rendering recipe lists with RecipeSerializer and with '
+            'FastListSerializer, and check they give the same JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--items', type=int, nargs='+', default=[1000, 10000],
+            help='List sizes to time',
+        )
+        parser.add_argument(
+            '--repeat', type=int, default=5,
+            help='Runs per list size, the best one is reported',
+        )
+
+    def handle(self, *args, **options):
+        renderer = JSONRenderer()
+        # the generated rows are rolled back at the end
+        with transaction.atomic():
+            user = self.generate(max(options['items']))
+            queryset = Recipe.objects.filter(user=user).order_by('-id')
+            fast = FastListSerializer(RecipeSerializer)
+
+            self.stdout.write(
+                f'{"items":>8} {"serializer":>12} {"fast":>10} {"speedup":>8}'
+            )
+            for items in options['items']:
+                def slow_path():
+                    recipes = queryset.prefetch_related(
+                        *RecipeViewSet.action_prefetches['list']
+                    )[:items]
+                    data = RecipeSerializer(recipes, many=True).data
+                    return renderer.render(data)
+
+                def fast_path():
+                    rows = list(queryset.values(*fast.columns)[:items])
+                    return renderer.render(fast.to_representation(rows))
+
+                slow_time, slow_json = self.best_of(slow_path, options)
+                fast_time, fast_json = self.best_of(fast_path, options)
+                if slow_json != fast_json:
+                    raise CommandError(f'Different JSON for {items} items')
+
+                self.stdout.write(
+                    f'{items:>8} {slow_time * 1000:>10.1f}ms '
+                    f'{fast_time * 1000:>8.1f}ms '
+                    f'{slow_time / fast_time:>7.1f}x'
+                )
+
+            transaction.set_rollback(True)
+
+    def best_of(self, func, options):
+        """Return the fastest time of a few runs and the last result"""
+        best = None
+        for _run in range(options['repeat']):
+            start = time.perf_counter()
+            result = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best, result
+
+    def generate(self, items):
+        """Create a user with recipes, each with a few tags and ingredients"""
+        user = get_user_model().objects.create_user(
+            f'benchmark-{uuid.uuid4().hex[:8]}@example.com'
+        )
+        Tag.objects.bulk_create(
+            Tag(user=user, name=f'Tag {i}') for i in range(10)
+        )
+        Ingredient.objects.bulk_create(
+            Ingredient(user=user, name=f'Ingredient {i}') for i in range(20)
+        )
+        Recipe.objects.bulk_create(
+            Recipe(
+                user=user,
+                title=f'Recipe {i}',
+                time_minutes=i % 120,
+                price=Decimal(i % 10000) / 100,
+                link=f'https://example.com/{i}',
+            )
+            for i in range(items)
+        )
+
+        # the ids are read back as sqlite does not return them
+        tag_ids = list(Tag.objects.filter(user=user).values_list(
+            'id', flat=True))
+        ingredient_ids = list(Ingredient.objects.filter(
+            user=user).values_list('id', flat=True))
+        recipe_ids = Recipe.objects.filter(user=user).values_list(
+            'id', flat=True)
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id in recipe_ids
+            for tag_id in tag_ids[recipe_id % 7:][:3]
+        )
+        Recipe.ingredients.through.objects.bulk_create(
+            Recipe.ingredients.through(
+                recipe_id=recipe_id, ingredient_id=ingredient_id
+            )
+            for recipe_id in recipe_ids
+            for ingredient_id in ingredient_ids[recipe_id % 11:][:5]
+        )
+        return user
@@ -0,0 +1,70 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.models import Recipe, RecipeImageRendition
+from core.storage import release_files
+
+
+class Command(BaseCommand):
+    """Django command to delete recipe image files nothing references
+    """
+    help = 'Delete orphaned recipe image files from the media storage'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--min-age', type=int, default=3600,
+            help='Only delete files older than this many seconds, '
+                 'so uploads still being saved are left alone',
+        )
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='List the orphaned files without deleting them',
+        )
+
+    def handle(self, *args, **options):
+        storage = Recipe._meta.get_field('image').storage
+        root = storage.path('uploads')
+        cutoff = time.time() - options['min_age']
+
+        # every file name referenced by a recipe or a rendition
+        # > streamed with iterator() to keep the memory down
+        referenced = set(
+            Recipe.objects.exclude(image='').exclude(image=None)
+            .values_list('image', flat=True).iterator()
+        )
+        referenced.update(
+            RecipeImageRendition.objects.values_list(
+                'file', flat=True
+            ).iterator()
+        )
+
+        deleted = 0
+        freed = 0
+        for directory, _dirs, files in os.walk(root):
+            for filename in files:
+                path = os.path.join(directory, filename)
+                name = os.path.relpath(path, storage.location)
+                # storage names always use forward slashes
+                name = name.replace(os.sep, '/')
+                if name in referenced:
+                    continue
+
+                stat = os.stat(path)
+                if stat.st_mtime > cutoff:
+                    continue
+
+                if options['dry_run']:
+                    self.stdout.write(name)
+                else:
+                    # checks the references again in case a new upload
+                    # of the same content reused the file meanwhile
+                    release_files(storage, [name])
+                deleted += 1
+                freed += stat.st_size
+
+        action = 'Would delete' if options['dry_run'] else 'Deleted'
+        self.stdout.write(self.style.SUCCESS(
+            f'{action} {deleted} orphaned file(s), {freed} bytes'
+        ))
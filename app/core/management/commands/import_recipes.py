@@ -0,0 +1,61 @@
+import sys
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from recipe import transfer
+
+
+class Command(BaseCommand):
+    """Django command to import recipes exported as NDJSON or CSV
+    """
+    help = 'Import recipes from an NDJSON or CSV export into an account'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            help="File to import, '-' to read from stdin",
+        )
+        parser.add_argument(
+            '--user', required=True,
+            help='Email of the user the recipes are imported for',
+        )
+        parser.add_argument(
+            '--format', choices=sorted(transfer.PARSERS),
+            help='Format of the file, by default from its extension',
+        )
+        parser.add_argument(
+            '--batch-size', type=int,
+            default=settings.RECIPE_IMPORT_BATCH_SIZE,
+            help='Recipes written per transaction',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(email=options['user'])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"No user with email {options['user']}")
+
+        fmt = options['format'] or options['path'].rsplit('.', 1)[-1]
+        if fmt not in transfer.PARSERS:
+            raise CommandError('Use --format to give the file format')
+
+        # the file is read line by line as it is imported
+        if options['path'] == '-':
+            result = self.run(user, fmt, sys.stdin.buffer, options)
+        else:
+            with open(options['path'], 'rb') as lines:
+                result = self.run(user, fmt, lines, options)
+
+        for error in result['errors']:
+            self.stderr.write(f"line {error['line']}: {error['errors']}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {result['created']} recipe(s), "
+            f"{result['failed']} failed"
+        ))
+
+    def run(self, user, fmt, lines, options):
+        return transfer.import_records(
+            user, transfer.PARSERS[fmt](lines), options['batch_size']
+        )
@@ -0,0 +1,35 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.dedupe import UNIQUE_NAME_MODELS, duplicate_groups, merge_duplicates
+
+
+class Command(BaseCommand):
+    """Django command to merge the tags and ingredients given twice
+    """
+    help = 'Merge the tags and ingredients a user has more than once ' \
+           'into the oldest, needed before the unique names migration'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Only list the duplicate names',
+        )
+
+    def handle(self, *args, **options):
+        for model_name, relation in UNIQUE_NAME_MODELS:
+            Model = apps.get_model('core', model_name)
+            if options['dry_run']:
+                for group in duplicate_groups(Model).order_by('user_id'):
+                    self.stdout.write(
+                        f'{model_name} {group["name"]!r} of user '
+                        f'{group["user_id"]}: {group["total"]} times'
+                    )
+                continue
+
+            with transaction.atomic():
+                merged = merge_duplicates(apps, model_name, relation)
+            self.stdout.write(self.style.SUCCESS(
+                f'Merged {merged} duplicate {model_name.lower()}(s)'
+            ))
@@ -0,0 +1,59 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core.images import process_recipe_image
+from core.models import Recipe
+
+
+class Command(BaseCommand):
+    """Django command to process the queue of pending recipe images
+    """
+    help = 'Create the renditions of pending recipe images'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Process the pending images then exit',
+        )
+        parser.add_argument(
+            '--interval', type=float, default=5.0,
+            help='Seconds to wait between polls of an empty queue',
+        )
+        parser.add_argument(
+            '--requeue', action='store_true',
+            help='Requeue images left processing by a crashed worker',
+        )
+
+    def handle(self, *args, **options):
+        if options['requeue']:
+            requeued = Recipe.objects.filter(
+                image_status=Recipe.IMAGE_PROCESSING
+            ).update(image_status=Recipe.IMAGE_PENDING)
+            self.stdout.write(f'Requeued {requeued} image(s)')
+
+        while True:
+            processed = self.process_pending()
+            if processed:
+                self.stdout.write(f'Processed {processed} image(s)')
+            if options['once']:
+                break
+            if not processed:
+                # nothing to do, wait before polling again
+                time.sleep(options['interval'])
+            # drop a connection that broke or got too old meanwhile
+            close_old_connections()
+
+    def process_pending(self, batch_size=100):
+        """Process a batch of pending images, return how many were done"""
+        # oldest recipes first, served by the image_status index
+        recipe_ids = list(Recipe.objects.filter(
+            image_status=Recipe.IMAGE_PENDING
+        ).order_by('id').values_list('id', flat=True)[:batch_size])
+
+        for recipe_id in recipe_ids:
+            # claiming is atomic so other workers may run at the same time
+            process_recipe_image(recipe_id)
+
+        return len(recipe_ids)
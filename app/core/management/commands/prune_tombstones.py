@@ -0,0 +1,41 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.models import Tombstone
+
+
+class Command(BaseCommand):
+    """Django command to delete tombstones no client needs anymore
+    """
+    help = 'Delete the tombstones of objects deleted long ago'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int,
+            default=settings.SYNC_TOMBSTONE_MAX_AGE_DAYS,
+            help='Keep the tombstones of this many days, clients that '
+                 'synced before that get a full sync anyway',
+        )
+
+    def handle(self, *args, **options):
+        # clients that synced within SYNC_TOMBSTONE_MAX_AGE_DAYS get
+        # an incremental sync, which would miss a pruned tombstone
+        if options['days'] < settings.SYNC_TOMBSTONE_MAX_AGE_DAYS:
+            raise CommandError(
+                f'--days must be at least SYNC_TOMBSTONE_MAX_AGE_DAYS '
+                f'({settings.SYNC_TOMBSTONE_MAX_AGE_DAYS})'
+            )
+
+        cutoff = timezone.now() - timedelta(days=options['days'])
+        # tombstones have no signals or relations
+        # so this is a single DELETE
+        deleted, _counts = Tombstone.objects.filter(
+            deleted_at__lt=cutoff
+        ).delete()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {deleted} tombstone(s)'
+        ))
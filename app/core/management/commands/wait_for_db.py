@@ -1,25 +1,110 @@
+import random
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 from django.db import connections
 from django.db.utils import OperationalError
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+
+
+def backoff(attempt, interval, max_interval):
+    """Return the pause before the next attempt, in seconds
+
+    Doubles after each failed attempt up to max_interval, with a random
+    jitter so that containers starting together do not all retry
+    at the same moment.
+    """
+    delay = min(max_interval, interval * 2 ** attempt)
+    return random.uniform(delay / 2, delay)
 
 
 class Command(BaseCommand):
     """Django command to pause execution until database is available
     """
+    help = ('Wait until every configured database accepts queries, '
+            'retrying with an exponential backoff')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--timeout', type=float, default=60,
+            help='Seconds to wait before failing, 0 to wait forever',
+        )
+        parser.add_argument(
+            '--interval', type=float, default=0.1,
+            help='Seconds before the first retry, doubled after each one',
+        )
+        parser.add_argument(
+            '--max-interval', type=float, default=5,
+            help='Longest pause between two attempts, in seconds',
+        )
+        parser.add_argument(
+            '--database', action='append', dest='databases',
+            help='Database alias to wait for, may be repeated '
+                 '(default: every configured database)',
+        )
 
     def handle(self, *args, **options):
+        aliases = options['databases'] or list(connections)
+        deadline = None
+        if options['timeout']:
+            deadline = time.monotonic() + options['timeout']
+
         self.stdout.write('Waiting for database...')
-        db_conn = None
-        while not db_conn:
-            try:
-                # try and set db connection
-                db_conn = connections['default']
-            except OperationalError:
-                # output msg
-                self.stdout.write('Database unavailable, waiting 1 second...')
-                # wait for 1 sec and try again
-                time.sleep(1)
+        if len(aliases) == 1:
+            errors = [self.wait(aliases[0], deadline, options)]
+        else:
+            # every database is waited for at the same time
+            with ThreadPoolExecutor(len(aliases)) as pool:
+                errors = list(pool.map(
+                    lambda alias: self.wait_in_thread(
+                        alias, deadline, options
+                    ),
+                    aliases
+                ))
+
+        errors = [error for error in errors if error]
+        if errors:
+            raise CommandError('\n'.join(errors))
         # style.SUCCESS wraps it in a green output
         self.stdout.write(self.style.SUCCESS('Database available!'))
+
+    def probe(self, alias):
+        """Run a query on a database, raise OperationalError if it fails"""
+        # opening a cursor is not enough, e.g. PostgreSQL accepts
+        # connections before it can run queries while it starts up
+        with connections[alias].cursor() as cursor:
+            cursor.execute('SELECT 1')
+
+    def wait(self, alias, deadline, options):
+        """Wait for a database, return an error message on timeout"""
+        attempt = 0
+        while True:
+            try:
+                self.probe(alias)
+                return None
+            except OperationalError as error:
+                delay = backoff(
+                    attempt, options['interval'], options['max_interval']
+                )
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return (f'Database {alias} unavailable after '
+                                f'{options["timeout"]:g} seconds: {error}')
+                    delay = min(delay, remaining)
+                # output msg
+                self.stdout.write(
+                    f'Database {alias} unavailable, '
+                    f'waiting {delay:.2f} seconds...'
+                )
+                # wait and try again
+                time.sleep(delay)
+                attempt += 1
+
+    def wait_in_thread(self, alias, deadline, options):
+        """Wait for a database from a pool thread"""
+        try:
+            return self.wait(alias, deadline, options)
+        finally:
+            # each thread has its own database connection
+            connections[alias].close()
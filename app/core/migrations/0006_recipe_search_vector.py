@@ -0,0 +1,74 @@
+# Generated by Django 3.0.14 on 2026-10-17 12:27
+
+import django.contrib.postgres.search
+from django.db import migrations
+from django.db.models import Max, Min
+
+
+# a copy of core.search.REFRESH_SQL as it was when this migration was
+# written, so later changes to it do not change the migration
+# > refreshes the recipes in a range of ids
+BACKFILL_SQL = """
+    UPDATE core_recipe SET search_vector =
+        setweight(to_tsvector('english', core_recipe.title), 'A')
+        || setweight(to_tsvector('english', coalesce((
+            SELECT string_agg(core_tag.name, ' ')
+            FROM core_tag
+            INNER JOIN core_recipe_tags
+                ON core_recipe_tags.tag_id = core_tag.id
+            WHERE core_recipe_tags.recipe_id = core_recipe.id
+        ), '')), 'B')
+        || setweight(to_tsvector('english', coalesce((
+            SELECT string_agg(core_ingredient.name, ' ')
+            FROM core_ingredient
+            INNER JOIN core_recipe_ingredients
+                ON core_recipe_ingredients.ingredient_id = core_ingredient.id
+            WHERE core_recipe_ingredients.recipe_id = core_recipe.id
+        ), '')), 'B')
+    WHERE core_recipe.id >= %(start)s AND core_recipe.id < %(end)s
+"""
+# ids refreshed per UPDATE
+BACKFILL_BATCH_SIZE = 10000
+
+
+def create_search_index(apps, schema_editor):
+    # tsvector and GIN indexes only exist on PostgreSQL
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX core_recipe_search_vector_gin '
+        'ON core_recipe USING gin (search_vector)'
+    )
+    # build the vectors of the existing recipes
+    # > in ranges of ids so that no single UPDATE rewrites the table
+    Recipe = apps.get_model('core', 'Recipe')
+    ids = Recipe.objects.aggregate(first=Min('id'), last=Max('id'))
+    if ids['first'] is None:
+        return
+    for start in range(ids['first'], ids['last'] + 1, BACKFILL_BATCH_SIZE):
+        schema_editor.execute(BACKFILL_SQL, {
+            'start': start,
+            'end': start + BACKFILL_BATCH_SIZE,
+        })
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX core_recipe_search_vector_gin')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_recipe_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.0.14 on 2026-10-17 12:29
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_status',
+            field=models.CharField(blank=True, choices=[('pending', 'Pending'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], db_index=True, max_length=10),
+        ),
+        migrations.CreateModel(
+            name='RecipeImageRendition',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('size', models.CharField(max_length=10)),
+                ('format', models.CharField(max_length=10)),
+                ('file', models.FileField(max_length=255, upload_to='')),
+                ('width', models.PositiveIntegerField()),
+                ('height', models.PositiveIntegerField()),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='image_renditions', to='core.Recipe')),
+            ],
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 3.0.14 on 2026-10-17 12:40
+
+from django.conf import settings
+from django.db import migrations
+
+from core.dedupe import UNIQUE_NAME_MODELS, duplicate_groups, merge_duplicates
+
+
+def dedupe_recipe_attrs(apps, schema_editor):
+    # names become unique per user in the next migration
+    # > the constraint is not optional: tags and ingredients given by
+    #   name (recipe writes, bulk writes, imports) are matched on it,
+    #   and save_missing_related relies on it to reuse a name created
+    #   by a concurrent request instead of creating it twice
+    # > existing duplicates are only merged when asked to, merging
+    #   deletes objects so it is never done behind the operator's back
+    duplicates = [
+        model_name for model_name, _relation in UNIQUE_NAME_MODELS
+        if duplicate_groups(apps.get_model('core', model_name)).exists()
+    ]
+    if not duplicates:
+        return
+    if not settings.MERGE_DUPLICATE_NAMES_ON_MIGRATE:
+        raise RuntimeError(
+            f'Some users have {" and ".join(duplicates)} names more than '
+            f'once. Review them with "manage.py merge_duplicate_names '
+            f'--dry-run" and merge them with "manage.py '
+            f'merge_duplicate_names" (or set '
+            f'MERGE_DUPLICATE_NAMES_ON_MIGRATE=1) before migrating.'
+        )
+    for model_name, relation in UNIQUE_NAME_MODELS:
+        merge_duplicates(apps, model_name, relation)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_sync_timestamps'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_recipe_attrs, migrations.RunPython.noop),
+    ]
@@ -1,3 +1,4 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
 import uuid
 import os
@@ -14,6 +15,8 @@ from django.contrib.auth.models import (
 
 from django.conf import settings
 
+from core.storage import ContentAddressedStorage
+
 
 def recipe_image_file_path(instance, filename):
     """Generate file path for new recipe image"""
@@ -23,6 +26,8 @@ def recipe_image_file_path(instance, filename):
     ext = filename.split('.')[-1]
 
     # Add the uuid as the new file name
+    # > the recipe image storage then renames it after the SHA-256
+    #   of the content, see core.storage.ContentAddressedStorage
     filename = f'{uuid.uuid4()}.{ext}'
 
     # return to the destination part to store the file
@@ -98,6 +103,26 @@ class Tag(models.Model):
         # delete the tags as well
         on_delete=models.CASCADE,
     )
+    # when the tag was created and last changed, used to sync clients
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # names are unique per user
+        # > the unique index on (user, name) also serves the
+        #   'WHERE user_id = ... ORDER BY name DESC' of the list view
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'name'],
+                name='core_tag_user_name_uniq',
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', 'updated_at'],
+                name='core_tag_user_updated_idx',
+            ),
+        ]
 
     # string representation of the model
     def __str__(self):
@@ -113,6 +138,25 @@ class Ingredient(models.Model):
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE
     )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        # names are unique per user
+        # > the unique index on (user, name) also serves the
+        #   'WHERE user_id = ... ORDER BY name DESC' of the list view
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'name'],
+                name='core_ingr_user_name_uniq',
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', 'updated_at'],
+                name='core_ingr_user_updated_idx',
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -136,7 +180,118 @@ class Recipe(models.Model):
     # null=True means image is optional
     # pass a reference to the fuction via the upload_to
     # so that fuction can be called anythime there is a file upload
-    image = models.ImageField(null=True, upload_to=recipe_image_file_path)
+    # > files are stored by content, identical uploads share a file
+    #   which is deleted when no recipe references it anymore
+    image = models.ImageField(
+        null=True,
+        upload_to=recipe_image_file_path,
+        storage=ContentAddressedStorage(),
+    )
+    # processing state of the uploaded image
+    # > the upload view only stores the original and marks it pending
+    #   then a background worker (core.images) creates the renditions
+    # > pending recipes are the work queue, hence the index
+    IMAGE_PENDING = 'pending'
+    IMAGE_PROCESSING = 'processing'
+    IMAGE_READY = 'ready'
+    IMAGE_FAILED = 'failed'
+    IMAGE_STATUS_CHOICES = (
+        (IMAGE_PENDING, 'Pending'),
+        (IMAGE_PROCESSING, 'Processing'),
+        (IMAGE_READY, 'Ready'),
+        (IMAGE_FAILED, 'Failed'),
+    )
+    image_status = models.CharField(
+        max_length=10,
+        choices=IMAGE_STATUS_CHOICES,
+        blank=True,
+        db_index=True,
+    )
+    # full-text search document built from the title, tag names
+    # and ingredient names, see core.search.refresh_search_vectors
+    # > kept up to date by the signal handlers in core.signals
+    # > on PostgreSQL it has a GIN index (migration 0006)
+    search_vector = SearchVectorField(null=True, editable=False)
+    # > updated_at also moves on when the tags or ingredients
+    #   of the recipe change (see core.signals)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # serves 'WHERE user_id = ... ORDER BY id DESC' of the list
+            # view and its cursor pages, the plain index on user_id
+            # would leave every recipe of the user to be sorted
+            models.Index(
+                fields=['user', 'id'],
+                name='core_recipe_user_id_idx',
+            ),
+            models.Index(
+                fields=['user', 'updated_at'],
+                name='core_recipe_user_updated_idx',
+            ),
+        ]
 
     def __str__(self):
         return self.title
+
+
+class RecipeImageRendition(models.Model):
+    """Resized copy of a recipe image, e.g. a WebP thumbnail"""
+    recipe = models.ForeignKey(
+        'Recipe',
+        on_delete=models.CASCADE,
+        related_name='image_renditions',
+    )
+    # name of the size e.g. thumb, medium or full
+    size = models.CharField(max_length=10)
+    # image format e.g. webp or jpeg
+    format = models.CharField(max_length=10)
+    # > named after the original, which is stored by content,
+    #   so identical images share their renditions too
+    file = models.FileField(max_length=255)
+    width = models.PositiveIntegerField()
+    height = models.PositiveIntegerField()
+
+    def __str__(self):
+        return self.file.name
+
+
+class Tombstone(models.Model):
+    """Record of a deleted recipe, tag or ingredient
+
+    Lets syncing clients find out what was deleted since their last
+    sync (see recipe.sync). Written by the signal handlers in
+    core.signals and pruned by 'manage.py prune_tombstones'.
+    """
+    RECIPE = 'recipe'
+    TAG = 'tag'
+    INGREDIENT = 'ingredient'
+    MODEL_CHOICES = (
+        (RECIPE, 'Recipe'),
+        (TAG, 'Tag'),
+        (INGREDIENT, 'Ingredient'),
+    )
+
+    # no database constraint: the tombstones of a user are written
+    # while the user is being deleted, and removed right after
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        related_name='+',
+    )
+    model = models.CharField(max_length=10, choices=MODEL_CHOICES)
+    object_id = models.IntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['user', 'deleted_at'],
+                name='core_tomb_user_deleted_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.model} {self.object_id}'
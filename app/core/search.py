@@ -0,0 +1,49 @@
+from django.db import connection
+
+
+# text search configuration used to build and query the search vectors
+SEARCH_CONFIG = 'english'
+
+# rebuild the search vector of recipes from their title (weight A)
+# and the names of their tags and ingredients (weight B)
+# > the tag and ingredient names are collected with correlated
+#   subqueries so a whole batch of recipes is refreshed in one UPDATE
+REFRESH_SQL = """
+    UPDATE core_recipe SET search_vector =
+        setweight(to_tsvector(%(config)s::regconfig, core_recipe.title), 'A')
+        || setweight(to_tsvector(%(config)s::regconfig, coalesce((
+            SELECT string_agg(core_tag.name, ' ')
+            FROM core_tag
+            INNER JOIN core_recipe_tags
+                ON core_recipe_tags.tag_id = core_tag.id
+            WHERE core_recipe_tags.recipe_id = core_recipe.id
+        ), '')), 'B')
+        || setweight(to_tsvector(%(config)s::regconfig, coalesce((
+            SELECT string_agg(core_ingredient.name, ' ')
+            FROM core_ingredient
+            INNER JOIN core_recipe_ingredients
+                ON core_recipe_ingredients.ingredient_id = core_ingredient.id
+            WHERE core_recipe_ingredients.recipe_id = core_recipe.id
+        ), '')), 'B')
+    WHERE core_recipe.id = ANY(%(ids)s)
+"""
+
+
+def search_enabled():
+    """Return True if the database supports full-text search vectors"""
+    return connection.vendor == 'postgresql'
+
+
+def refresh_search_vectors(recipe_ids):
+    """Rebuild the stored search vector of the given recipes"""
+    recipe_ids = list(recipe_ids)
+    # other databases (e.g. sqlite in tests) do not store a vector
+    # and search falls back to a LIKE match instead
+    if not recipe_ids or not search_enabled():
+        return
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            REFRESH_SQL,
+            {'config': SEARCH_CONFIG, 'ids': recipe_ids}
+        )
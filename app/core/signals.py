@@ -0,0 +1,177 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import (
+    m2m_changed,
+    post_delete,
+    post_save,
+    pre_delete,
+)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from core.models import (
+    Tag,
+    Ingredient,
+    Recipe,
+    RecipeImageRendition,
+    Tombstone,
+)
+from core.search import refresh_search_vectors
+from core.storage import release_files
+from core.versions import bump_data_version
+
+
+# Keep the recipe search vectors up to date
+# > a recipe is searchable by its title and by the names of
+#   its tags and ingredients, so the vector is rebuilt whenever
+#   any of them changes
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, **kwargs):
+    """Refresh the search vector of a saved recipe"""
+    refresh_search_vectors([instance.pk])
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def recipe_relations_changed(sender, instance, action, reverse, pk_set,
+                             **kwargs):
+    """Refresh the search vectors of recipes whose tags changed"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    # reverse is True when the change was made from the tag side
+    # e.g. tag.recipe_set.add(recipe), then pk_set holds recipe ids
+    if reverse:
+        refresh_search_vectors(pk_set or ())
+    else:
+        refresh_search_vectors([instance.pk])
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def recipe_attr_saved(sender, instance, created, **kwargs):
+    """Refresh the recipes using a renamed tag or ingredient"""
+    if not created:
+        refresh_search_vectors(
+            instance.recipe_set.values_list('id', flat=True)
+        )
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def recipe_attr_deleting(sender, instance, **kwargs):
+    """Remember the recipes using a tag or ingredient being deleted"""
+    # the through rows are removed by the cascade without any
+    # m2m_changed signal so we collect the recipes beforehand
+    instance._recipe_ids = list(
+        instance.recipe_set.values_list('id', flat=True)
+    )
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def recipe_attr_deleted(sender, instance, **kwargs):
+    """Refresh the recipes that used a deleted tag or ingredient"""
+    refresh_search_vectors(getattr(instance, '_recipe_ids', ()))
+
+
+# Delete image files once nothing references them
+# > files are shared between recipes with identical images
+#   (see core.storage.ContentAddressedStorage) so a file is
+#   only deleted when no other recipe or rendition uses it
+# > done after the commit so a rolled back delete keeps its file
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    """Release the image of a deleted recipe"""
+    if instance.image:
+        storage, name = instance.image.storage, instance.image.name
+        transaction.on_commit(lambda: release_files(storage, [name]))
+
+
+@receiver(post_delete, sender=RecipeImageRendition)
+def rendition_deleted(sender, instance, **kwargs):
+    """Release the file of a deleted image rendition"""
+    storage, name = instance.file.storage, instance.file.name
+    transaction.on_commit(lambda: release_files(storage, [name]))
+
+
+# Move the owner's data version on after any change
+# > cached responses of the user are keyed by it (see core.versions)
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def user_data_changed(sender, instance, **kwargs):
+    """Bump the data version of the owner of a changed object"""
+    bump_data_version(instance.user_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def user_relations_changed(sender, instance, action, **kwargs):
+    """Bump the data version when recipe tags or ingredients change"""
+    # instance is the recipe, or the tag when changed from that side
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_data_version(instance.user_id)
+
+
+# Keep the data needed to sync clients (see recipe.sync)
+# > a recipe lists the ids of its tags and ingredients so it counts
+#   as changed when they change, update() keeps it to one query
+# > deleted objects leave a tombstone behind
+
+
+def touch_recipes(recipe_ids):
+    """Mark recipes as changed without saving them"""
+    recipe_ids = list(recipe_ids)
+    if recipe_ids:
+        Recipe.objects.filter(pk__in=recipe_ids).update(
+            updated_at=timezone.now()
+        )
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def recipe_relations_touched(sender, instance, action, reverse, pk_set,
+                             **kwargs):
+    """Mark recipes whose tags or ingredients changed as updated"""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if reverse:
+        touch_recipes(pk_set or ())
+    else:
+        touch_recipes([instance.pk])
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def recipe_attr_removed(sender, instance, **kwargs):
+    """Mark the recipes that used a deleted tag or ingredient"""
+    touch_recipes(getattr(instance, '_recipe_ids', ()))
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def object_deleted(sender, instance, **kwargs):
+    """Leave a tombstone for a deleted recipe, tag or ingredient"""
+    Tombstone.objects.create(
+        user_id=instance.user_id,
+        model=sender._meta.model_name,
+        object_id=instance.pk,
+    )
+
+
+@receiver(post_delete, sender=settings.AUTH_USER_MODEL)
+def user_deleted(sender, instance, **kwargs):
+    """Remove the tombstones left by the objects of a deleted user"""
+    Tombstone.objects.filter(user_id=instance.pk).delete()
@@ -0,0 +1,121 @@
+import hashlib
+import os
+import posixpath
+import uuid
+
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import connection, transaction
+from django.utils.deconstruct import deconstructible
+
+
+# first key of the advisory locks taken on stored files
+# > keeps them apart from other users of PostgreSQL advisory locks
+FILE_LOCK_NAMESPACE = 7305
+
+
+def lock_files(names):
+    """Lock stored files by name until the current transaction ends
+
+    Reusing a stored file and releasing it both take the lock, so a
+    file can not be deleted between being found and being referenced.
+    Must be called inside transaction.atomic().
+    """
+    # PostgreSQL advisory locks on a hash of each name
+    # > other databases (e.g. sqlite in tests) run without them
+    if connection.vendor != 'postgresql':
+        return
+
+    with connection.cursor() as cursor:
+        # always in the same order so two callers can not deadlock
+        for name in sorted(set(names)):
+            cursor.execute(
+                'SELECT pg_advisory_xact_lock(%s, hashtext(%s))',
+                [FILE_LOCK_NAMESPACE, name]
+            )
+
+
+def content_sha256(content):
+    """Return the hex SHA-256 of a file, reusing the upload's own hash"""
+    # StreamingImageUploadHandler hashes the upload while receiving it
+    digest = getattr(content, 'sha256', None)
+    if digest:
+        return digest
+
+    hasher = hashlib.sha256()
+    content.seek(0)
+    for chunk in content.chunks():
+        hasher.update(chunk)
+    content.seek(0)
+    return hasher.hexdigest()
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """File storage where a file is named after its content
+
+    The name given to save() only provides the directory and the
+    extension, the file itself is named after the SHA-256 of its
+    content e.g. uploads/recipe/9f/9f86d0...0a08.jpg. Saving content
+    that is already stored returns the existing file instead of
+    writing a second copy.
+
+    The file is locked (see lock_files) so save inside a transaction
+    that also stores the reference to it.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        """Keep the name, an existing file has the same content"""
+        return name
+
+    def _save(self, name, content):
+        # the first two hex digits are used as a sub directory
+        # to keep the number of files per directory down
+        directory, filename = posixpath.split(name)
+        extension = posixpath.splitext(filename)[1].lower()
+        digest = content_sha256(content)
+        name = posixpath.join(directory, digest[:2], digest + extension)
+
+        # held until the caller commits the row referencing the file
+        lock_files([name])
+        full_path = self.path(name)
+        if os.path.exists(full_path):
+            # identical content is already stored
+            return name
+
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+
+        # write next to the final file then rename it into place
+        # > the rename is atomic so a concurrent upload of the same
+        #   content can only ever replace it with identical bytes
+        staging = os.path.join(directory, f'.{uuid.uuid4()}.part')
+        if hasattr(content, 'temporary_file_path'):
+            file_move_safe(content.temporary_file_path(), staging)
+        else:
+            with open(staging, 'wb') as staged:
+                for chunk in content.chunks():
+                    staged.write(chunk)
+        if self.file_permissions_mode is not None:
+            os.chmod(staging, self.file_permissions_mode)
+        os.replace(staging, full_path)
+
+        return name
+
+
+def release_files(storage, names):
+    """Delete stored recipe image files that nothing references anymore"""
+    # imported here as core.models imports this module
+    from core.models import Recipe, RecipeImageRendition
+
+    for name in set(filter(None, names)):
+        # waits for a save reusing the file to commit its reference
+        with transaction.atomic():
+            lock_files([name])
+            # the reference count of a file is the number of recipes
+            # and renditions pointing at it, only unreferenced files go
+            if Recipe.objects.filter(image=name).exists():
+                continue
+            if RecipeImageRendition.objects.filter(file=name).exists():
+                continue
+            storage.delete(name)
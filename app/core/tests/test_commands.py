@@ -1,9 +1,22 @@
 # Simulate the db being avaliable or not
+import json
+import tempfile
+from io import StringIO
+from datetime import timedelta
+from itertools import count
 from unittest.mock import patch
 
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+
 from django.core.management import call_command
+from django.core.management.base import CommandError
 from django.db.utils import OperationalError
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from core.management.commands.wait_for_db import backoff
+from core.models import Recipe, Tombstone
 
 
 class CommandTests(TestCase):
@@ -11,20 +24,226 @@ class CommandTests(TestCase):
     def test_wait_for_db_ready(self):
         """Test waithing for db when db is available
         """
-        with patch('django.db.utils.ConnectionHandler.__getitem__') as gi:
-            gi.return_value = True
-            call_command('wait_for_db')  # core/management/wait_for_db.py
-            # check that getitem was called once
-            self.assertEqual(gi.call_count, 1)
+        target = 'django.db.backends.base.base.' \
+                 'BaseDatabaseWrapper.ensure_connection'
+        with patch(target) as ec:
+            call_command('wait_for_db', stdout=StringIO())
+            # check that the database was queried once
+            self.assertEqual(ec.call_count, 1)
 
     @patch('time.sleep', return_value=True)
     def test_wait_for_db(self, ts):
         """Test waiting for db
         """
-        with patch('django.db.utils.ConnectionHandler.__getitem__') as gi:
+        target = 'django.db.backends.base.base.' \
+                 'BaseDatabaseWrapper.ensure_connection'
+        with patch(target) as ec:
             # the 1st 5 times will raise an operational error
             # and 6th will be a success
-            gi.side_effect = [OperationalError] * 5 + [True]
-            call_command('wait_for_db')  # core/management/wait_for_db.py
-            # ckeck that getitem is called five times and sixth is a success
-            self.assertEqual(gi.call_count, 6)
+            ec.side_effect = [OperationalError] * 5 + [None]
+            call_command('wait_for_db', stdout=StringIO())
+            # ckeck that it is called five times and sixth is a success
+            self.assertEqual(ec.call_count, 6)
+
+        # the pauses grow between the attempts
+        delays = [call.args[0] for call in ts.call_args_list]
+        self.assertEqual(len(delays), 5)
+        self.assertLess(delays[0], delays[-1])
+
+    @patch('time.sleep', return_value=True)
+    def test_wait_for_db_timeout(self, ts):
+        """Test giving up once the timeout is reached"""
+        target = 'django.db.backends.base.base.' \
+                 'BaseDatabaseWrapper.ensure_connection'
+        clock = 'core.management.commands.wait_for_db.time.monotonic'
+        with patch(target, side_effect=OperationalError('down')), \
+                patch(clock, side_effect=count(0, 1)):
+            with self.assertRaisesMessage(CommandError, 'after 3 seconds'):
+                call_command('wait_for_db', timeout=3, stdout=StringIO())
+
+    def test_backoff(self):
+        """Test the pauses double up to the maximum, with jitter"""
+        for attempt, delay in ((0, 0.1), (1, 0.2), (3, 0.8), (10, 5)):
+            pause = backoff(attempt, 0.1, 5)
+            self.assertGreaterEqual(pause, delay / 2)
+            self.assertLessEqual(pause, delay)
+
+
+class ProcessImagesCommandTests(TestCase):
+
+    def setUp(self):
+        user = get_user_model().objects.create_user('user', 'testpass')
+        self.recipe = Recipe.objects.create(
+            user=user,
+            title='Sample recipe',
+            time_minutes=10,
+            price=5.00,
+            image_status=Recipe.IMAGE_PENDING,
+        )
+
+    @patch('core.management.commands.process_images.process_recipe_image')
+    def test_process_pending_images(self, process):
+        """Test the pending images are processed"""
+        call_command('process_images', '--once')
+
+        process.assert_called_once_with(self.recipe.id)
+
+    @patch('core.management.commands.process_images.process_recipe_image')
+    def test_requeue_processing_images(self, process):
+        """Test images left processing are requeued"""
+        Recipe.objects.update(image_status=Recipe.IMAGE_PROCESSING)
+
+        call_command('process_images', '--once', '--requeue')
+
+        process.assert_called_once_with(self.recipe.id)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class GcRecipeImagesCommandTests(TestCase):
+
+    def test_orphaned_images_deleted(self):
+        """Test unreferenced image files are deleted"""
+        user = get_user_model().objects.create_user('user', 'testpass')
+        recipe = Recipe.objects.create(
+            user=user,
+            title='Sample recipe',
+            time_minutes=10,
+            price=5.00,
+        )
+        recipe.image.save('photo.jpg', ContentFile(b'kept'))
+        storage = recipe.image.storage
+        orphan = storage.save('uploads/recipe/orphan.jpg', ContentFile(b'x'))
+
+        call_command('gc_recipe_images', '--min-age', '0')
+
+        self.assertTrue(storage.exists(recipe.image.name))
+        self.assertFalse(storage.exists(orphan))
+
+    def test_recent_files_kept(self):
+        """Test files newer than the minimum age are left alone"""
+        storage = Recipe._meta.get_field('image').storage
+        recent = storage.save('uploads/recipe/recent.jpg', ContentFile(b'x'))
+
+        call_command('gc_recipe_images')
+
+        self.assertTrue(storage.exists(recent))
+
+
+@override_settings(SYNC_TOMBSTONE_MAX_AGE_DAYS=7)
+class PruneTombstonesCommandTests(TestCase):
+
+    def test_old_tombstones_deleted(self):
+        """Test only tombstones older than the cutoff are deleted"""
+        user = get_user_model().objects.create_user(
+            'test@gmail.com', 'password'
+        )
+        old = Tombstone.objects.create(user=user, model='tag', object_id=1)
+        Tombstone.objects.filter(pk=old.pk).update(
+            deleted_at=timezone.now() - timedelta(days=10)
+        )
+        recent = Tombstone.objects.create(
+            user=user, model='tag', object_id=2
+        )
+
+        with self.assertNumQueries(1):
+            call_command('prune_tombstones', stdout=StringIO())
+
+        self.assertEqual(
+            list(Tombstone.objects.values_list('id', flat=True)),
+            [recent.id]
+        )
+
+    def test_days_below_sync_max_age_refused(self):
+        """Test tombstones clients may still need are never pruned"""
+        with self.assertRaises(CommandError):
+            call_command('prune_tombstones', days=3)
+
+
+class BenchmarkIndexesCommandTests(TestCase):
+
+    def test_requires_postgresql(self):
+        """Test the benchmark refuses to run on other databases"""
+        target = 'core.management.commands.benchmark_indexes.connection'
+        with patch(target) as conn:
+            conn.vendor = 'sqlite'
+            with self.assertRaises(CommandError):
+                call_command('benchmark_indexes', rows=10, users=1)
+
+
+class ImportRecipesCommandTests(TestCase):
+
+    def test_import_ndjson_file(self):
+        """Test recipes are imported from a file for a user"""
+        user = get_user_model().objects.create_user(
+            'test@gmail.com', 'password'
+        )
+        with tempfile.NamedTemporaryFile(suffix='.ndjson') as ntf:
+            ntf.write(
+                b'{"title": "Soup", "time_minutes": 20, "price": "3.00",'
+                b' "tags": ["Warm"], "ingredients": ["Leek"]}\n'
+                b'{"title": "Bad"}\n'
+            )
+            ntf.flush()
+
+            call_command(
+                'import_recipes', ntf.name, user='test@gmail.com',
+                stdout=StringIO(), stderr=StringIO()
+            )
+
+        recipe = Recipe.objects.get(user=user)
+        self.assertEqual(recipe.title, 'Soup')
+        self.assertEqual(list(recipe.tags.values_list('name', flat=True)),
+                         ['Warm'])
+
+
+class BenchmarkApiCommandTests(TestCase):
+
+    options = {
+        'users': 1, 'recipes': 3, 'tags': 3, 'ingredients': 4,
+        'requests': 3, 'concurrency': 1,
+    }
+
+    def test_report(self):
+        """Test every scenario is reported and the data is deleted"""
+        out = StringIO()
+        call_command('benchmark_api', stdout=out, stderr=StringIO(),
+                     **self.options)
+
+        report = json.loads(out.getvalue())
+        self.assertEqual(
+            sorted(report['scenarios']),
+            ['create', 'detail', 'filter', 'list', 'upload_image']
+        )
+        for result in report['scenarios'].values():
+            self.assertEqual(result['requests'], 3)
+            self.assertEqual(result['errors'], 0)
+            self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+        self.assertFalse(get_user_model().objects.exists())
+
+    def test_regression_fails(self):
+        """Test a run worse than the baseline fails"""
+        baseline = {'scenarios': {'detail': {
+            'p95_ms': 0, 'queries_per_request': 0, 'throughput_rps': 0,
+        }}}
+        with tempfile.NamedTemporaryFile('w', suffix='.json') as ntf:
+            json.dump(baseline, ntf)
+            ntf.flush()
+
+            with self.assertRaisesMessage(CommandError, 'detail p95_ms'):
+                call_command(
+                    'benchmark_api', scenarios=['detail'], baseline=ntf.name,
+                    stdout=StringIO(), stderr=StringIO(), **self.options
+                )
+
+
+class BenchmarkConnectionsCommandTests(TestCase):
+
+    def test_modes_reported(self):
+        """Test both connection modes are timed"""
+        out = StringIO()
+        call_command('benchmark_connections', requests=5, stdout=out)
+
+        output = out.getvalue()
+        self.assertIn('per request', output)
+        self.assertIn('persistent', output)
+        self.assertIn('saved per request', output)
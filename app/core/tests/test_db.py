@@ -0,0 +1,124 @@
+import importlib.util
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from django.test import SimpleTestCase
+
+from core.db.health import check_connections
+from core.db.pool import ConnectionPool
+
+
+class FakeConnection:
+    """Stands for a database connection in the pool"""
+
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class ConnectionPoolTests(SimpleTestCase):
+
+    def test_reuse_most_recent_first(self):
+        """Test idle connections are handed out again, newest first"""
+        pool = ConnectionPool(max_size=2, max_lifetime=60)
+        first, second = FakeConnection(), FakeConnection()
+        now = time.monotonic()
+
+        self.assertTrue(pool.put(first, now))
+        self.assertTrue(pool.put(second, now))
+
+        self.assertIs(pool.get()[0], second)
+        self.assertIs(pool.get()[0], first)
+        self.assertEqual(pool.get(), (None, None))
+
+    def test_full_pool(self):
+        """Test connections beyond the pool size are not kept"""
+        pool = ConnectionPool(max_size=1, max_lifetime=60)
+
+        self.assertTrue(pool.put(FakeConnection(), time.monotonic()))
+        self.assertFalse(pool.put(FakeConnection(), time.monotonic()))
+        self.assertEqual(len(pool), 1)
+
+    def test_expired_and_unusable_connections_closed(self):
+        """Test old or broken connections are closed, not handed out"""
+        pool = ConnectionPool(max_size=3, max_lifetime=60)
+        old, broken, good = (FakeConnection() for _i in range(3))
+        pool._idle.extend([
+            (good, time.monotonic()),
+            (old, time.monotonic() - 120),
+            (broken, time.monotonic()),
+        ])
+
+        connection, _created = pool.get(lambda conn: conn is not broken)
+
+        self.assertIs(connection, good)
+        self.assertTrue(old.closed)
+        self.assertTrue(broken.closed)
+        self.assertFalse(pool.put(FakeConnection(), time.monotonic() - 120))
+
+
+@unittest.skipUnless(importlib.util.find_spec('psycopg2'),
+                     'needs psycopg2')
+class PooledBackendTests(SimpleTestCase):
+
+    def closing(self, status, rollback_error=None):
+        """Return a database wrapper whose connection has a status"""
+        import psycopg2
+        from core.db.postgresql_pool.base import DatabaseWrapper
+
+        wrapper = MagicMock(Database=psycopg2)
+        wrapper.connection.get_transaction_status.return_value = status
+        wrapper.connection.rollback.side_effect = rollback_error
+        reusable = DatabaseWrapper.is_closed_connection_reusable(wrapper)
+        return reusable, wrapper.connection
+
+    def test_idle_connection_reused(self):
+        """Test an idle connection goes back to the pool as it is"""
+        import psycopg2.extensions as ext
+        reusable, connection = self.closing(ext.TRANSACTION_STATUS_IDLE)
+
+        self.assertTrue(reusable)
+        connection.rollback.assert_not_called()
+
+    def test_open_transaction_rolled_back(self):
+        """Test a transaction left open is rolled back before reuse"""
+        import psycopg2.extensions as ext
+        reusable, connection = self.closing(ext.TRANSACTION_STATUS_INTRANS)
+
+        self.assertTrue(reusable)
+        connection.rollback.assert_called_once_with()
+
+    def test_broken_connection_not_reused(self):
+        """Test a connection lost or failing to roll back is dropped"""
+        import psycopg2
+        import psycopg2.extensions as ext
+
+        reusable, connection = self.closing(ext.TRANSACTION_STATUS_UNKNOWN)
+        self.assertFalse(reusable)
+        connection.rollback.assert_not_called()
+
+        reusable, _connection = self.closing(
+            ext.TRANSACTION_STATUS_INERROR,
+            rollback_error=psycopg2.OperationalError('connection lost'),
+        )
+        self.assertFalse(reusable)
+
+
+class HealthCheckTests(SimpleTestCase):
+
+    def test_unusable_connection_closed(self):
+        """Test a dropped persistent connection is closed"""
+        dropped = MagicMock(in_atomic_block=False)
+        dropped.is_usable.return_value = False
+        healthy = MagicMock(in_atomic_block=False)
+        healthy.is_usable.return_value = True
+
+        with patch('core.db.health.connections') as conns:
+            conns.all.return_value = [dropped, healthy]
+            check_connections()
+
+        dropped.close.assert_called_once_with()
+        healthy.close.assert_not_called()
@@ -0,0 +1,154 @@
+import json
+import os
+import tempfile
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from core.instrumentation import RequestMetrics, registry
+from core.models import Recipe
+from user.authentication import token_cache
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+TOKEN_URL = reverse('user:token')
+METRICS_URL = reverse('metrics')
+
+
+class RequestMetricsTests(TestCase):
+
+    def test_duplicate_queries(self):
+        """Test queries repeated by a request are counted"""
+        metrics = RequestMetrics()
+        metrics.queries = [
+            ('SELECT a WHERE id = %s', 0.001),
+            ('SELECT a WHERE id = %s', 0.001),
+            ('SELECT a WHERE id = %s', 0.001),
+            ('SELECT b', 0.002),
+        ]
+
+        self.assertEqual(metrics.duplicate_queries, 2)
+        self.assertEqual(
+            metrics.repeated_queries(), {'SELECT a WHERE id = %s': 3}
+        )
+        self.assertIn('4 queries, 2 duplicates', metrics.server_timing())
+
+
+@override_settings(INSTRUMENTATION_ENABLED=True,
+                   INSTRUMENTATION_SAMPLE_RATE=1.0,
+                   INSTRUMENTATION_METRICS_TOKEN='')
+class InstrumentationMiddlewareTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        registry.clear()
+        self.user = get_user_model().objects.create_user(
+            'test@gmail.com',
+            'password'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_server_timing(self):
+        """Test measured responses get a Server-Timing header"""
+        Recipe.objects.create(
+            user=self.user, title='Soup', time_minutes=5, price=1.00
+        )
+
+        response = self.client.get(RECIPES_URL)
+
+        timing = response['Server-Timing']
+        for metric in ('total;dur=', 'db;dur=', 'serializer;dur=',
+                       'render;dur='):
+            self.assertIn(metric, timing)
+
+    def test_metrics_per_view(self):
+        """Test the metrics endpoint reports each view and action"""
+        self.client.get(RECIPES_URL)
+        self.client.post(TOKEN_URL, {
+            'email': 'test@gmail.com', 'password': 'password'
+        })
+
+        response = self.client.get(METRICS_URL)
+
+        self.assertEqual(response.status_code, 200)
+        body = response.content.decode()
+        self.assertIn(
+            'recipe_api_requests_total{view="RecipeViewSet.list",'
+            'status="200"} 1', body
+        )
+        self.assertIn('view="CreateTokenView.post"', body)
+        self.assertIn('recipe_api_db_queries_total{view=', body)
+        self.assertIn('recipe_api_token_cache_hits_total', body)
+
+    @override_settings(INSTRUMENTATION_SAMPLE_RATE=0.0)
+    def test_not_sampled(self):
+        """Test requests outside the sample are not measured"""
+        response = self.client.get(RECIPES_URL)
+
+        self.assertNotIn('Server-Timing', response)
+        self.assertNotIn('RecipeViewSet', registry.render())
+
+    @override_settings(INSTRUMENTATION_METRICS_TOKEN='secret')
+    def test_metrics_token(self):
+        """Test the metrics require the token when one is set"""
+        client = APIClient()
+
+        response = client.get(METRICS_URL)
+        self.assertEqual(response.status_code, 401)
+
+        response = client.get(
+            METRICS_URL, HTTP_AUTHORIZATION='Bearer secret'
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_metrics_without_token_local_only(self):
+        """Test the metrics are only served locally without a token"""
+        client = APIClient()
+
+        response = client.get(METRICS_URL, REMOTE_ADDR='10.0.0.5')
+        self.assertEqual(response.status_code, 403)
+
+        response = client.get(METRICS_URL, REMOTE_ADDR='127.0.0.1')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(INSTRUMENTATION_ENABLED=False)
+    def test_disabled(self):
+        """Test nothing is measured nor exposed when disabled"""
+        response = self.client.get(RECIPES_URL)
+
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(self.client.get(METRICS_URL).status_code, 404)
+
+    def test_metrics_of_every_worker(self):
+        """Test the totals of all the processes sharing a directory"""
+        token_cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        # written by another worker, which has exited since
+        with open(os.path.join(directory.name, '1-other.json'), 'w') as f:
+            json.dump({
+                'pid': 2 ** 22 + 1,
+                'views': {},
+                'statuses': [['RecipeViewSet.list', 200, 4]],
+                'values': {
+                    'token_cache_hits_total': 3,
+                    'token_cache_entries': 7,
+                },
+            }, f)
+
+        with override_settings(INSTRUMENTATION_METRICS_DIR=directory.name):
+            self.client.get(RECIPES_URL)
+            body = self.client.get(METRICS_URL).content.decode()
+
+        self.assertIn(
+            'recipe_api_requests_total{view="RecipeViewSet.list",'
+            'status="200"} 5', body
+        )
+        self.assertIn('recipe_api_token_cache_hits_total 3', body)
+        # the entries of an exited worker are gone with it
+        self.assertNotIn('recipe_api_token_cache_entries 7', body)
@@ -0,0 +1,65 @@
+import os
+import tempfile
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+
+def media_url(path):
+    """Return the URL of an uploaded file"""
+    return reverse('media', args=[path])
+
+
+class MediaViewTests(TestCase):
+    """Test serving the uploaded files"""
+
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        os.makedirs(os.path.join(self.media_root.name, 'uploads'))
+        with open(os.path.join(
+                self.media_root.name, 'uploads', 'image.jpg'), 'wb') as f:
+            f.write(b'jpeg')
+
+    def test_file_served(self):
+        """Test the file is sent by the app without a proxy"""
+        with override_settings(MEDIA_ROOT=self.media_root.name,
+                               MEDIA_ACCEL_REDIRECT=''):
+            response = self.client.get(media_url('uploads/image.jpg'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'jpeg')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('public', response['Cache-Control'])
+
+    def test_file_handed_to_proxy(self):
+        """Test the proxy is told to send the file"""
+        with override_settings(MEDIA_ROOT=self.media_root.name,
+                               MEDIA_ACCEL_REDIRECT='/protected-media/'):
+            response = self.client.get(media_url('uploads/image.jpg'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response['X-Accel-Redirect'], '/protected-media/uploads/image.jpg'
+        )
+        self.assertEqual(response.content, b'')
+
+    def test_missing_or_outside_files(self):
+        """Test files that are missing or outside MEDIA_ROOT are not found"""
+        with override_settings(MEDIA_ROOT=self.media_root.name):
+            for path in ('uploads/missing.jpg', '../etc/passwd', 'uploads'):
+                response = self.client.get('/media/' + path)
+                self.assertEqual(response.status_code, 404, path)
+
+    def test_uploads_in_progress_not_found(self):
+        """Test uploads still being received are not served"""
+        tmp_dir = os.path.join(self.media_root.name, 'uploads', 'tmp')
+        os.makedirs(tmp_dir)
+        with open(os.path.join(tmp_dir, 'upload.part'), 'wb') as f:
+            f.write(b'partial')
+
+        with override_settings(MEDIA_ROOT=self.media_root.name):
+            for path in ('uploads/tmp/upload.part',
+                         'uploads/../uploads/tmp/upload.part'):
+                response = self.client.get('/media/' + path)
+                self.assertEqual(response.status_code, 404, path)
@@ -0,0 +1,112 @@
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TransactionTestCase, override_settings
+from django.utils import timezone
+
+
+BEFORE = [('core', '0009_sync_timestamps')]
+AFTER = [('core', '0010_dedupe_recipe_attrs')]
+
+
+def migrate(targets):
+    """Migrate the database and return the app registry of the targets"""
+    executor = MigrationExecutor(connection)
+    executor.migrate(targets)
+    return executor.loader.project_state(targets).apps
+
+
+class DedupeMigrationTests(TransactionTestCase):
+    """Test migration 0010 on tags and ingredients a user has twice"""
+
+    def setUp(self):
+        apps = migrate(BEFORE)
+        User = apps.get_model('core', 'User')
+        Tag = apps.get_model('core', 'Tag')
+        Ingredient = apps.get_model('core', 'Ingredient')
+        Recipe = apps.get_model('core', 'Recipe')
+
+        user = User.objects.create(email='test@gmail.com')
+        other = User.objects.create(email='other@gmail.com')
+        self.kept = Tag.objects.create(user=user, name='Vegan')
+        self.extra = Tag.objects.create(user=user, name='Vegan')
+        self.other_tag = Tag.objects.create(user=other, name='Vegan')
+        self.salt = Ingredient.objects.create(user=user, name='Salt')
+        Ingredient.objects.create(user=user, name='Salt')
+
+        # one recipe only has the duplicate, the other has both
+        self.only_extra = Recipe.objects.create(
+            user=user, title='Soup', time_minutes=5, price=1.00
+        )
+        self.only_extra.tags.add(self.extra)
+        self.both = Recipe.objects.create(
+            user=user, title='Salad', time_minutes=5, price=1.00
+        )
+        self.both.tags.add(self.kept, self.extra)
+        self.long_ago = timezone.now() - timedelta(days=1)
+        Recipe.objects.update(updated_at=self.long_ago)
+
+    def tearDown(self):
+        # back to the latest migrations for the next tests
+        executor = MigrationExecutor(connection)
+        with override_settings(MERGE_DUPLICATE_NAMES_ON_MIGRATE=True):
+            executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_duplicates_stop_the_migration(self):
+        """Test nothing is merged unless the operator asks for it"""
+        with self.assertRaises(RuntimeError):
+            migrate(AFTER)
+
+        apps = migrate(BEFORE)
+        Tag = apps.get_model('core', 'Tag')
+        self.assertEqual(Tag.objects.filter(name='Vegan').count(), 3)
+
+    @override_settings(MERGE_DUPLICATE_NAMES_ON_MIGRATE=True)
+    def test_duplicates_merged_into_oldest(self):
+        """Test recipes keep their links and tombstones are written"""
+        apps = migrate(AFTER)
+        Tag = apps.get_model('core', 'Tag')
+        Ingredient = apps.get_model('core', 'Ingredient')
+        Recipe = apps.get_model('core', 'Recipe')
+        Tombstone = apps.get_model('core', 'Tombstone')
+
+        self.assertEqual(
+            list(Tag.objects.order_by('id').values_list('id', flat=True)),
+            [self.kept.id, self.other_tag.id]
+        )
+        self.assertEqual(
+            list(Ingredient.objects.values_list('id', flat=True)),
+            [self.salt.id]
+        )
+        for recipe in Recipe.objects.all():
+            self.assertEqual(
+                list(recipe.tags.values_list('id', flat=True)),
+                [self.kept.id]
+            )
+            self.assertGreater(recipe.updated_at, self.long_ago)
+        self.assertTrue(Tombstone.objects.filter(
+            model='tag', object_id=self.extra.id
+        ).exists())
+        self.assertEqual(Tombstone.objects.filter(model='tag').count(), 1)
+        self.assertEqual(
+            Tombstone.objects.filter(model='ingredient').count(), 1
+        )
+
+    def test_merge_command_before_migrating(self):
+        """Test the duplicates merged by the command let 0010 through"""
+        out = StringIO()
+        call_command('merge_duplicate_names', dry_run=True, stdout=out)
+        self.assertIn("Tag 'Vegan'", out.getvalue())
+
+        call_command('merge_duplicate_names', stdout=StringIO())
+        apps = migrate(AFTER)
+
+        Tag = apps.get_model('core', 'Tag')
+        self.assertEqual(
+            list(self.both.tags.values_list('id', flat=True)),
+            [self.kept.id]
+        )
+        self.assertFalse(Tag.objects.filter(id=self.extra.id).exists())
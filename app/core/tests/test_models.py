@@ -1,7 +1,13 @@
-from django.test import TestCase
+import hashlib
+import os
+import tempfile
+
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
 from unittest.mock import patch
 from core import models
+from core.storage import release_files
 
 
 def sample_user(email='test@gmail.com', password='abcd1234'):
@@ -107,3 +113,58 @@ class ModelTests(TestCase):
         # f'' means you can insert varibles in strings by using {}
         exp_path = f'uploads/recipe/{uuid}.jpg'
         self.assertEqual(file_path, exp_path)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ContentAddressedStorageTests(TestCase):
+
+    def setUp(self):
+        self.user = sample_user()
+
+    def sample_recipe_with_image(self, content):
+        """Create a recipe with an image file holding content"""
+        recipe = models.Recipe.objects.create(
+            user=self.user,
+            title='Sample recipe',
+            time_minutes=5,
+            price=5.00,
+        )
+        recipe.image.save('photo.JPG', ContentFile(content))
+        return recipe
+
+    def test_image_named_after_content_hash(self):
+        """Test that an image is named after the hash of its content"""
+        content = b'image content'
+        digest = hashlib.sha256(content).hexdigest()
+
+        recipe = self.sample_recipe_with_image(content)
+
+        exp_path = f'uploads/recipe/{digest[:2]}/{digest}.jpg'
+        self.assertEqual(recipe.image.name, exp_path)
+
+    def test_identical_images_stored_once(self):
+        """Test that the same image uploaded twice shares one file"""
+        recipe1 = self.sample_recipe_with_image(b'same photo')
+        recipe2 = self.sample_recipe_with_image(b'same photo')
+        recipe3 = self.sample_recipe_with_image(b'other photo')
+
+        self.assertEqual(recipe1.image.name, recipe2.image.name)
+        self.assertNotEqual(recipe1.image.name, recipe3.image.name)
+        directory = os.path.dirname(recipe1.image.path)
+        self.assertEqual(os.listdir(directory), [
+            os.path.basename(recipe1.image.name)
+        ])
+
+    def test_release_files_keeps_referenced_files(self):
+        """Test a shared file is only deleted once unreferenced"""
+        recipe1 = self.sample_recipe_with_image(b'shared photo')
+        recipe2 = self.sample_recipe_with_image(b'shared photo')
+        storage, name = recipe1.image.storage, recipe1.image.name
+
+        recipe1.delete()
+        release_files(storage, [name])
+        self.assertTrue(storage.exists(name))
+
+        recipe2.delete()
+        release_files(storage, [name])
+        self.assertFalse(storage.exists(name))
@@ -0,0 +1,76 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.test import (
+    SimpleTestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.urls import reverse
+
+from rest_framework.test import APIClient
+
+from core.models import Recipe
+from core.versions import bump_data_version, check_shared_cache
+
+
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+LOCMEM = {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}
+MEMCACHED = {
+    'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+    'LOCATION': 'cache:11211',
+}
+
+
+class CheckSharedCacheTests(SimpleTestCase):
+
+    @override_settings(LIST_CACHE_ENABLED=True, LIST_CACHE_ALIAS='default',
+                       CACHES={'default': LOCMEM})
+    def test_process_local_cache_refused(self):
+        """Test the list cache can not be used with a per-process cache"""
+        with self.assertRaises(ImproperlyConfigured):
+            check_shared_cache()
+
+    @override_settings(LIST_CACHE_ENABLED=True, LIST_CACHE_ALIAS='default',
+                       CACHES={'default': MEMCACHED})
+    def test_shared_cache_accepted(self):
+        """Test the list cache can be used with memcached"""
+        check_shared_cache()
+
+    @override_settings(LIST_CACHE_ENABLED=False, CACHES={'default': LOCMEM})
+    def test_disabled(self):
+        """Test nothing is checked when the list cache is off"""
+        check_shared_cache()
+
+
+@override_settings(LIST_CACHE_ENABLED=True)
+class BumpOnCommitTests(TransactionTestCase):
+    """Test the data version moves on when a write is committed"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            'test@gmail.com',
+            'password'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_list_cached_during_write_is_replaced(self):
+        """Test a list cached before the commit is not served after it"""
+        with transaction.atomic():
+            bump_data_version(self.user.pk)
+            # a request reading before the rows are written
+            # caches the old list under the new version
+            self.assertEqual(self.client.get(RECIPES_URL).data, [])
+            # bulk_create sends no signal, nothing else bumps
+            Recipe.objects.bulk_create([Recipe(
+                user=self.user, title='Soup', time_minutes=5, price=1.00
+            )])
+
+        response = self.client.get(RECIPES_URL)
+
+        self.assertEqual(len(response.data), 1)
@@ -0,0 +1,166 @@
+import hashlib
+import io
+import os
+import uuid
+
+from PIL import Image
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import (
+    FileUploadHandler,
+    SkipFile,
+    StopFutureHandlers,
+)
+from django.utils.translation import gettext as _
+
+
+# the image header is looked for in at most this many leading bytes
+HEADER_MAX_BYTES = 256 * 1024
+# directory of the media storage the uploads are received in
+UPLOAD_TMP_DIR = 'uploads/tmp'
+
+
+class StreamedImageFile(UploadedFile):
+    """An uploaded image already written to a file in the media storage"""
+
+    def __init__(self, path, name, content_type, size, charset,
+                 sha256, width, height):
+        super().__init__(
+            open(path, 'rb'), name, content_type, size, charset
+        )
+        self.path = path
+        # hex SHA-256 of the content, computed while it was received
+        self.sha256 = sha256
+        # dimensions read from the header, the pixels were never decoded
+        self.width = width
+        self.height = height
+
+    def temporary_file_path(self):
+        """Return the path of the received file"""
+        # FileSystemStorage moves files with a temporary_file_path
+        # into place with a rename instead of copying them
+        return self.path
+
+    def close(self):
+        """Close the file and remove it unless it was moved into place"""
+        try:
+            return self.file.close()
+        finally:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+
+class StreamingImageUploadHandler(FileUploadHandler):
+    """Stream an uploaded image to disk, enforcing the size limits early
+
+    Every chunk is written straight to a file next to its final
+    location in the media storage and fed to a SHA-256 hash, so peak
+    memory is one chunk whatever the size of the upload. The upload
+    is rejected as soon as it goes over max_bytes, or once the image
+    header shows more than max_pixels, before any pixel is decoded.
+    """
+
+    def __init__(self, request=None, storage=None, max_bytes=None,
+                 max_pixels=None):
+        super().__init__(request)
+        self.storage = storage
+        self.max_bytes = max_bytes or settings.IMAGE_UPLOAD_MAX_BYTES
+        self.max_pixels = max_pixels or settings.IMAGE_UPLOAD_MAX_PIXELS
+        # reason the upload was rejected, shown to the client
+        self.error = None
+        # True if it was rejected for going over a limit
+        self.too_large = False
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        # write into the storage so that saving the image later
+        # is a rename on the same filesystem rather than a copy
+        directory = self.storage.path(UPLOAD_TMP_DIR)
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f'{uuid.uuid4()}.part')
+        self.file = open(self.path, 'wb')
+        self.hasher = hashlib.sha256()
+        self.size = 0
+        self.header = bytearray()
+        self.dimensions = None
+        # we handle the file, the default handlers must not buffer it
+        raise StopFutureHandlers()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.size += len(raw_data)
+        if self.size > self.max_bytes:
+            self.reject(_('Image is larger than %(max)d bytes.') % {
+                'max': self.max_bytes
+            }, too_large=True)
+
+        if self.dimensions is None:
+            self.read_header(raw_data)
+
+        self.hasher.update(raw_data)
+        self.file.write(raw_data)
+        # returning None tells Django not to pass the chunk any further
+        return None
+
+    def read_header(self, raw_data):
+        """Read the image dimensions from the leading bytes"""
+        self.header.extend(raw_data[:HEADER_MAX_BYTES - len(self.header)])
+        try:
+            # Image.open only parses the header, decoding is lazy
+            with Image.open(io.BytesIO(self.header)) as image:
+                self.dimensions = image.size
+        except Image.DecompressionBombError:
+            self.reject(_('Image has too many pixels.'), too_large=True)
+        except Exception:
+            # not enough of the header yet, unless we have read the
+            # most we are willing to buffer
+            if len(self.header) >= HEADER_MAX_BYTES:
+                self.reject(_('Upload a valid image.'))
+            return
+
+        width, height = self.dimensions
+        if width * height > self.max_pixels:
+            self.reject(_('Image is larger than %(max)d pixels.') % {
+                'max': self.max_pixels
+            }, too_large=True)
+        # the header is no longer needed
+        self.header = None
+
+    def reject(self, message, too_large=False):
+        """Stop receiving the current file and remove what was written"""
+        self.error = message
+        self.too_large = too_large
+        self.cleanup()
+        # skip the rest of this file but keep parsing the request
+        raise SkipFile()
+
+    def cleanup(self):
+        """Remove the partially written file"""
+        # Django closes handler.file itself when a file is skipped
+        # so the closed file object is kept rather than set to None
+        self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def file_complete(self, file_size):
+        self.file.close()
+
+        if self.dimensions is None:
+            self.error = _('Upload a valid image.')
+            os.remove(self.path)
+            return None
+
+        width, height = self.dimensions
+        return StreamedImageFile(
+            self.path,
+            self.file_name,
+            self.content_type,
+            self.size,
+            self.charset,
+            self.hasher.hexdigest(),
+            width,
+            height,
+        )
+
+    def upload_interrupted(self):
+        self.cleanup()
@@ -0,0 +1,84 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+
+
+# Every user has a data version that changes whenever one of their
+# recipes, tags or ingredients changes (see core.signals). Cached
+# responses are keyed by it, so they are invalidated by a bump
+# instead of having to find and delete them.
+# > the version is a nanosecond timestamp rather than a counter so
+#   a version lost from the cache, e.g. evicted, is never reused
+# > versions are only meaningful in a cache shared by every process,
+#   see check_shared_cache()
+
+# cache backends holding their entries in each process
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+)
+
+
+def data_version_key(user_id):
+    """Return the cache key holding the data version of a user"""
+    return f'data-version:{user_id}'
+
+
+def get_data_version(user_id):
+    """Return the current data version of a user"""
+    key = data_version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        # add() so that a concurrent bump is not overwritten
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_data_version(user_id):
+    """Move the data version of a user on, invalidating cached data
+
+    Bumped again once the transaction commits: a request reading
+    between the first bump and the commit sees the new version but
+    the old rows, and caches them under that version.
+    """
+    if user_id is None:
+        return
+    _bump(user_id)
+    # runs right away outside of a transaction
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _bump(user_id))
+
+
+def _bump(user_id):
+    """Set the data version of a user to a newer one"""
+    key = data_version_key(user_id)
+    # always newer than the current version, even if the clock
+    # has not moved on since the previous bump
+    version = time.time_ns()
+    current = cache.get(key)
+    if current is not None and current >= version:
+        version = current + 1
+    cache.set(key, version, None)
+
+
+def check_shared_cache():
+    """Refuse the list cache when its caches are not shared
+
+    With a per-process cache a write only bumps the data version in
+    the process that handled it, the others would keep serving their
+    cached lists and answering 304 to stale ETags.
+    """
+    if not settings.LIST_CACHE_ENABLED:
+        return
+    # the data versions are in the default cache
+    for alias in sorted({'default', settings.LIST_CACHE_ALIAS}):
+        backend = settings.CACHES.get(alias, {}).get('BACKEND')
+        if backend in PROCESS_LOCAL_CACHES:
+            raise ImproperlyConfigured(
+                f'LIST_CACHE_ENABLED needs a cache shared between '
+                f'processes but the {alias!r} cache is {backend}, set '
+                f'CACHE_URL or LIST_CACHE_ENABLED=0'
+            )
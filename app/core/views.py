@@ -0,0 +1,85 @@
+import hmac
+import ipaddress
+import mimetypes
+import os
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import patch_cache_control
+
+from core.instrumentation import registry
+from core.uploadhandlers import UPLOAD_TMP_DIR
+
+
+def is_loopback(request):
+    """Return True if the request comes from the same host"""
+    address = request.META.get('REMOTE_ADDR', '')
+    try:
+        return ipaddress.ip_address(address).is_loopback
+    except ValueError:
+        return False
+
+
+def metrics(request):
+    """Return the instrumentation metrics for Prometheus"""
+    if not settings.INSTRUMENTATION_ENABLED:
+        raise Http404
+    # when a token is set, scrapers send it as a bearer token
+    token = settings.INSTRUMENTATION_METRICS_TOKEN
+    if token:
+        expected = f'Bearer {token}'
+        given = request.META.get('HTTP_AUTHORIZATION', '')
+        if not hmac.compare_digest(given.encode(), expected.encode()):
+            return HttpResponse(status=401)
+    elif not is_loopback(request):
+        # without a token only a scraper on the same host is served
+        # > behind a proxy every request comes from the proxy's
+        #   address, so other private addresses are not trusted
+        return HttpResponse(status=403)
+
+    # the token cache counters are added by user.authentication
+    body = registry.render(extra=(
+        ('instrumentation_sample_rate', 'gauge',
+         'Share of the requests that are measured.',
+         settings.INSTRUMENTATION_SAMPLE_RATE),
+    ))
+    return HttpResponse(
+        body, content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+
+def media(request, path):
+    """Serve an uploaded file, handing it to the proxy when it can"""
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+    # uploads still being received are not served
+    tmp_dir = safe_join(settings.MEDIA_ROOT, UPLOAD_TMP_DIR)
+    if os.path.commonpath([full_path, tmp_dir]) == tmp_dir:
+        raise Http404
+
+    content_type, encoding = mimetypes.guess_type(full_path)
+    content_type = content_type or 'application/octet-stream'
+    if settings.MEDIA_ACCEL_REDIRECT:
+        # nginx sends the file from its internal location
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = (
+            settings.MEDIA_ACCEL_REDIRECT.rstrip('/') + '/' + quote(path)
+        )
+    else:
+        # sent with sendfile by servers supporting wsgi.file_wrapper
+        response = FileResponse(
+            open(full_path, 'rb'), content_type=content_type
+        )
+    if encoding:
+        response['Content-Encoding'] = encoding
+    patch_cache_control(
+        response, public=True, max_age=settings.MEDIA_CACHE_MAX_AGE
+    )
+    return response
@@ -0,0 +1,68 @@
+import multiprocessing
+import os
+import shutil
+
+
+# Production server, run with `gunicorn` from this directory
+# > see docker-compose.prod.yml and the README
+# > every value can be set from the environment
+
+# SERVER_INTERFACE picks app/wsgi.py (the default) or app/asgi.py
+# > Django 3.0 runs every view synchronously, so WSGI with threads
+#   is the faster of the two, ASGI is there for async middleware
+#   or views added later
+SERVER_INTERFACE = os.environ.get('SERVER_INTERFACE', 'wsgi')
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:8000')
+
+# worker processes, each with its own interpreter so they run in
+# parallel, the usual starting point is 2 per CPU core + 1
+workers = int(os.environ.get(
+    'GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1
+))
+# threads per worker process, they overlap the time spent waiting
+# on the database, see DB_POOL_SIZE in app/settings.py
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+if SERVER_INTERFACE == 'asgi':
+    wsgi_app = 'app.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    wsgi_app = 'app.wsgi:application'
+    worker_class = 'gthread' if threads > 1 else 'sync'
+
+# a request taking longer than this restarts its worker
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+# connections from the proxy are kept open between requests
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', 5))
+
+# workers are replaced after this many requests, at slightly different
+# times, so a slow memory leak can not build up
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 1000))
+max_requests_jitter = int(
+    os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', 100)
+)
+
+# load Django once in the master, the workers share its memory
+preload_app = bool(int(os.environ.get('GUNICORN_PRELOAD', 1)))
+
+# the proxy sets X-Forwarded-*, trust it
+forwarded_allow_ips = os.environ.get('GUNICORN_FORWARDED_ALLOW_IPS', '*')
+
+# the worker heartbeat files, in memory rather than on the
+# container's overlay filesystem
+worker_tmp_dir = os.environ.get('GUNICORN_WORKER_TMP_DIR', '/dev/shm')
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('GUNICORN_LOG_LEVEL', 'info')
+
+
+def on_starting(server):
+    """Drop the metrics files left by a previous run"""
+    # counters start from zero again with a new master process
+    # > see INSTRUMENTATION_METRICS_DIR in app/settings.py
+    directory = os.environ.get('INSTRUMENTATION_METRICS_DIR')
+    if directory:
+        shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,322 @@
+from django.db import connection, models, transaction
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+from core.models import Recipe
+from core.search import refresh_search_vectors
+from core.versions import bump_data_version
+from recipe.serializers import BatchedManyRelatedField, save_missing_related
+
+
+def bulk_insert(model, objs, batch_size):
+    """Insert objects with bulk_create and make sure their pks are set"""
+    # PostgreSQL returns the new ids from a bulk INSERT
+    # > other databases (e.g. sqlite in tests) do not
+    #   so the objects are saved one by one instead
+    if connection.features.can_return_rows_from_bulk_insert:
+        return model.objects.bulk_create(objs, batch_size=batch_size)
+
+    for obj in objs:
+        obj.save(force_insert=True)
+    return objs
+
+
+def is_id(value):
+    """Return True if value is an integer id"""
+    # True and False are ints too and would match the ids 1 and 0
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def duplicate_message(model, field_name):
+    """Return the error for a value the user already has"""
+    return _('%(model)s with this %(field)s already exists.') % {
+        'model': model._meta.verbose_name,
+        'field': model._meta.get_field(field_name).verbose_name,
+    }
+
+
+def per_user_unique_fields(model):
+    """Return the fields a model keeps unique per user, e.g. name"""
+    return [
+        field_name
+        for constraint in model._meta.constraints
+        if isinstance(constraint, models.UniqueConstraint) and
+        len(constraint.fields) == 2 and 'user' in constraint.fields
+        for field_name in constraint.fields if field_name != 'user'
+    ]
+
+
+class BulkModelMixin:
+    """Add a ../bulk/ endpoint creating, updating or deleting many objects
+
+    POST   a list of objects to create them
+    PATCH  a list of objects with an 'id' to partially update them
+    DELETE {'ids': [...]} to delete them
+
+    Each request is validated in one pass and written in one
+    transaction. If any item is invalid nothing is written and the
+    errors are returned in a list matching the position of each item.
+    """
+
+    # largest number of items accepted in one request
+    bulk_max_items = 10000
+    # number of rows written per INSERT / UPDATE statement
+    bulk_batch_size = 1000
+
+    @action(methods=['POST', 'PATCH', 'DELETE'], detail=False,
+            url_path='bulk')
+    def bulk(self, request):
+        """Create, update or delete objects in bulk"""
+        if request.method == 'DELETE':
+            return self.bulk_destroy(request)
+
+        items = request.data
+        if not isinstance(items, list):
+            raise ValidationError(_('Expected a list of items'))
+        if len(items) > self.bulk_max_items:
+            raise ValidationError(
+                _('At most %d items are allowed') % self.bulk_max_items
+            )
+
+        if request.method == 'PATCH':
+            return self.bulk_update(items)
+        return self.bulk_create(items)
+
+    def get_bulk_defaults(self):
+        """Return the field values set on every created object"""
+        return {'user': self.request.user}
+
+    def bulk_create(self, items):
+        """Validate a list of items and create them"""
+        serializer = self.get_serializer(data=items, many=True)
+        # the items share the fields of a single child serializer
+        self.prefetch_related(serializer.child, items)
+        if not serializer.is_valid():
+            return Response(
+                {'errors': serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        errors = self.unique_errors(serializer.validated_data)
+        if any(errors):
+            return Response(
+                {'errors': errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        with transaction.atomic():
+            objs = self._write(serializer.validated_data)
+
+        return Response(
+            {'ids': [obj.pk for obj in objs]},
+            status=status.HTTP_201_CREATED
+        )
+
+    def bulk_update(self, items):
+        """Validate a list of partial updates and apply them"""
+        # load every object in one query, limited to the user's objects
+        ids = [item.get('id') for item in items if isinstance(item, dict)]
+        instances = self.get_queryset().in_bulk(
+            [pk for pk in ids if is_id(pk)]
+        )
+
+        resolved = self.prefetch_related(self.get_serializer(), items)
+
+        errors = []
+        updates = []
+        for item in items:
+            instance = None
+            if isinstance(item, dict) and is_id(item.get('id')):
+                instance = instances.get(item['id'])
+            if instance is None:
+                errors.append({'id': [_('Not found.')]})
+                continue
+
+            serializer = self.get_serializer(
+                instance, data=item, partial=True
+            )
+            for name, objects in resolved.items():
+                serializer.fields[name].resolved = objects
+            if serializer.is_valid():
+                errors.append({})
+                updates.append((instance, serializer.validated_data))
+            else:
+                errors.append(serializer.errors)
+
+        if not any(errors):
+            errors = self.unique_errors(
+                [data for _instance, data in updates],
+                [instance for instance, _data in updates]
+            )
+        if any(errors):
+            return Response(
+                {'errors': errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        with transaction.atomic():
+            objs = self._write(
+                [data for _instance, data in updates],
+                [instance for instance, _data in updates]
+            )
+
+        return Response({'ids': [obj.pk for obj in objs]})
+
+    def bulk_destroy(self, request):
+        """Delete the objects with the given ids"""
+        ids = request.data.get('ids') if isinstance(
+            request.data, dict
+        ) else None
+        if not isinstance(ids, list) or not all(is_id(pk) for pk in ids):
+            raise ValidationError({'ids': [_('Expected a list of ids')]})
+
+        with transaction.atomic():
+            queryset = self.get_queryset().filter(id__in=ids)
+            deleted = queryset.delete()[1].get(
+                queryset.model._meta.label, 0
+            )
+
+        return Response({'deleted': deleted})
+
+    def prefetch_related(self, serializer, items):
+        """Resolve the related ids and names of all items at once
+
+        Returns the objects found for each related field by name.
+        """
+        resolved = {}
+        for name, field in serializer.fields.items():
+            if isinstance(field, BatchedManyRelatedField):
+                field.prefetch(items)
+                resolved[name] = field.resolved
+        return resolved
+
+    def unique_errors(self, validated_items, instances=None):
+        """Return the errors of items reusing a value unique per user
+
+        Checks the items against each other and against the user's
+        existing objects with a single query per unique field, instead
+        of letting the INSERT fail on the constraint.
+        """
+        model = self.get_queryset().model
+        errors = [{} for _item in validated_items]
+        for field_name in per_user_unique_fields(model):
+            values = []
+            for index, data in enumerate(validated_items):
+                if field_name in data:
+                    values.append(data[field_name])
+                elif instances is not None:
+                    values.append(getattr(instances[index], field_name))
+                else:
+                    values.append(None)
+
+            # the pk of the object using each value, if any
+            taken = dict(model.objects.filter(**{
+                'user': self.request.user,
+                f'{field_name}__in': [v for v in values if v is not None],
+            }).values_list(field_name, 'pk'))
+
+            seen = set()
+            for index, value in enumerate(values):
+                if value is None:
+                    continue
+                own_pk = instances[index].pk if instances else None
+                # another object has the value, or an earlier item does
+                if value in seen or taken.get(value, own_pk) != own_pk:
+                    errors[index][field_name] = [
+                        duplicate_message(model, field_name)
+                    ]
+                seen.add(value)
+
+        return errors
+
+    def recipes_using(self, model, objs):
+        """Return the ids of the recipes using any of the objects"""
+        for field in Recipe._meta.many_to_many:
+            if field.related_model is model:
+                return Recipe.objects.filter(**{
+                    f'{field.name}__in': objs
+                }).values_list('id', flat=True).distinct()
+        return []
+
+    def _write(self, validated_items, instances=None):
+        """Write validated items with bulk INSERT / UPDATE statements"""
+        model = self.get_queryset().model
+        m2m_fields = {
+            field.name: field for field in model._meta.many_to_many
+        }
+
+        # split each item into its columns and its many-to-many values
+        objs = []
+        columns = set()
+        relations = []
+        for index, data in enumerate(validated_items):
+            data = dict(data)
+            related = {
+                name: data.pop(name) for name in m2m_fields if name in data
+            }
+            if instances is None:
+                obj = model(**self.get_bulk_defaults(), **data)
+            else:
+                obj = instances[index]
+                for name, value in data.items():
+                    setattr(obj, name, value)
+                columns.update(data)
+            objs.append(obj)
+            relations.append(related)
+
+        if instances is None:
+            bulk_insert(model, objs, self.bulk_batch_size)
+        elif columns or any(relations):
+            # bulk_update() does not set auto_now fields
+            # > the many-to-many values count as a change too
+            now = timezone.now()
+            for obj in objs:
+                obj.updated_at = now
+            columns.add('updated_at')
+            model.objects.bulk_update(
+                objs, columns, batch_size=self.bulk_batch_size
+            )
+
+        # create the tags and ingredients given by name
+        save_missing_related(self.request.user, [
+            values for related in relations for values in related.values()
+        ])
+
+        # replace the many-to-many rows with one DELETE and
+        # one INSERT per relation, for all of the objects at once
+        for name, field in m2m_fields.items():
+            through = field.remote_field.through
+            source = field.m2m_field_name() + '_id'
+            target = field.m2m_reverse_field_name() + '_id'
+            changed = [
+                (obj, related[name])
+                for obj, related in zip(objs, relations) if name in related
+            ]
+            if not changed:
+                continue
+
+            if instances is not None:
+                through.objects.filter(**{
+                    f'{source}__in': [obj.pk for obj, _values in changed]
+                }).delete()
+            through.objects.bulk_create([
+                through(**{source: obj.pk, target: value.pk})
+                for obj, values in changed
+                for value in {value.pk: value for value in values}.values()
+            ], batch_size=self.bulk_batch_size)
+
+        # bulk writes do not send the model signals
+        # so the recipe search vectors are refreshed here
+        # and the user's cached responses invalidated
+        if model is Recipe:
+            refresh_search_vectors(obj.pk for obj in objs)
+        elif instances is not None and 'name' in columns:
+            # renamed tags or ingredients change the recipes using them
+            refresh_search_vectors(self.recipes_using(model, objs))
+        bump_data_version(self.request.user.pk)
+
+        return objs
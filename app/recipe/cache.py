@@ -0,0 +1,76 @@
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags
+
+from rest_framework import status
+from rest_framework.response import Response
+
+from core.versions import get_data_version
+
+
+class CachedListMixin:
+    """Cache the list responses of a viewset per user
+
+    Responses are keyed by the user, the endpoint, the query params and
+    the user's data version (see core.versions), so any change to the
+    user's recipes, tags or ingredients invalidates them at once.
+
+    The key also gives a strong ETag: a request with a matching
+    If-None-Match header is answered with 304 Not Modified without
+    running a single query on the recipe tables.
+
+    Turned off, ETags included, unless LIST_CACHE_ENABLED is set.
+    """
+
+    def list_cache_key(self, request):
+        """Return the digest identifying a list response"""
+        # the host is part of the key because the pagination
+        # links in the response are absolute urls
+        parts = [
+            request.user.pk,
+            type(self).__name__,
+            request.get_host(),
+            request.path,
+            sorted(request.query_params.lists()),
+            request.accepted_renderer.format,
+            get_data_version(request.user.pk),
+        ]
+        raw = json.dumps(parts, sort_keys=True, default=str)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def list(self, request, *args, **kwargs):
+        # only with a cache shared by every process, see core.versions
+        if not settings.LIST_CACHE_ENABLED:
+            return super().list(request, *args, **kwargs)
+
+        cache = caches[settings.LIST_CACHE_ALIAS]
+        digest = self.list_cache_key(request)
+        etag = f'"{digest}"'
+
+        # the client already has this version of the list
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match and etag in parse_etags(if_none_match):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            cache_key = f'list-response:{request.user.pk}:{digest}'
+            data = cache.get(cache_key)
+            if data is None:
+                response = super().list(request, *args, **kwargs)
+                # streamed lists are not held in memory, nor cached
+                if isinstance(response, Response):
+                    cache.set(
+                        cache_key, response.data, settings.LIST_CACHE_TIMEOUT
+                    )
+            else:
+                response = Response(data)
+
+        response['ETag'] = etag
+        # each user gets their own list, shared caches must not keep it
+        # and clients should check it is still current with the ETag
+        patch_vary_headers(response, ('Authorization',))
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
@@ -0,0 +1,209 @@
+from itertools import islice
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.http import StreamingHttpResponse
+
+from rest_framework import serializers
+from rest_framework.response import Response
+
+from core.instrumentation import measure
+from recipe.renderers import stream_json_array
+
+
+# serializer fields whose to_representation() returns a column value
+# unchanged (or as the same JSON), so it can be skipped
+PASSTHROUGH_FIELDS = (
+    serializers.IntegerField,
+    serializers.CharField,
+    serializers.BooleanField,
+)
+
+
+class FastListSerializer:
+    """Read-only list serializer working from values() rows
+
+    Builds the same output as serializer_class(many=True).data, without
+    creating model instances or running each field of the serializer
+    for every row:
+    - columns come straight from queryset.values()
+    - many-to-many ids are read from the through tables, ordered by id
+    - only fields that actually convert the value (e.g. a Decimal price
+      to "5.00") go through the serializer field
+
+    Only serializers made of model columns, read-only annotations and
+    primary key many-to-many fields are supported, see is_supported().
+    """
+
+    def __init__(self, serializer_class, fields=None):
+        self.model = serializer_class.Meta.model
+        # an unbound serializer, only used for its fields
+        serializer = serializer_class(context={'fields': fields})
+        self.fields = []
+        self.relations = []
+        for name, field in serializer.fields.items():
+            if isinstance(field, serializers.ManyRelatedField):
+                model_field = self.model._meta.get_field(field.source)
+                self.relations.append((name, model_field))
+            convert = None
+            if not isinstance(field, PASSTHROUGH_FIELDS):
+                convert = field.to_representation
+            self.fields.append((name, convert))
+
+    # results of is_supported() per serializer class
+    _supported = {}
+
+    @classmethod
+    def is_supported(cls, serializer_class):
+        """Return if the fields of a serializer can be read from rows"""
+        if serializer_class not in cls._supported:
+            cls._supported[serializer_class] = cls._check(serializer_class)
+        return cls._supported[serializer_class]
+
+    @staticmethod
+    def _check(serializer_class):
+        model = serializer_class.Meta.model
+        for name, field in serializer_class().fields.items():
+            if field.source != name or field.source == '*':
+                return False
+            try:
+                model_field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                # a plain value annotated by the view's queryset
+                if field.read_only and isinstance(field, PASSTHROUGH_FIELDS):
+                    continue
+                return False
+            if isinstance(field, serializers.ManyRelatedField):
+                if not (model_field.many_to_many and isinstance(
+                        field.child_relation,
+                        serializers.PrimaryKeyRelatedField)):
+                    return False
+            elif model_field.is_relation or isinstance(
+                    field, (serializers.BaseSerializer,
+                            serializers.RelatedField,
+                            serializers.FileField,
+                            serializers.SerializerMethodField)):
+                return False
+        return True
+
+    @property
+    def columns(self):
+        """Return the columns to pass to queryset.values()"""
+        relation_names = {name for name, _field in self.relations}
+        return [
+            name for name, _convert in self.fields
+            if name not in relation_names
+        ]
+
+    def related_ids(self, model_field, pks):
+        """Return the related ids of each row, ordered by id"""
+        through = model_field.remote_field.through
+        source = model_field.m2m_field_name() + '_id'
+        target = model_field.m2m_reverse_field_name() + '_id'
+        related = {pk: [] for pk in pks}
+        # one query on the through table, no join with the related table
+        for pk, related_pk in through.objects.filter(**{
+            f'{source}__in': pks,
+        }).order_by(target).values_list(source, target):
+            related[pk].append(related_pk)
+        return related
+
+    def to_representation(self, rows):
+        """Return the serialized data of a list of values() rows"""
+        with measure('serializer'):
+            return self._to_representation(rows)
+
+    def _to_representation(self, rows):
+        pks = [row['id'] for row in rows]
+        related = {
+            name: self.related_ids(model_field, pks)
+            for name, model_field in self.relations
+        } if pks else {}
+
+        data = []
+        for row in rows:
+            item = {}
+            for name, convert in self.fields:
+                if name in related:
+                    item[name] = related[name][row['id']]
+                    continue
+                value = row[name]
+                if convert is not None and value is not None:
+                    value = convert(value)
+                item[name] = value
+            data.append(item)
+        return data
+
+
+class FastListMixin:
+    """Serve the list action of a viewset with a FastListSerializer
+
+    Falls back to the regular serializer for anything the fast path
+    can not render identically, e.g. ?expand= or nested serializers.
+    Turned off with RECIPE_FAST_LIST=0.
+
+    Unpaginated lists are streamed when asked with ?stream=1, or by
+    default with RECIPE_STREAM_LISTS=1, so the memory used stays the
+    same however many objects the user has.
+    """
+
+    def get_fast_list_serializer(self):
+        """Return a FastListSerializer for the request, or None"""
+        if not settings.RECIPE_FAST_LIST:
+            return None
+        context = self.get_serializer_context()
+        if context.get('expand'):
+            return None
+        serializer_class = self.get_serializer_class()
+        if not FastListSerializer.is_supported(serializer_class):
+            return None
+        return FastListSerializer(serializer_class, context.get('fields'))
+
+    def list(self, request, *args, **kwargs):
+        fast = self.get_fast_list_serializer()
+        if fast is None:
+            return super().list(request, *args, **kwargs)
+
+        # prefetches are not needed, the ids come from the through tables
+        queryset = self.filter_queryset(self.get_queryset())
+        queryset = queryset.prefetch_related(None)
+
+        # the id and the cursor position are always loaded
+        columns = set(fast.columns) | {'id'}
+        if self.paginator is not None:
+            ordering = getattr(self.paginator, 'ordering', ())
+            columns.update(field.lstrip('-') for field in ordering)
+        rows = queryset.values(*columns)
+
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(fast.to_representation(page))
+        if self.should_stream():
+            return self.stream_list(fast, rows)
+        return Response(fast.to_representation(list(rows)))
+
+    def should_stream(self):
+        """Return if the whole list should be streamed as JSON"""
+        # not for the browsable API, which renders the data in a page
+        if self.request.accepted_renderer.format != 'json':
+            return False
+        stream = self.request.query_params.get('stream')
+        if stream is not None:
+            return stream.lower() in ('1', 'true')
+        return settings.RECIPE_STREAM_LISTS
+
+    def stream_list(self, fast, rows):
+        """Stream the rows as a JSON array, one chunk at a time"""
+        # iterator() reads the rows from a server-side cursor on
+        # PostgreSQL instead of loading all of them at once
+        # > the many-to-many ids are loaded for one chunk at a time
+        size = settings.RECIPE_STREAM_CHUNK_SIZE
+        rows = rows.iterator(chunk_size=size)
+        chunks = (
+            fast.to_representation(chunk)
+            for chunk in iter(lambda: list(islice(rows, size)), [])
+        )
+        return StreamingHttpResponse(
+            stream_json_array(chunks),
+            content_type='application/json'
+        )
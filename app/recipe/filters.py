@@ -0,0 +1,74 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import Count, Exists, F, OuterRef, Q
+
+from core.models import Recipe
+from core.search import SEARCH_CONFIG, search_enabled
+
+
+# 'any' returns recipes that have at least one of the given ids
+# 'all' returns recipes that have every one of the given ids
+MATCH_MODES = ('any', 'all')
+
+
+def filter_by_related(queryset, field_name, ids, mode='any'):
+    """Filter a queryset by the ids of a many-to-many relation
+
+    The filter is a single subquery on the through table so every
+    object is returned once, however many of the ids it matches.
+    """
+    # e.g. Recipe.tags is stored in the core_recipe_tags through table
+    # with a 'recipe' column pointing at us and a 'tag' column
+    field = queryset.model._meta.get_field(field_name)
+    through = field.remote_field.through
+    source = field.m2m_field_name()
+    target = field.m2m_reverse_field_name()
+    ids = set(ids)
+
+    if mode == 'all':
+        # SELECT recipe_id FROM through WHERE tag_id IN (...)
+        # GROUP BY recipe_id HAVING COUNT(tag_id) = len(ids)
+        # > the through table is unique on (recipe, tag)
+        #   so the count is the number of distinct ids matched
+        matches = through.objects.filter(
+            **{f'{target}__in': ids}
+        ).values(source).annotate(
+            matched=Count(target)
+        ).filter(matched=len(ids)).values(source)
+
+        return queryset.filter(pk__in=matches)
+
+    # WHERE EXISTS (SELECT 1 FROM through
+    #               WHERE recipe_id = recipe.id AND tag_id IN (...))
+    # > unlike a JOIN this never duplicates rows
+    matches = through.objects.filter(
+        **{source: OuterRef('pk'), f'{target}__in': ids}
+    )
+    return queryset.filter(Exists(matches))
+
+
+def search_recipes(queryset, text):
+    """Full-text search recipes by title, tag names and ingredient names
+
+    The results are ordered by relevance, best match first.
+    """
+    if search_enabled():
+        # WHERE search_vector @@ plainto_tsquery('english', text)
+        # > served by the GIN index on search_vector
+        query = SearchQuery(text, config=SEARCH_CONFIG)
+        return queryset.filter(search_vector=query).annotate(
+            rank=SearchRank(F('search_vector'), query)
+        ).order_by('-rank', '-id')
+
+    # fallback for databases without full-text search (e.g. sqlite)
+    # > every word must appear in the title, a tag or an ingredient
+    for word in text.split():
+        tags = Recipe.tags.through.objects.filter(
+            recipe=OuterRef('pk'), tag__name__icontains=word
+        )
+        ingredients = Recipe.ingredients.through.objects.filter(
+            recipe=OuterRef('pk'), ingredient__name__icontains=word
+        )
+        queryset = queryset.filter(
+            Q(title__icontains=word) | Q(Exists(tags)) | Q(Exists(ingredients))
+        )
+    return queryset
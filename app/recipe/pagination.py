@@ -0,0 +1,42 @@
+from rest_framework import pagination
+
+
+class OptInCursorPagination(pagination.CursorPagination):
+    """Keyset pagination that is only used when the client asks for it"""
+
+    # default number of items on a page
+    # > the client can change this with ?page_size=
+    # > but never above max_page_size
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """Paginate only if ?cursor= or ?page_size= was provided"""
+        # without either param we return None
+        # which tells the ListModelMixin to return the full list
+        # so existing clients keep getting a plain JSON array
+        params = request.query_params
+        if (self.cursor_query_param not in params and
+                self.page_size_query_param not in params):
+            return None
+
+        # the cursor is an opaque base64 string holding the position
+        # of the last item on the previous page
+        # > the page is fetched with 'WHERE id < position LIMIT n'
+        #   so page 10,000 costs the same as page 1
+        # > no COUNT(*) is ever run
+        return super().paginate_queryset(queryset, request, view)
+
+
+class RecipeCursorPagination(OptInCursorPagination):
+    """Cursor pagination for recipes, newest first"""
+    ordering = ('-id',)
+
+
+class RecipeAttrCursorPagination(OptInCursorPagination):
+    """Cursor pagination for tags and ingredients, ordered by name"""
+    # the cursor position is taken from the name
+    # > names are unique per user so no tie breaker is needed
+    #   and the (user, name) unique index serves the ordering
+    ordering = ('-name',)
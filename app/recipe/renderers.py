@@ -0,0 +1,75 @@
+import json
+
+from rest_framework import renderers
+from rest_framework.utils import encoders
+
+try:
+    # optional, a lot faster than the json module
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(data):
+    """Encode data as compact JSON bytes, like DRF's JSONRenderer"""
+    if orjson is not None:
+        try:
+            # handles what orjson does not itself, e.g. lazy strings
+            content = orjson.dumps(
+                data, default=encoders.JSONEncoder().default
+            )
+        except TypeError:
+            # e.g. an integer too big for orjson
+            content = None
+        if content is not None:
+            return escape_line_separators(content)
+
+    content = json.dumps(
+        data, cls=encoders.JSONEncoder, ensure_ascii=False,
+        separators=(',', ':'),
+    ).encode()
+    return escape_line_separators(content)
+
+
+def escape_line_separators(content):
+    """Escape U+2028 and U+2029, like DRF, so the JSON is valid JS"""
+    return content.replace(
+        '\u2028'.encode(), b'\\u2028'
+    ).replace(
+        '\u2029'.encode(), b'\\u2029'
+    )
+
+
+def stream_json_array(chunks):
+    """Yield a JSON array made of the items of each chunk
+
+    Only one chunk is held in memory at a time, whatever the length
+    of the whole array.
+    """
+    yield b'['
+    first = True
+    for chunk in chunks:
+        if not chunk:
+            continue
+        # the items of the chunk without the surrounding brackets
+        content = dumps(chunk)[1:-1]
+        if not first:
+            yield b','
+        yield content
+        first = False
+    yield b']'
+
+
+class FastJSONRenderer(renderers.JSONRenderer):
+    """JSON renderer using orjson when it is installed
+
+    Gives the same bytes as the JSONRenderer, which is still used for
+    indented output or when the JSON settings are not the defaults.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if (orjson is None or data is None or indent is not None or
+                self.ensure_ascii or not self.compact):
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps(data)
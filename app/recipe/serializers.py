@@ -1,48 +1,295 @@
+from django.db import transaction
+from django.db.models import Q
+from django.utils.translation import gettext_lazy as _
 # import serializer from the rest framework
 from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
 
 # import our Tag model
-from core.models import Tag, Ingredient, Recipe
+from core.models import Tag, Ingredient, Recipe, RecipeImageRendition
 
 
 class TagSerializer(serializers.ModelSerializer):
     """Serializer for tag object"""
+    # number of recipes using the tag, annotated by the list view
+    # > left out where the tag was not loaded with the annotation
+    recipe_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         # point to the model we want to communicate with
         model = Tag
         # fields to return
-        fields = ('id', 'name')
+        fields = ('id', 'name', 'recipe_count')
         # make the id read only
         read_only_Fields = ('id',)
 
 
 class IngredientSerializer(serializers.ModelSerializer):
     """Serializer for an ingredient object"""
+    # number of recipes using the ingredient, annotated by the list view
+    recipe_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         # point serializer to correct model
         model = Ingredient
         # list the fields to return in our serializer
-        fields = ('id', 'name')
+        fields = ('id', 'name', 'recipe_count')
         read_only_fields = ('id',)
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+def save_missing_related(user, related_lists):
+    """Create the unsaved tags or ingredients found in related_lists
+
+    The lists hold related objects as returned by a
+    BatchedManyRelatedField, the unsaved ones are created for the user
+    and replaced in place by their saved rows.
+    """
+    missing = {}
+    for objs in related_lists:
+        for obj in objs:
+            if obj.pk is None:
+                missing.setdefault(type(obj), set()).add(obj.name)
+
+    for model, names in missing.items():
+        # INSERT ... ON CONFLICT DO NOTHING so that a name created by
+        # a concurrent request meanwhile is reused instead of failing
+        # on the (user, name) unique constraint
+        model.objects.bulk_create(
+            [model(user=user, name=name) for name in names],
+            ignore_conflicts=True,
+        )
+        # the ids are not returned when conflicts are ignored
+        saved = {
+            obj.name: obj
+            for obj in model.objects.filter(user=user, name__in=names)
+        }
+        for objs in related_lists:
+            for index, obj in enumerate(objs):
+                if obj.pk is None and isinstance(obj, model):
+                    objs[index] = saved[obj.name]
+
+    # an id and a new name could now point to the same row
+    if missing:
+        for objs in related_lists:
+            objs[:] = list({obj.pk: obj for obj in objs}.values())
+
+
+class BatchedManyRelatedField(serializers.ManyRelatedField):
+    """List of related objects resolved with a single query
+
+    With create_by_name the list may also hold names, e.g.
+    [1, "Vegan", {"name": "Dessert"}]. Names not found are returned
+    as unsaved objects, see save_missing_related.
+    """
+
+    default_error_messages = {
+        'does_not_exist': _(
+            'Invalid pk(s) "{pk_values}" - object(s) do not exist.'
+        ),
+        'invalid_name': _(
+            'Invalid name "{name}" - must be 1 to {max_length} characters.'
+        ),
+    }
+
+    def __init__(self, create_by_name=False, **kwargs):
+        self.create_by_name = create_by_name
+        # objects resolved ahead for a whole batch, see prefetch
+        self.resolved = None
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        """Resolve every primary key and name in one query"""
+        # by default DRF runs queryset.get(pk=...) for each id
+        # so a recipe with 40 ingredients costs 40 SELECTs
+        keys = self.to_keys(data)
+        if not self.allow_empty and len(keys) == 0:
+            self.fail('empty')
+
+        if self.resolved is None:
+            objects = self.resolve(keys)
+        else:
+            objects = {
+                key: self.resolved[key]
+                for key in keys if key in self.resolved
+            }
+
+        # report all of the missing ids together
+        missing = [
+            str(value) for kind, value in keys
+            if kind == 'pk' and (kind, value) not in objects
+        ]
+        if missing:
+            self.fail('does_not_exist', pk_values=', '.join(missing))
+
+        # names not found yet are created along with the recipe
+        model = self.child_relation.get_queryset().model
+        for kind, value in keys:
+            if kind == 'name':
+                objects.setdefault((kind, value), model(name=value))
+
+        # the same object may have been given by id and by name
+        related = {}
+        for key in keys:
+            obj = objects[key]
+            related.setdefault(obj.pk or key, obj)
+        return list(related.values())
+
+    def prefetch(self, items):
+        """Resolve the ids and names of many items with one query
+
+        Used for bulk requests, where validating each item on its own
+        would run one query per item.
+        """
+        keys = []
+        for item in items:
+            if not isinstance(item, dict) or self.field_name not in item:
+                continue
+            try:
+                keys.extend(self.to_keys(item[self.field_name]))
+            except serializers.ValidationError:
+                # reported when the item itself is validated
+                continue
+        self.resolved = self.resolve(list(dict.fromkeys(keys)))
+
+    def to_keys(self, data):
+        """Return ('pk', 1) or ('name', 'Vegan') for each item of data"""
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+
+        child = self.child_relation
+        keys = []
+        for item in data:
+            if self.create_by_name and isinstance(item, dict):
+                item = item.get('name')
+                if not isinstance(item, str):
+                    child.fail(
+                        'incorrect_type', data_type=type(item).__name__
+                    )
+                keys.append(('name', self.to_name(item)))
+                continue
+            # ids arrive as ints in JSON and as strings in form data
+            # > a string that is not a number is a name
+            if isinstance(item, bool):
+                child.fail('incorrect_type', data_type=type(item).__name__)
+            try:
+                keys.append(('pk', int(item)))
+            except (TypeError, ValueError):
+                if not self.create_by_name or not isinstance(item, str):
+                    child.fail(
+                        'incorrect_type', data_type=type(item).__name__
+                    )
+                keys.append(('name', self.to_name(item)))
+
+        # drop duplicates but keep the order the items were given in
+        return list(dict.fromkeys(keys))
+
+    def resolve(self, keys):
+        """Return the existing objects of keys, keyed by them"""
+        pks = [value for kind, value in keys if kind == 'pk']
+        names = [value for kind, value in keys if kind == 'name']
+        if not pks and not names:
+            return {}
+
+        lookup = Q(pk__in=pks)
+        if names:
+            lookup |= Q(name__in=names)
+        found = self.child_relation.get_queryset().filter(lookup)
+        objects = {('pk', obj.pk): obj for obj in found}
+        objects.update({('name', obj.name): obj for obj in found})
+        return objects
+
+    def to_name(self, name):
+        """Validate a tag or ingredient name"""
+        name = name.strip()
+        max_length = self.child_relation.get_queryset().model._meta.get_field(
+            'name'
+        ).max_length
+        if not name or len(name) > max_length:
+            self.fail('invalid_name', name=name, max_length=max_length)
+        return name
+
+
+class UserPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Primary key field limited to the authenticated user's objects"""
+
+    def get_queryset(self):
+        """Return only the objects owned by the requesting user"""
+        queryset = super().get_queryset()
+        request = self.context.get('request')
+        if request is None:
+            return queryset
+        return queryset.filter(user=request.user)
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        """Use BatchedManyRelatedField when many=True"""
+        # same as RelatedField.many_init with our own list field
+        create_by_name = kwargs.pop('create_by_name', False)
+        list_kwargs = {
+            'child_relation': cls(*args, **kwargs),
+            'create_by_name': create_by_name,
+        }
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BatchedManyRelatedField(**list_kwargs)
+
+
+class SparseFieldsMixin:
+    """Render only the fields and nested relations a view asked for
+
+    The view puts in the serializer context
+    - 'fields': the names of the fields to render, None for all
+    - 'expand': relations to render as objects instead of ids
+    """
+
+    # serializers of the relations that can be expanded
+    expandable = {}
+
+    def get_fields(self):
+        fields = super().get_fields()
+        for name in self.context.get('expand', ()):
+            if name in self.expandable:
+                fields[name] = self.expandable[name](
+                    many=True, read_only=True
+                )
+
+        requested = self.context.get('fields')
+        if requested is None:
+            return fields
+        for name in list(fields):
+            if name not in requested:
+                del fields[name]
+        return fields
+
+
+class RecipeSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     """Serialize a recipe"""
 
+    # ?expand=tags,ingredients renders these as objects instead of ids
+    expandable = {
+        'tags': TagSerializer,
+        'ingredients': IngredientSerializer,
+    }
+
     # primary key related fields of ingredient
     # lists only the primary key ids
-    ingredients = serializers.PrimaryKeyRelatedField(
+    # > the ids are validated with one query
+    #   and must belong to the authenticated user
+    # > names can be given instead of ids, the ingredients
+    #   that do not exist yet are created with the recipe
+    ingredients = UserPrimaryKeyRelatedField(
         many=True,
-        queryset=Ingredient.objects.all()
+        queryset=Ingredient.objects.all(),
+        create_by_name=True,
     )
     # primary key related fields of tag
     # lists only the primary keys
     # can also list RelatedField
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = UserPrimaryKeyRelatedField(
         many=True,
-        queryset=Tag.objects.all()
+        queryset=Tag.objects.all(),
+        create_by_name=True,
     )
 
     class Meta:
@@ -58,6 +305,26 @@ class RecipeSerializer(serializers.ModelSerializer):
         # read only fields
         read_only_fields = ('id',)
 
+    def create(self, validated_data):
+        """Create a recipe and the tags and ingredients it names"""
+        # one transaction so a failed recipe leaves no new tags behind
+        with transaction.atomic():
+            self.save_missing_related(validated_data['user'], validated_data)
+            return super().create(validated_data)
+
+    def update(self, instance, validated_data):
+        """Update a recipe and create the tags and ingredients it names"""
+        with transaction.atomic():
+            self.save_missing_related(instance.user, validated_data)
+            return super().update(instance, validated_data)
+
+    def save_missing_related(self, user, validated_data):
+        """Create the tags and ingredients that were given by name"""
+        save_missing_related(user, [
+            validated_data[name] for name in ('tags', 'ingredients')
+            if name in validated_data
+        ])
+
 # Notice that the difference between
 # RecipeSerializer and RecipeDetailSerializer
 # is that RecipeSerializer returns the Primary Key Related Fields
@@ -67,6 +334,16 @@ class RecipeSerializer(serializers.ModelSerializer):
 # this is call Nesting Serializers inside each other
 
 
+class RecipeImageRenditionSerializer(serializers.ModelSerializer):
+    """Serializer for a resized copy of a recipe image"""
+    url = serializers.FileField(source='file', read_only=True)
+
+    class Meta:
+        model = RecipeImageRendition
+        fields = ('size', 'format', 'width', 'height', 'url')
+        read_only_fields = fields
+
+
 class RecipeDetailSerializer(RecipeSerializer):
     """Serialize a recipe detail
     """
@@ -74,12 +351,29 @@ class RecipeDetailSerializer(RecipeSerializer):
     # read_only: you can not create a recipe by providing this values
     ingredients = IngredientSerializer(many=True, read_only=True)
     tags = TagSerializer(many=True, read_only=True)
+    image_renditions = RecipeImageRenditionSerializer(
+        many=True,
+        read_only=True
+    )
+
+    class Meta(RecipeSerializer.Meta):
+        # the detail also shows the image and its processing state
+        fields = RecipeSerializer.Meta.fields + (
+            'image', 'image_status', 'image_renditions',
+        )
+        read_only_fields = ('id', 'image', 'image_status')
 
 
 class RecipeImageSerializer(serializers.ModelSerializer):
     """Serializer for uploading images to recipe"""
+    # the renditions are created in the background
+    # > image_status says when they are ready
+    image_renditions = RecipeImageRenditionSerializer(
+        many=True,
+        read_only=True
+    )
 
     class Meta:
         model = Recipe
-        fields = ('id', 'image')
-        read_only_fields = ('id',)
+        fields = ('id', 'image', 'image_status', 'image_renditions')
+        read_only_fields = ('id', 'image_status')
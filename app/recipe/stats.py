@@ -0,0 +1,174 @@
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import Avg, Case, Count, IntegerField, Value, When
+
+from core.models import Tag, Ingredient, Recipe
+from core.versions import get_data_version
+
+
+# upper bounds of the histogram buckets, the last bucket is open ended
+TIME_BUCKETS = (15, 30, 60, 120)
+PRICE_BUCKETS = (5, 10, 20, 50)
+PRICE_PERCENTILES = (25, 50, 75, 90)
+# number of most used tag / ingredient pairs returned
+TOP_COMBINATIONS = 10
+
+# the n-th cheapest recipes of a user, numbered by a window function
+PERCENTILE_SQL = (
+    'SELECT rn, price FROM ('
+    '  SELECT price, ROW_NUMBER() OVER (ORDER BY price) AS rn'
+    '  FROM core_recipe WHERE user_id = %s'
+    ') ranked WHERE rn IN ({})'
+)
+
+# pairs of tags (or ingredients) used together on the user's recipes
+COMBINATIONS_SQL = (
+    'SELECT a.{column}, b.{column}, COUNT(*) AS total'
+    ' FROM {table} a'
+    ' JOIN {table} b ON b.recipe_id = a.recipe_id'
+    '  AND a.{column} < b.{column}'
+    ' JOIN core_recipe r ON r.id = a.recipe_id'
+    # only pairs of the user's own tags, older data may link
+    # recipes to the tags of other users
+    ' JOIN {attr_table} ta ON ta.id = a.{column} AND ta.user_id = r.user_id'
+    ' JOIN {attr_table} tb ON tb.id = b.{column} AND tb.user_id = r.user_id'
+    ' WHERE r.user_id = %s'
+    ' GROUP BY a.{column}, b.{column}'
+    ' ORDER BY total DESC, a.{column}, b.{column}'
+    ' LIMIT %s'
+)
+
+
+def format_price(value):
+    """Format a price like the API does, e.g. '5.00'"""
+    if value is None:
+        return None
+    return str(Decimal(str(value)).quantize(Decimal('0.01')))
+
+
+def bucket_labels(edges):
+    """Return the labels of histogram buckets, e.g. '15-30' and '120+'"""
+    lower = (0,) + edges
+    return [f'{low}-{high}' for low, high in zip(lower, edges)] + [
+        f'{edges[-1]}+'
+    ]
+
+
+def histogram(queryset, field, edges):
+    """Count the recipes per bucket of a field with one GROUP BY"""
+    bucket = Case(
+        *[When(**{f'{field}__lt': edge}, then=Value(index))
+          for index, edge in enumerate(edges)],
+        default=Value(len(edges)),
+        output_field=IntegerField(),
+    )
+    counts = dict(
+        queryset.annotate(bucket=bucket).order_by().values('bucket')
+        .annotate(total=Count('id')).values_list('bucket', 'total')
+    )
+    return [
+        {'range': label, 'recipes': counts.get(index, 0)}
+        for index, label in enumerate(bucket_labels(edges))
+    ]
+
+
+def price_percentiles(user, total):
+    """Return the nearest-rank price percentiles, in one query"""
+    if not total:
+        return {f'p{p}': None for p in PRICE_PERCENTILES}
+    ranks = {p: max(1, -(-total * p // 100)) for p in PRICE_PERCENTILES}
+    sql = PERCENTILE_SQL.format(', '.join(['%s'] * len(ranks)))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [user.pk, *ranks.values()])
+        prices = dict(cursor.fetchall())
+    return {f'p{p}': format_price(prices[rank]) for p, rank in ranks.items()}
+
+
+def usage(model, user):
+    """Return the number of recipes using each tag or ingredient"""
+    return list(
+        model.objects.filter(user=user)
+        .annotate(recipes=Count('recipe'))
+        .order_by('-recipes', 'name')
+        .values('id', 'name', 'recipes')
+    )
+
+
+def combinations(relation, user, names):
+    """Return the pairs of tags or ingredients most often used together"""
+    field = Recipe._meta.get_field(relation)
+    through = field.remote_field.through
+    sql = COMBINATIONS_SQL.format(
+        table=connection.ops.quote_name(through._meta.db_table),
+        attr_table=connection.ops.quote_name(
+            field.related_model._meta.db_table
+        ),
+        column=field.m2m_reverse_name(),
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [user.pk, TOP_COMBINATIONS])
+        rows = cursor.fetchall()
+    return [
+        {relation: [names[first], names[second]], 'recipes': total}
+        for first, second, total in rows
+    ]
+
+
+def compute_stats(user):
+    """Return the statistics of a user's recipes
+
+    Everything is aggregated by the database, a few rows per query,
+    whatever the number of recipes.
+    """
+    recipes = Recipe.objects.filter(user=user)
+    totals = recipes.aggregate(
+        recipes=Count('id'),
+        average_time=Avg('time_minutes'),
+        average_price=Avg('price'),
+    )
+    tags = usage(Tag, user)
+    ingredients = usage(Ingredient, user)
+
+    average_time = totals['average_time']
+    return {
+        'recipes': totals['recipes'],
+        'average_time_minutes': (
+            None if average_time is None else round(average_time, 1)
+        ),
+        'average_price': format_price(totals['average_price']),
+        'price_percentiles': price_percentiles(user, totals['recipes']),
+        'time_minutes_histogram': histogram(
+            recipes, 'time_minutes', TIME_BUCKETS
+        ),
+        'price_histogram': histogram(recipes, 'price', PRICE_BUCKETS),
+        'tags': tags,
+        'ingredients': ingredients,
+        'tag_combinations': combinations(
+            'tags', user, {tag['id']: tag['name'] for tag in tags}
+        ),
+        'ingredient_combinations': combinations(
+            'ingredients', user,
+            {item['id']: item['name'] for item in ingredients}
+        ),
+    }
+
+
+def get_stats(user, version=None):
+    """Return the statistics of a user's recipes at a data version
+
+    The statistics are cached under the user's data version (see
+    core.versions), they are only computed again after one of the
+    user's recipes, tags or ingredients has changed.
+    """
+    cache = caches[settings.LIST_CACHE_ALIAS]
+    if version is None:
+        version = get_data_version(user.pk)
+    key = f'recipe-stats:{user.pk}:{version}'
+    stats = cache.get(key)
+    if stats is None:
+        stats = compute_stats(user)
+        cache.set(key, stats, settings.LIST_CACHE_TIMEOUT)
+    return stats
@@ -0,0 +1,111 @@
+import base64
+import binascii
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from core.models import Tag, Ingredient, Recipe, Tombstone
+from recipe import serializers
+
+
+# what a sync returns, per model
+# > the same representations as the list endpoints
+SYNC_MODELS = (
+    ('recipes', Tombstone.RECIPE, Recipe, serializers.RecipeSerializer),
+    ('tags', Tombstone.TAG, Tag, serializers.TagSerializer),
+    ('ingredients', Tombstone.INGREDIENT, Ingredient,
+     serializers.IngredientSerializer),
+)
+
+
+class InvalidSyncToken(ValueError):
+    """Raised for a sync token that was not issued by this server"""
+
+
+def encode_token(moment):
+    """Return the opaque sync token of a point in time"""
+    micros = int(moment.timestamp() * 1000000)
+    return base64.urlsafe_b64encode(str(micros).encode()).decode()
+
+
+def decode_token(token):
+    """Return the point in time of a sync token"""
+    try:
+        micros = int(base64.urlsafe_b64decode(token.encode()).decode())
+        return datetime.fromtimestamp(micros / 1000000, dt_timezone.utc)
+    except (binascii.Error, UnicodeError, ValueError, OverflowError,
+            OSError):
+        raise InvalidSyncToken(token)
+
+
+# start of the oldest transaction of another session that has
+# written something and is still running
+# > its rows are stamped after it started but only become visible
+#   when it commits, however long after that
+RUNNING_WRITES_SQL = (
+    'SELECT min(xact_start) FROM pg_stat_activity'
+    ' WHERE datname = current_database()'
+    ' AND backend_xid IS NOT NULL'
+    ' AND pid <> pg_backend_pid()'
+)
+
+
+def oldest_running_write():
+    """Return when the oldest uncommitted write began, None if none"""
+    # other databases (e.g. sqlite in tests) have a single writer
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(RUNNING_WRITES_SQL)
+        return cursor.fetchone()[0]
+
+
+def changes_since(user, token=None):
+    """Return everything of a user changed since a sync token
+
+    Without a token, or with a token older than the kept tombstones,
+    every object is returned and 'full' is True so the client
+    replaces its copy instead of merging into it.
+    """
+    # taken before reading so nothing changed meanwhile is skipped
+    now = timezone.now()
+    # the next sync starts from here, so it also gets the rows of the
+    # transactions still running, which commit after this read
+    # > rows are stamped when saved rather than when committed
+    next_since = now
+    running = oldest_running_write()
+    if running is not None:
+        next_since = min(now, running)
+
+    since = decode_token(token) if token else None
+    oldest = now - timedelta(days=settings.SYNC_TOMBSTONE_MAX_AGE_DAYS)
+    full = since is None or since < oldest
+    if not full:
+        # the grace covers the moments between stamping a row and
+        # its transaction taking a write lock, and clock differences
+        # between the app and the database, clients apply the rows by
+        # id so getting a row twice is harmless
+        since -= timedelta(seconds=settings.SYNC_GRACE_SECONDS)
+
+    data = {'full': full, 'deleted': {}}
+    for name, kind, model, serializer_class in SYNC_MODELS:
+        # served by the (user, updated_at) index
+        queryset = model.objects.filter(user=user)
+        if not full:
+            queryset = queryset.filter(updated_at__gte=since)
+        if model is Recipe:
+            queryset = queryset.prefetch_related('tags', 'ingredients')
+        queryset = queryset.order_by('updated_at', 'id')
+        data[name] = serializer_class(queryset, many=True).data
+
+        deleted = []
+        if not full:
+            deleted = list(Tombstone.objects.filter(
+                user=user, model=kind, deleted_at__gte=since
+            ).values_list('object_id', flat=True))
+        data['deleted'][name] = deleted
+
+    data['token'] = encode_token(next_since)
+    return data
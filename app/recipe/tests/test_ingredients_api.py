@@ -1,11 +1,13 @@
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import Count
 from django.urls import reverse
-from django.test import TestCase
+from django.test import TestCase, override_settings
 
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from core.models import Ingredient
+from core.models import Ingredient, Recipe
 
 from recipe.serializers import IngredientSerializer
 
@@ -35,6 +37,8 @@ class PublicIngredientsApiTests(TestCase):
 # Test that authenticated users can access the Ingredient model
 
 
+# the test runner is a single process
+@override_settings(LIST_CACHE_ENABLED=True)
 class PrivateIngredientsAPITests(TestCase):
     """Test ingredients can be retrieved by authorized user"""
 
@@ -46,6 +50,8 @@ class PrivateIngredientsAPITests(TestCase):
             'testpass'
         )
         self.client.force_authenticate(self.user)
+        # user ids are reused between tests, drop the cached lists
+        cache.clear()
 
     def test_retrieve_ingredient_list(self):
         """Test retrieving a list of ingredients"""
@@ -59,7 +65,9 @@ class PrivateIngredientsAPITests(TestCase):
 
         # list all ingredients from the DB
         # order by name in reverse order
-        ingredients = Ingredient.objects.all().order_by('-name')
+        ingredients = Ingredient.objects.annotate(
+            recipe_count=Count('recipe')
+        ).order_by('-name')
         # Serialize many ingredents from PYTHON NATIVE to JSON
         serializer = IngredientSerializer(ingredients, many=True)
 
@@ -112,3 +120,48 @@ class PrivateIngredientsAPITests(TestCase):
         res = self.client.post(INGREDIENTS_URL, payload)
 
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_create_ingredient_duplicate_name(self):
+        """Test creating an ingredient the user already has fails"""
+        Ingredient.objects.create(user=self.user, name='Cabbage')
+
+        res = self.client.post(INGREDIENTS_URL, {'name': 'Cabbage'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            Ingredient.objects.filter(user=self.user).count(), 1
+        )
+
+    def test_ingredients_recipe_count(self):
+        """Test each ingredient has the number of recipes using it"""
+        ingredient1 = Ingredient.objects.create(user=self.user, name='Salt')
+        ingredient2 = Ingredient.objects.create(user=self.user, name='Kale')
+        for title in ('First', 'Second'):
+            recipe = Recipe.objects.create(
+                user=self.user, title=title, time_minutes=5, price=1.00
+            )
+            recipe.ingredients.add(ingredient1)
+
+        # counted by the list query itself
+        with self.assertNumQueries(1):
+            response = self.client.get(INGREDIENTS_URL)
+
+        counts = {item['name']: item['recipe_count'] for item in response.data}
+        self.assertEqual(counts, {ingredient1.name: 2, ingredient2.name: 0})
+
+    def test_ingredients_assigned_only(self):
+        """Test filtering ingredients by those assigned to recipes"""
+        ingredient1 = Ingredient.objects.create(user=self.user, name='Salt')
+        Ingredient.objects.create(user=self.user, name='Kale')
+        recipe = Recipe.objects.create(
+            user=self.user, title='Soup', time_minutes=5, price=1.00
+        )
+        recipe.ingredients.add(ingredient1)
+
+        response = self.client.get(INGREDIENTS_URL, {'assigned_only': 1})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['name'] for item in response.data], ['Salt'])
+
+        response = self.client.get(INGREDIENTS_URL, {'assigned_only': 'yes'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
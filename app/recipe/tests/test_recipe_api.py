@@ -7,13 +7,19 @@ import os
 from PIL import Image
 
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 # reverse is for generating the urls
 from django.urls import reverse
+from unittest.mock import patch
 
 from rest_framework import status
-from rest_framework.test import APIClient
+from rest_framework.test import APIClient, APIRequestFactory
 
+from core import images as core_images
+from core.images import process_recipe_image, rendition_formats
 from core.models import Recipe, Tag, Ingredient
 
 from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
@@ -23,6 +29,8 @@ from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
 # recipe-list => identifier of the app in the url
 # ../recipe/recipe-list
 RECIPES_URL = reverse('recipe:recipe-list')
+# ../recipe/recipes/bulk/
+RECIPES_BULK_URL = reverse('recipe:recipe-bulk')
 
 # Helper functions
 
@@ -57,8 +65,19 @@ def detail_url(recipe_id):
 # - **params: parses args into a dic
 
 
-def sample_recipe(user, **params):
-    """Create and return a sample recipe"""
+def authenticated_request(user):
+    """Return a request authenticated as user, for serializer context"""
+    request = APIRequestFactory().get(RECIPES_URL)
+    request.user = user
+    return request
+
+
+def sample_recipe(user, tags=(), ingredients=(), **params):
+    """Create and return a sample recipe
+
+    tags and ingredients are names, created for the user if needed.
+    Shared with the other recipe API tests.
+    """
     defaults = {
         'title': 'Sample recipe',
         'time_minutes': 10,
@@ -69,7 +88,14 @@ def sample_recipe(user, **params):
     defaults.update(params)
 
     # **defaults: passes a dic into args
-    return Recipe.objects.create(user=user, **defaults)
+    recipe = Recipe.objects.create(user=user, **defaults)
+    for name in tags:
+        recipe.tags.add(Tag.objects.get_or_create(user=user, name=name)[0])
+    for name in ingredients:
+        recipe.ingredients.add(
+            Ingredient.objects.get_or_create(user=user, name=name)[0]
+        )
+    return recipe
 
 
 class PublicRecipeApiTests(TestCase):
@@ -88,6 +114,8 @@ class PublicRecipeApiTests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 
 
+# the test runner is a single process
+@override_settings(LIST_CACHE_ENABLED=True)
 class PrivateRecipeApiTests(TestCase):
     """Test authenticated recipe API access"""
 
@@ -99,6 +127,8 @@ class PrivateRecipeApiTests(TestCase):
             'testpass'
         )
         self.client.force_authenticate(self.user)
+        # user ids are reused between tests, drop the cached lists
+        cache.clear()
 
     def test_retrieve_recipes(self):
         """Test retrieving list of recipes"""
@@ -140,6 +170,230 @@ class PrivateRecipeApiTests(TestCase):
         self.assertEqual(len(response.data), 1)
         self.assertEqual(response.data, serializer.data)
 
+    def test_recipes_not_paginated_by_default(self):
+        """Test that the list is a plain array without pagination params"""
+        sample_recipe(user=self.user)
+
+        response = self.client.get(RECIPES_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsInstance(response.data, list)
+
+    def test_recipes_cursor_pagination(self):
+        """Test paging through recipes with a cursor"""
+        recipes = [
+            sample_recipe(user=self.user, title=f'Recipe {i}')
+            for i in range(5)
+        ]
+
+        # first page, newest recipes first
+        response = self.client.get(RECIPES_URL, {'page_size': 2})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('count', response.data)
+        self.assertEqual(
+            [r['id'] for r in response.data['results']],
+            [recipes[4].id, recipes[3].id]
+        )
+        self.assertIsNotNone(response.data['next'])
+
+        # follow the next links until the last page
+        ids = [r['id'] for r in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            ids.extend(r['id'] for r in response.data['results'])
+
+        self.assertEqual(ids, [r.id for r in reversed(recipes)])
+
+    def test_list_recipes_query_count_is_constant(self):
+        """Test listing recipes does not run a query per recipe"""
+        tag = sample_tag(user=self.user)
+        ingredient = sample_ingredient(user=self.user)
+
+        # one query for the recipes
+        # and one query each for the tag and ingredient ids
+        for total in (1, 10):
+            while Recipe.objects.count() < total:
+                recipe = sample_recipe(user=self.user)
+                recipe.tags.add(tag)
+                recipe.ingredients.add(ingredient)
+
+            with self.assertNumQueries(3):
+                response = self.client.get(RECIPES_URL)
+
+            self.assertEqual(len(response.data), total)
+
+    def test_recipe_detail_query_count(self):
+        """Test retrieving a recipe runs a fixed number of queries"""
+        recipe = sample_recipe(user=self.user)
+        for i in range(5):
+            recipe.tags.add(sample_tag(user=self.user, name=f'Tag {i}'))
+            recipe.ingredients.add(
+                sample_ingredient(user=self.user, name=f'Ingredient {i}')
+            )
+
+        # recipe, tags, ingredients and image renditions
+        with self.assertNumQueries(4):
+            response = self.client.get(detail_url(recipe.id))
+
+        self.assertEqual(len(response.data['tags']), 5)
+        self.assertEqual(len(response.data['ingredients']), 5)
+
+    def test_list_recipes_sparse_fields(self):
+        """Test ?fields= limits the response and skips the relations"""
+        recipe = sample_recipe(user=self.user)
+        recipe.tags.add(sample_tag(user=self.user))
+
+        # only the recipes query, the tags are not prefetched
+        with self.assertNumQueries(1):
+            response = self.client.get(RECIPES_URL, {'fields': 'id,title'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response.data, [{'id': recipe.id, 'title': recipe.title}]
+        )
+
+    def test_list_recipes_expand_tags(self):
+        """Test ?expand=tags renders the tags as objects"""
+        recipe = sample_recipe(user=self.user)
+        tag = sample_tag(user=self.user)
+        recipe.tags.add(tag)
+
+        response = self.client.get(
+            RECIPES_URL, {'fields': 'id,tags', 'expand': 'tags'}
+        )
+
+        self.assertEqual(response.data, [{
+            'id': recipe.id,
+            'tags': [{'id': tag.id, 'name': tag.name}],
+        }])
+
+    def test_recipe_detail_sparse_fields(self):
+        """Test ?fields= on the detail only loads what was asked for"""
+        recipe = sample_recipe(user=self.user)
+        recipe.tags.add(sample_tag(user=self.user))
+
+        # recipe and tags, no ingredients or image renditions
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                detail_url(recipe.id), {'fields': 'title,tags'}
+            )
+
+        self.assertEqual(list(response.data), ['title', 'tags'])
+        self.assertEqual(response.data['tags'][0]['name'], 'Main course')
+
+    def test_list_recipes_unknown_field(self):
+        """Test unknown ?fields= and ?expand= names are rejected"""
+        response = self.client.get(RECIPES_URL, {'fields': 'id,secret'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(RECIPES_URL, {'expand': 'price'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_fast_list_matches_serializers(self):
+        """Test the fast list path renders the same bytes"""
+        tags = [sample_tag(user=self.user, name=f'Tag {i}') for i in range(3)]
+        for i, price in enumerate(('5.00', '10.5', '0.99')):
+            recipe = sample_recipe(
+                user=self.user, price=price, link=f'https://x.io/{i}'
+            )
+            recipe.tags.add(*tags[i:])
+            recipe.ingredients.add(sample_ingredient(user=self.user,
+                                                     name=f'Salt {i}'))
+
+        for params in ({}, {'page_size': 2}, {'fields': 'id,price,tags'}):
+            fast = self.client.get(RECIPES_URL, params).content
+            cache.clear()
+            with override_settings(RECIPE_FAST_LIST=False):
+                slow = self.client.get(RECIPES_URL, params).content
+            cache.clear()
+
+            self.assertEqual(fast, slow)
+
+    def test_stream_recipes(self):
+        """Test a streamed list has the same JSON as the regular one"""
+        tag = sample_tag(user=self.user)
+        for i in range(5):
+            sample_recipe(user=self.user, title=f'Recipe {i}').tags.add(tag)
+        expected = self.client.get(RECIPES_URL).content
+
+        # several chunks, the last one smaller
+        with override_settings(RECIPE_STREAM_CHUNK_SIZE=2):
+            response = self.client.get(RECIPES_URL, {'stream': '1'})
+            content = b''.join(response.streaming_content)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(content, expected)
+        self.assertIn('ETag', response)
+
+    def test_list_recipes_served_from_cache(self):
+        """Test listing recipes again does not query the database"""
+        sample_recipe(user=self.user)
+        self.client.get(RECIPES_URL)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(RECIPES_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+
+    @override_settings(LIST_CACHE_ENABLED=False)
+    def test_list_recipes_cache_disabled(self):
+        """Test lists are neither cached nor tagged when disabled"""
+        sample_recipe(user=self.user)
+        self.client.get(RECIPES_URL)
+
+        # the recipes and the prefetched tags and ingredients, again
+        with self.assertNumQueries(3):
+            response = self.client.get(RECIPES_URL)
+
+        self.assertEqual(len(response.data), 1)
+        self.assertNotIn('ETag', response)
+
+    def test_list_recipes_not_modified(self):
+        """Test a matching If-None-Match is answered with 304"""
+        sample_recipe(user=self.user)
+        etag = self.client.get(RECIPES_URL)['ETag']
+
+        with self.assertNumQueries(0):
+            response = self.client.get(RECIPES_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_list_recipes_cache_invalidated(self):
+        """Test changing a recipe or its tags invalidates the list"""
+        recipe = sample_recipe(user=self.user)
+        etag = self.client.get(RECIPES_URL)['ETag']
+
+        recipe.tags.add(sample_tag(user=self.user))
+        response = self.client.get(RECIPES_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data[0]['tags']), 1)
+        self.assertNotEqual(response['ETag'], etag)
+
+        sample_recipe(user=self.user, title='Another recipe')
+        response = self.client.get(RECIPES_URL)
+
+        self.assertEqual(len(response.data), 2)
+
+    def test_list_recipes_cache_per_user(self):
+        """Test cached lists are not shared between users"""
+        user2 = get_user_model().objects.create_user(
+            'other@gmail.com',
+            'password'
+        )
+        sample_recipe(user=user2)
+        self.client.get(RECIPES_URL)
+
+        self.client.force_authenticate(user2)
+        response = self.client.get(RECIPES_URL)
+
+        self.assertEqual(len(response.data), 1)
+
     def test_view_recipe_detail(self):
         """Test viewing a recipe detail"""
 
@@ -347,6 +601,287 @@ class PrivateRecipeApiTests(TestCase):
         # and should be removed
         self.assertEqual(len(tags), 0)
 
+    def test_bulk_create_recipes(self):
+        """Test creating many recipes in one request"""
+        tag = sample_tag(user=self.user)
+        ingredient = sample_ingredient(user=self.user)
+        payload = [
+            {
+                'title': f'Recipe {i}',
+                'time_minutes': 10,
+                'price': '5.00',
+                'tags': [tag.id],
+                'ingredients': [ingredient.id],
+            }
+            for i in range(3)
+        ]
+
+        response = self.client.post(RECIPES_BULK_URL, payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data['ids']), 3)
+        recipes = Recipe.objects.filter(user=self.user)
+        self.assertEqual(recipes.count(), 3)
+        for recipe in recipes:
+            self.assertEqual(list(recipe.tags.all()), [tag])
+            self.assertEqual(list(recipe.ingredients.all()), [ingredient])
+
+    def test_bulk_create_recipes_invalid_item(self):
+        """Test nothing is created and errors are reported per item"""
+        payload = [
+            {
+                'title': 'Good', 'time_minutes': 10, 'price': '5.00',
+                'tags': [], 'ingredients': [],
+            },
+            {'title': 'Bad', 'price': '5.00', 'tags': [], 'ingredients': []},
+        ]
+
+        response = self.client.post(RECIPES_BULK_URL, payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['errors'][0], {})
+        self.assertIn('time_minutes', response.data['errors'][1])
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_bulk_create_recipes_resolves_relations_once(self):
+        """Test the tags and ingredients of all items are found at once"""
+        tags = [sample_tag(user=self.user, name=f'Tag {i}') for i in range(3)]
+        ingredient = sample_ingredient(user=self.user)
+        payload = [
+            {
+                'title': f'Recipe {i}',
+                'time_minutes': 10,
+                'price': '5.00',
+                'tags': [tags[i % 3].id, 'Quick'],
+                'ingredients': [ingredient.name],
+            }
+            for i in range(10)
+        ]
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(
+                RECIPES_BULK_URL, payload, format='json'
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        selects = [
+            query['sql'] for query in queries
+            if query['sql'].startswith('SELECT')
+        ]
+        # one to validate, one to load the tags created by name
+        self.assertEqual(
+            len([sql for sql in selects if 'FROM "core_tag"' in sql]), 2
+        )
+        self.assertEqual(
+            len([sql for sql in selects if 'FROM "core_ingredient"' in sql]),
+            1
+        )
+        for recipe in Recipe.objects.filter(user=self.user):
+            self.assertEqual(recipe.tags.count(), 2)
+            self.assertEqual(list(recipe.ingredients.all()), [ingredient])
+
+    def test_bulk_create_recipes_other_users_tag(self):
+        """Test prefetched relations are still limited to the user"""
+        other = get_user_model().objects.create_user(
+            'other@londonappdev.com',
+            'pass'
+        )
+        tag = sample_tag(user=other)
+        payload = [
+            {'title': 'Mine', 'time_minutes': 5, 'price': '1.00',
+             'tags': [], 'ingredients': []},
+            {'title': 'Theirs', 'time_minutes': 5, 'price': '1.00',
+             'tags': [tag.id], 'ingredients': []},
+        ]
+
+        response = self.client.post(RECIPES_BULK_URL, payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['errors'][0], {})
+        self.assertIn('tags', response.data['errors'][1])
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_bulk_update_recipes(self):
+        """Test partially updating many recipes in one request"""
+        recipe1 = sample_recipe(user=self.user)
+        recipe1.tags.add(sample_tag(user=self.user))
+        recipe2 = sample_recipe(user=self.user)
+        new_tag = sample_tag(user=self.user, name='Curry')
+        payload = [
+            {'id': recipe1.id, 'title': 'Chicken tikka', 'tags': [new_tag.id]},
+            {'id': recipe2.id, 'time_minutes': 45},
+        ]
+
+        response = self.client.patch(
+            RECIPES_BULK_URL, payload, format='json'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        recipe1.refresh_from_db()
+        recipe2.refresh_from_db()
+        self.assertEqual(recipe1.title, 'Chicken tikka')
+        self.assertEqual(list(recipe1.tags.all()), [new_tag])
+        self.assertEqual(recipe2.time_minutes, 45)
+
+    def test_bulk_update_other_users_recipe_fails(self):
+        """Test bulk updates are limited to the user's recipes"""
+        user2 = get_user_model().objects.create_user(
+            'other@londonappdev.com',
+            'pass'
+        )
+        recipe = sample_recipe(user=user2)
+
+        response = self.client.patch(
+            RECIPES_BULK_URL,
+            [{'id': recipe.id, 'title': 'Mine now'}],
+            format='json'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.title, 'Sample recipe')
+
+    def test_bulk_delete_recipes(self):
+        """Test deleting many recipes in one request"""
+        recipe1 = sample_recipe(user=self.user)
+        recipe2 = sample_recipe(user=self.user)
+        recipe3 = sample_recipe(user=self.user)
+
+        response = self.client.delete(
+            RECIPES_BULK_URL,
+            {'ids': [recipe1.id, recipe2.id]},
+            format='json'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['deleted'], 2)
+        self.assertEqual(list(Recipe.objects.all()), [recipe3])
+
+    def test_bulk_delete_recipes_rejects_booleans(self):
+        """Test true is not taken for the id 1"""
+        recipe = sample_recipe(user=self.user)
+
+        response = self.client.delete(
+            RECIPES_BULK_URL, {'ids': [True]}, format='json'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(Recipe.objects.filter(id=recipe.id).exists())
+
+    def test_create_recipe_validates_ids_in_one_query(self):
+        """Test tag ids are validated with a single query"""
+        tags = [
+            sample_tag(user=self.user, name=f'Tag {i}') for i in range(10)
+        ]
+        serializer = RecipeSerializer(
+            data={
+                'title': 'Many tags',
+                'time_minutes': 10,
+                'price': '5.00',
+                'tags': [tag.id for tag in tags],
+                'ingredients': [],
+            },
+            context={'request': authenticated_request(self.user)}
+        )
+
+        with self.assertNumQueries(1):
+            self.assertTrue(serializer.is_valid())
+
+        self.assertEqual(serializer.validated_data['tags'], tags)
+
+    def test_create_recipe_with_other_users_tags_fails(self):
+        """Test that missing or foreign ids are all reported"""
+        user2 = get_user_model().objects.create_user(
+            'other@londonappdev.com',
+            'pass'
+        )
+        own_tag = sample_tag(user=self.user)
+        other_tag = sample_tag(user=user2)
+        payload = {
+            'title': 'Stolen tags',
+            'time_minutes': 10,
+            'price': '5.00',
+            'tags': [own_tag.id, other_tag.id, 9999],
+            'ingredients': [],
+        }
+
+        response = self.client.post(RECIPES_URL, payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(response.data['tags']), 1)
+        self.assertIn(f'{other_tag.id}, 9999', response.data['tags'][0])
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_create_recipe_with_tag_and_ingredient_names(self):
+        """Test tags and ingredients can be given by name"""
+        vegan = sample_tag(user=self.user, name='Vegan')
+        salt = sample_ingredient(user=self.user, name='Salt')
+        payload = {
+            'title': 'Avocado toast',
+            'time_minutes': 5,
+            'price': '4.00',
+            'tags': ['Vegan', 'Breakfast', vegan.id],
+            'ingredients': [salt.id, {'name': 'Avocado'}],
+        }
+
+        response = self.client.post(RECIPES_URL, payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        recipe = Recipe.objects.get(id=response.data['id'])
+        self.assertEqual(
+            sorted(recipe.tags.values_list('name', flat=True)),
+            ['Breakfast', 'Vegan']
+        )
+        self.assertEqual(
+            sorted(recipe.ingredients.values_list('name', flat=True)),
+            ['Avocado', 'Salt']
+        )
+        # the existing tag was reused, only Breakfast was created
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 2)
+
+    def test_update_recipe_with_new_tag_name(self):
+        """Test updating a recipe can create a tag by name"""
+        recipe = sample_recipe(user=self.user)
+
+        response = self.client.patch(
+            detail_url(recipe.id), {'tags': ['Spicy']}, format='json'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        tag = Tag.objects.get(user=self.user, name='Spicy')
+        self.assertEqual(list(recipe.tags.all()), [tag])
+
+    def test_create_recipe_with_invalid_tag_name(self):
+        """Test a blank name is rejected and nothing is created"""
+        payload = {
+            'title': 'Nameless',
+            'time_minutes': 5,
+            'price': '4.00',
+            'tags': ['Fine', '  '],
+            'ingredients': [],
+        }
+
+        response = self.client.post(RECIPES_URL, payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('tags', response.data)
+        self.assertFalse(Tag.objects.exists())
+
+    def test_bulk_create_recipes_with_tag_names(self):
+        """Test bulk created recipes share the tags created by name"""
+        payload = [
+            {'title': f'Recipe {i}', 'time_minutes': 5, 'price': '1.00',
+             'tags': ['Quick'], 'ingredients': ['Egg']}
+            for i in range(3)
+        ]
+
+        response = self.client.post(RECIPES_BULK_URL, payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        tag = Tag.objects.get(user=self.user, name='Quick')
+        self.assertEqual(tag.recipe_set.count(), 3)
+        self.assertEqual(Ingredient.objects.filter(user=self.user).count(), 1)
+
 
 class RecipeImageUploadTests(TestCase):
 
@@ -355,6 +890,8 @@ class RecipeImageUploadTests(TestCase):
         self.client = APIClient()
         self.user = get_user_model().objects.create_user('user', 'testpass')
         self.client.force_authenticate(self.user)
+        # user ids are reused between tests, drop the cached lists
+        cache.clear()
         self.recipe = sample_recipe(user=self.user)
 
     # tear down after test runs
@@ -377,11 +914,154 @@ class RecipeImageUploadTests(TestCase):
 
         # refresh DB
         self.recipe.refresh_from_db()
-        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        # accepted, the renditions are created in the background
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
         self.assertIn('image', res.data)
+        self.assertEqual(res.data['image_status'], Recipe.IMAGE_PENDING)
         # check that the path to image exist in the file system
         self.assertTrue(os.path.exists(self.recipe.image.path))
 
+    def test_process_uploaded_image(self):
+        """Test renditions are created and the exif data is stripped"""
+        url = image_upload_url(self.recipe.id)
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as ntf:
+            img = Image.new('RGB', (1000, 500))
+            exif = Image.Exif()
+            # 0x010f is the camera make tag
+            exif[0x010f] = 'Phone'
+            img.save(ntf, format='JPEG', exif=exif.tobytes())
+            ntf.seek(0)
+            self.client.post(url, {'image': ntf}, format='multipart')
+
+        process_recipe_image(self.recipe.id)
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.image_status, Recipe.IMAGE_READY)
+        renditions = {
+            (r.size, r.format): r for r in self.recipe.image_renditions.all()
+        }
+        self.assertIn(('thumb', 'jpg'), renditions)
+        self.assertEqual(len(renditions), 3 * len(rendition_formats()))
+
+        thumb = renditions[('thumb', 'jpg')]
+        self.assertEqual((thumb.width, thumb.height), (150, 75))
+        with Image.open(thumb.file.path) as rendered:
+            self.assertEqual(rendered.size, (150, 75))
+            self.assertEqual(len(rendered.getexif()), 0)
+
+        # the full size rendition is not upscaled
+        full = renditions[('full', 'jpg')]
+        self.assertEqual((full.width, full.height), (1000, 500))
+
+        response = self.client.get(detail_url(self.recipe.id))
+        self.assertEqual(response.data['image_status'], Recipe.IMAGE_READY)
+        self.assertEqual(
+            len(response.data['image_renditions']), len(renditions)
+        )
+
+        for rendition in renditions.values():
+            rendition.file.delete(save=False)
+
+    def test_process_image_failure_removes_renditions(self):
+        """Test renditions written before a failure are deleted"""
+        url = image_upload_url(self.recipe.id)
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as ntf:
+            Image.new('RGB', (1000, 500)).save(ntf, format='JPEG')
+            ntf.seek(0)
+            self.client.post(url, {'image': ntf}, format='multipart')
+        self.recipe.refresh_from_db()
+        storage = self.recipe.image.storage
+        directory = os.path.dirname(self.recipe.image.name)
+        before = set(storage.listdir(directory)[1])
+
+        render = core_images.render_image
+        calls = []
+
+        def render_then_fail(*args):
+            # the first rendition is written, the second one fails
+            calls.append(args)
+            if len(calls) > 1:
+                raise OSError('disk full')
+            return render(*args)
+
+        with patch('core.images.render_image', render_then_fail):
+            process_recipe_image(self.recipe.id)
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.image_status, Recipe.IMAGE_FAILED)
+        self.assertFalse(self.recipe.image_renditions.exists())
+        self.assertEqual(set(storage.listdir(directory)[1]), before)
+
+    def test_upload_image_streamed_to_storage(self):
+        """Test the upload is moved into place without leftover files"""
+        url = image_upload_url(self.recipe.id)
+        with tempfile.NamedTemporaryFile(suffix='.png') as ntf:
+            Image.new('RGB', (10, 10)).save(ntf, format='PNG')
+            ntf.seek(0)
+            res = self.client.post(url, {'image': ntf}, format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.recipe.refresh_from_db()
+        self.assertTrue(os.path.exists(self.recipe.image.path))
+        tmp_dir = self.recipe.image.storage.path('uploads/tmp')
+        self.assertEqual(os.listdir(tmp_dir), [])
+
+    @override_settings(IMAGE_UPLOAD_MAX_BYTES=100)
+    def test_upload_image_too_many_bytes(self):
+        """Test uploads over the byte limit are rejected"""
+        url = image_upload_url(self.recipe.id)
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as ntf:
+            Image.new('RGB', (100, 100)).save(ntf, format='JPEG')
+            ntf.seek(0)
+            res = self.client.post(url, {'image': ntf}, format='multipart')
+
+        self.assertEqual(
+            res.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        )
+        self.recipe.refresh_from_db()
+        self.assertFalse(self.recipe.image)
+
+    @override_settings(IMAGE_UPLOAD_MAX_PIXELS=50)
+    def test_upload_image_too_many_pixels(self):
+        """Test images over the pixel limit are rejected from the header"""
+        url = image_upload_url(self.recipe.id)
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as ntf:
+            Image.new('RGB', (10, 10)).save(ntf, format='JPEG')
+            ntf.seek(0)
+            res = self.client.post(url, {'image': ntf}, format='multipart')
+
+        self.assertEqual(
+            res.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        )
+
+    def test_upload_file_not_an_image(self):
+        """Test uploading a file that is not an image fails"""
+        url = image_upload_url(self.recipe.id)
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as ntf:
+            ntf.write(b'not an image')
+            ntf.seek(0)
+            res = self.client.post(url, {'image': ntf}, format='multipart')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_upload_same_image_twice_shares_file(self):
+        """Test the same image uploaded to two recipes is stored once"""
+        recipe2 = sample_recipe(user=self.user)
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as ntf:
+            Image.new('RGB', (10, 10)).save(ntf, format='JPEG')
+            for recipe in (self.recipe, recipe2):
+                ntf.seek(0)
+                self.client.post(
+                    image_upload_url(recipe.id),
+                    {'image': ntf},
+                    format='multipart'
+                )
+
+        self.recipe.refresh_from_db()
+        recipe2.refresh_from_db()
+        self.assertEqual(self.recipe.image.name, recipe2.image.name)
+        self.assertTrue(os.path.exists(self.recipe.image.path))
+
     def test_upload_image_bad_request(self):
         """Test uploading an invalid image"""
         url = image_upload_url(self.recipe.id)
@@ -464,3 +1144,84 @@ class RecipeImageUploadTests(TestCase):
         self.assertIn(serializer1.data, response.data)
         self.assertIn(serializer2.data, response.data)
         self.assertNotIn(serializer3.data, response.data)
+
+    def test_filter_recipes_by_tags_returns_each_recipe_once(self):
+        """Test a recipe matching several tags is only returned once"""
+        recipe = sample_recipe(user=self.user)
+        tag1 = sample_tag(user=self.user, name='Vegan')
+        tag2 = sample_tag(user=self.user, name='Vegetarian')
+        recipe.tags.add(tag1, tag2)
+
+        response = self.client.get(
+            RECIPES_URL,
+            {'tags': f'{tag1.id},{tag2.id}'}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 1)
+
+    def test_filter_recipes_by_all_tags(self):
+        """Test returning only recipes that have all of the tags"""
+        tag1 = sample_tag(user=self.user, name='Vegan')
+        tag2 = sample_tag(user=self.user, name='Quick')
+        recipe1 = sample_recipe(user=self.user, title='Vegan stir fry')
+        recipe1.tags.add(tag1, tag2)
+        recipe2 = sample_recipe(user=self.user, title='Vegan stew')
+        recipe2.tags.add(tag1)
+
+        response = self.client.get(
+            RECIPES_URL,
+            {'tags': f'{tag1.id},{tag2.id}', 'tags_mode': 'all'}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['id'] for r in response.data], [recipe1.id])
+
+    def test_filter_recipes_by_all_ingredients_and_any_tags(self):
+        """Test combining an all ingredients filter with an any tags filter"""
+        tag = sample_tag(user=self.user)
+        ingredient1 = sample_ingredient(user=self.user, name='Salt')
+        ingredient2 = sample_ingredient(user=self.user, name='Pepper')
+        recipe1 = sample_recipe(user=self.user, title='Steak')
+        recipe1.tags.add(tag)
+        recipe1.ingredients.add(ingredient1, ingredient2)
+        recipe2 = sample_recipe(user=self.user, title='Chips')
+        recipe2.tags.add(tag)
+        recipe2.ingredients.add(ingredient1)
+
+        response = self.client.get(RECIPES_URL, {
+            'tags': f'{tag.id}',
+            'ingredients': f'{ingredient1.id},{ingredient2.id}',
+            'ingredients_mode': 'all',
+        })
+
+        self.assertEqual([r['id'] for r in response.data], [recipe1.id])
+
+    def test_filter_recipes_invalid_params(self):
+        """Test invalid ids or match modes return a bad request"""
+        response = self.client.get(RECIPES_URL, {'tags': '1,abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(
+            RECIPES_URL,
+            {'tags': '1', 'tags_mode': 'some'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_search_recipes(self):
+        """Test searching recipes by title, tag and ingredient names"""
+        recipe1 = sample_recipe(user=self.user, title='Thai green curry')
+        recipe2 = sample_recipe(user=self.user, title='Beef stew')
+        recipe2.tags.add(sample_tag(user=self.user, name='Curry night'))
+        recipe3 = sample_recipe(user=self.user, title='Fish and chips')
+        recipe3.ingredients.add(sample_ingredient(user=self.user, name='Cod'))
+
+        response = self.client.get(RECIPES_URL, {'search': 'curry'})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        ids = {r['id'] for r in response.data}
+        self.assertEqual(ids, {recipe1.id, recipe2.id})
+
+        response = self.client.get(RECIPES_URL, {'search': 'cod chips'})
+
+        self.assertEqual([r['id'] for r in response.data], [recipe3.id])
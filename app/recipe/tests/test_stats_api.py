@@ -0,0 +1,142 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.urls import reverse
+from django.test import TestCase, override_settings
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Tag
+
+from recipe.tests.test_recipe_api import sample_recipe
+
+
+# ../recipe/stats/
+STATS_URL = reverse('recipe:stats')
+
+
+class PublicStatsApiTests(TestCase):
+    """Test the publicly available stats API"""
+
+    def test_login_required(self):
+        """Test that login is required to get the stats"""
+        response = APIClient().get(STATS_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+# the test runner is a single process
+@override_settings(LIST_CACHE_ENABLED=True)
+class PrivateStatsApiTests(TestCase):
+    """Test the stats of the authorized user's recipes"""
+
+    def setUp(self):
+        # user ids are reused between tests, so are the cache keys
+        cache.clear()
+        self.user = get_user_model().objects.create_user(
+            'test@gmail.com',
+            'password'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_stats_without_recipes(self):
+        """Test the stats of a user without recipes"""
+        response = self.client.get(STATS_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['recipes'], 0)
+        self.assertIsNone(response.data['average_price'])
+        self.assertIsNone(response.data['price_percentiles']['p50'])
+        self.assertEqual(response.data['tag_combinations'], [])
+
+    def test_stats(self):
+        """Test the aggregates of the user's recipes"""
+        sample_recipe(self.user, tags=['Vegan', 'Quick'],
+                      ingredients=['Salt', 'Kale'],
+                      time_minutes=10, price=4.00)
+        sample_recipe(self.user, tags=['Vegan', 'Quick'],
+                      ingredients=['Salt'], time_minutes=20, price=8.00)
+        sample_recipe(self.user, tags=['Vegan'],
+                      time_minutes=150, price=30.00)
+        other = get_user_model().objects.create_user(
+            'other@gmail.com',
+            'password'
+        )
+        sample_recipe(other, tags=['Vegan'], price=99.00)
+
+        response = self.client.get(STATS_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = response.data
+        self.assertEqual(data['recipes'], 3)
+        self.assertEqual(data['average_time_minutes'], 60.0)
+        self.assertEqual(data['average_price'], '14.00')
+        self.assertEqual(data['price_percentiles'], {
+            'p25': '4.00', 'p50': '8.00', 'p75': '30.00', 'p90': '30.00',
+        })
+        self.assertEqual(
+            [(tag['name'], tag['recipes']) for tag in data['tags']],
+            [('Vegan', 3), ('Quick', 2)]
+        )
+        self.assertEqual(
+            [(item['name'], item['recipes']) for item in data['ingredients']],
+            [('Salt', 2), ('Kale', 1)]
+        )
+        self.assertEqual(data['time_minutes_histogram'], [
+            {'range': '0-15', 'recipes': 1},
+            {'range': '15-30', 'recipes': 1},
+            {'range': '30-60', 'recipes': 0},
+            {'range': '60-120', 'recipes': 0},
+            {'range': '120+', 'recipes': 1},
+        ])
+        self.assertEqual(
+            [bucket['recipes'] for bucket in data['price_histogram']],
+            [1, 1, 0, 1, 0]
+        )
+        self.assertEqual(data['tag_combinations'], [
+            {'tags': ['Vegan', 'Quick'], 'recipes': 2},
+        ])
+        self.assertEqual(data['ingredient_combinations'], [
+            {'ingredients': ['Salt', 'Kale'], 'recipes': 1},
+        ])
+
+    def test_stats_cached_until_change(self):
+        """Test the stats are cached until the user's data changes"""
+        sample_recipe(self.user)
+        response = self.client.get(STATS_URL)
+        etag = response['ETag']
+
+        # served from the cache, or not at all
+        with self.assertNumQueries(0):
+            response = self.client.get(STATS_URL)
+        self.assertEqual(response.data['recipes'], 1)
+        with self.assertNumQueries(0):
+            response = self.client.get(STATS_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        sample_recipe(self.user)
+        response = self.client.get(STATS_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data['recipes'], 2)
+
+    def test_combinations_skip_other_users_tags(self):
+        """Test pairs with another user's tag are left out"""
+        other = get_user_model().objects.create_user(
+            'other@gmail.com',
+            'password'
+        )
+        foreign = Tag.objects.create(user=other, name='Theirs')
+        for _i in range(2):
+            # linked before the ids were checked to belong to the user
+            recipe = sample_recipe(self.user, tags=['Vegan', 'Quick'])
+            recipe.tags.add(foreign)
+
+        response = self.client.get(STATS_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['tag_combinations'], [
+            {'tags': ['Vegan', 'Quick'], 'recipes': 2},
+        ])
@@ -0,0 +1,175 @@
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from django.test import TestCase
+from django.utils import timezone
+from unittest.mock import patch
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Tag, Ingredient, Recipe, Tombstone
+
+from recipe.sync import encode_token
+from recipe.tests.test_recipe_api import sample_recipe
+
+
+# ../recipe/sync/
+SYNC_URL = reverse('recipe:sync')
+
+
+def token_before(seconds):
+    """Return a sync token from some seconds ago, past the grace window"""
+    return encode_token(timezone.now() - timedelta(seconds=seconds))
+
+
+class PublicSyncApiTests(TestCase):
+    """Test unauthenticated sync API access"""
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_login_required(self):
+        """Test that authentication is required"""
+        response = self.client.get(SYNC_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateSyncApiTests(TestCase):
+    """Test authenticated sync API access"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@gmail.com',
+            'password'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def age(self, *objs, seconds=3600):
+        """Move the last change of objects into the past"""
+        for obj in objs:
+            type(obj).objects.filter(pk=obj.pk).update(
+                updated_at=timezone.now() - timedelta(seconds=seconds)
+            )
+
+    def test_full_sync(self):
+        """Test syncing without a token returns everything"""
+        recipe = sample_recipe(user=self.user)
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        other = get_user_model().objects.create_user(
+            'other@gmail.com',
+            'password'
+        )
+        Ingredient.objects.create(user=other, name='Salt')
+
+        response = self.client.get(SYNC_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.data['full'])
+        self.assertEqual([r['id'] for r in response.data['recipes']],
+                         [recipe.id])
+        self.assertEqual([t['id'] for t in response.data['tags']], [tag.id])
+        self.assertEqual(response.data['ingredients'], [])
+        self.assertTrue(response.data['token'])
+
+    def test_sync_since_returns_changes_only(self):
+        """Test syncing with a token returns what changed since"""
+        unchanged = sample_recipe(user=self.user, title='Unchanged')
+        changed = sample_recipe(user=self.user, title='Changed')
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.age(unchanged, changed, tag)
+        since = token_before(600)
+
+        changed.title = 'Changed again'
+        changed.save()
+        new = Ingredient.objects.create(user=self.user, name='Salt')
+
+        response = self.client.get(SYNC_URL, {'since': since})
+
+        self.assertFalse(response.data['full'])
+        self.assertEqual([r['id'] for r in response.data['recipes']],
+                         [changed.id])
+        self.assertEqual(response.data['tags'], [])
+        self.assertEqual([i['id'] for i in response.data['ingredients']],
+                         [new.id])
+
+    def test_sync_since_returns_deletions(self):
+        """Test deleted objects are listed by id"""
+        recipe = sample_recipe(user=self.user)
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        recipe_id, tag_id = recipe.id, tag.id
+        since = token_before(600)
+
+        recipe.delete()
+        tag.delete()
+
+        response = self.client.get(SYNC_URL, {'since': since})
+
+        self.assertEqual(response.data['deleted'], {
+            'recipes': [recipe_id],
+            'tags': [tag_id],
+            'ingredients': [],
+        })
+
+    def test_changing_recipe_tags_marks_recipe_changed(self):
+        """Test adding a tag to a recipe counts as a recipe change"""
+        recipe = sample_recipe(user=self.user)
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.age(recipe, tag)
+        since = token_before(600)
+
+        tag.recipe_set.add(recipe)
+
+        response = self.client.get(SYNC_URL, {'since': since})
+
+        self.assertEqual([r['id'] for r in response.data['recipes']],
+                         [recipe.id])
+        self.assertEqual(response.data['recipes'][0]['tags'], [tag.id])
+
+    def test_write_committed_after_sync_is_returned(self):
+        """Test a long write still running at a sync is sent next time"""
+        write_started = timezone.now() - timedelta(seconds=60)
+        # the sync runs while the write's transaction is open
+        with patch('recipe.sync.oldest_running_write',
+                   return_value=write_started):
+            token = self.client.get(SYNC_URL).data['token']
+
+        # then the write commits, its row stamped near its start
+        recipe = sample_recipe(user=self.user)
+        Recipe.objects.filter(pk=recipe.pk).update(
+            updated_at=write_started + timedelta(seconds=1)
+        )
+
+        response = self.client.get(SYNC_URL, {'since': token})
+
+        self.assertEqual(
+            [item['id'] for item in response.data['recipes']], [recipe.id]
+        )
+
+    def test_sync_with_expired_token_is_full(self):
+        """Test a token older than the tombstones gives a full sync"""
+        sample_recipe(user=self.user)
+
+        response = self.client.get(
+            SYNC_URL, {'since': token_before(365 * 24 * 3600)}
+        )
+
+        self.assertTrue(response.data['full'])
+        self.assertEqual(len(response.data['recipes']), 1)
+
+    def test_sync_invalid_token(self):
+        """Test an invalid token returns a bad request"""
+        response = self.client.get(SYNC_URL, {'since': 'not-a-token'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_deleting_user_removes_tombstones(self):
+        """Test tombstones of a deleted user are not kept"""
+        sample_recipe(user=self.user)
+
+        self.user.delete()
+
+        self.assertFalse(Tombstone.objects.exists())
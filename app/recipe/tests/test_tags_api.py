@@ -1,16 +1,21 @@
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import Count
 from django.urls import reverse
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from unittest.mock import patch
 
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from core.models import Tag
+from core.models import Tag, Recipe
 
 from recipe.serializers import TagSerializer
 
 # ../recipe/tag-list
 TAGS_URL = reverse('recipe:tag-list')
+# ../recipe/tags/bulk/
+TAGS_BULK_URL = reverse('recipe:tag-bulk')
 
 
 class PublicTagsApiTests(TestCase):
@@ -28,6 +33,8 @@ class PublicTagsApiTests(TestCase):
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 
 
+# the test runner is a single process
+@override_settings(LIST_CACHE_ENABLED=True)
 class PrivateTagsApiTests(TestCase):
     """Test the authorized user tags API"""
 
@@ -38,6 +45,8 @@ class PrivateTagsApiTests(TestCase):
         )
         self.client = APIClient()
         self.client.force_authenticate(self.user)
+        # user ids are reused between tests, drop the cached lists
+        cache.clear()
 
     def test_retrieve_tags(self):
         """Test retrieving tags"""
@@ -51,7 +60,9 @@ class PrivateTagsApiTests(TestCase):
 
         # -name ensures that tags are returned in reverse order
         # or alphabetical order based on the name
-        tags = Tag.objects.all().order_by('-name')
+        tags = Tag.objects.annotate(
+            recipe_count=Count('recipe')
+        ).order_by('-name')
 
         # many=True: becos there is more than one item in serializer
         serializer = TagSerializer(tags, many=True)
@@ -120,3 +131,123 @@ class PrivateTagsApiTests(TestCase):
 
         # returns a bad request becos empty string does not exist
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_create_tag_duplicate_name(self):
+        """Test creating a tag with a name the user already has fails"""
+        Tag.objects.create(user=self.user, name='Vegan')
+
+        response = self.client.post(TAGS_URL, {'name': 'Vegan'})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('name', response.data)
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 1)
+
+    def test_tags_cursor_pagination(self):
+        """Test paging through tags ordered by name with a cursor"""
+        for name in ('Vegan', 'Dessert', 'Breakfast', 'Spicy'):
+            Tag.objects.create(user=self.user, name=name)
+
+        response = self.client.get(TAGS_URL, {'page_size': 3})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        names = [t['name'] for t in response.data['results']]
+        self.assertEqual(names, ['Vegan', 'Spicy', 'Dessert'])
+
+        response = self.client.get(response.data['next'])
+
+        names = [t['name'] for t in response.data['results']]
+        self.assertEqual(names, ['Breakfast'])
+        self.assertIsNone(response.data['next'])
+
+    def test_tags_cache_invalidated(self):
+        """Test creating a tag invalidates the cached tag list"""
+        Tag.objects.create(user=self.user, name='Vegan')
+        etag = self.client.get(TAGS_URL)['ETag']
+
+        response = self.client.get(TAGS_URL, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.client.post(TAGS_URL, {'name': 'Dessert'})
+        response = self.client.get(TAGS_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 2)
+
+    def test_bulk_create_tags(self):
+        """Test creating many tags in one request"""
+        payload = [{'name': 'Vegan'}, {'name': 'Dessert'}]
+
+        response = self.client.post(TAGS_BULK_URL, payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        names = Tag.objects.filter(user=self.user).values_list(
+            'name', flat=True
+        )
+        self.assertEqual(sorted(names), ['Dessert', 'Vegan'])
+
+    def test_bulk_create_tags_duplicate_names(self):
+        """Test bulk creating existing or repeated names fails"""
+        Tag.objects.create(user=self.user, name='Vegan')
+        payload = [{'name': 'Vegan'}, {'name': 'Dessert'},
+                   {'name': 'Dessert'}]
+
+        response = self.client.post(TAGS_BULK_URL, payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        errors = response.data['errors']
+        self.assertIn('name', errors[0])
+        self.assertEqual(errors[1], {})
+        self.assertIn('name', errors[2])
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 1)
+
+    @patch('recipe.bulk.refresh_search_vectors')
+    def test_bulk_rename_tags_refreshes_recipes(self, refresh):
+        """Test renaming tags in bulk refreshes the recipes using them"""
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        recipe = Recipe.objects.create(
+            user=self.user, title='Soup', time_minutes=5, price=1.00
+        )
+        recipe.tags.add(tag)
+
+        response = self.client.patch(
+            TAGS_BULK_URL, [{'id': tag.id, 'name': 'Plant based'}],
+            format='json'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        refresh.assert_called_once()
+        self.assertEqual(list(refresh.call_args[0][0]), [recipe.id])
+
+    def test_tags_recipe_count(self):
+        """Test each tag has the number of recipes using it"""
+        tag1 = Tag.objects.create(user=self.user, name='Vegan')
+        tag2 = Tag.objects.create(user=self.user, name='Dessert')
+        for title in ('First', 'Second'):
+            recipe = Recipe.objects.create(
+                user=self.user, title=title, time_minutes=5, price=1.00
+            )
+            recipe.tags.add(tag1)
+
+        # counted by the list query itself
+        with self.assertNumQueries(1):
+            response = self.client.get(TAGS_URL)
+
+        counts = {item['name']: item['recipe_count'] for item in response.data}
+        self.assertEqual(counts, {tag1.name: 2, tag2.name: 0})
+
+    def test_tags_assigned_only(self):
+        """Test filtering tags by those assigned to recipes"""
+        tag1 = Tag.objects.create(user=self.user, name='Vegan')
+        Tag.objects.create(user=self.user, name='Dessert')
+        recipe = Recipe.objects.create(
+            user=self.user, title='Soup', time_minutes=5, price=1.00
+        )
+        recipe.tags.add(tag1)
+
+        response = self.client.get(TAGS_URL, {'assigned_only': 1})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['name'] for item in response.data], ['Vegan'])
+
+        response = self.client.get(TAGS_URL, {'assigned_only': 'yes'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -0,0 +1,126 @@
+import csv
+import io
+import json
+
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from django.test import TestCase, override_settings
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Tag, Recipe
+
+from recipe.tests.test_recipe_api import sample_recipe
+
+
+# ../recipe/recipes/export/
+EXPORT_URL = reverse('recipe:recipe-export')
+# ../recipe/recipes/import/
+IMPORT_URL = reverse('recipe:recipe-import')
+
+
+class PrivateTransferApiTests(TestCase):
+    """Test exporting and importing recipes"""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            'test@gmail.com',
+            'password'
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_export_ndjson(self):
+        """Test recipes are exported one JSON object per line"""
+        first = sample_recipe(self.user, tags=['Vegan', 'Quick'],
+                              ingredients=['Salt'], title='First')
+        sample_recipe(self.user, title='Second')
+
+        # several chunks
+        with override_settings(RECIPE_STREAM_CHUNK_SIZE=1):
+            response = self.client.get(EXPORT_URL, {'format': 'ndjson'})
+            content = b''.join(response.streaming_content)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        records = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(records[0], {
+            'id': first.id,
+            'title': 'First',
+            'time_minutes': 10,
+            'price': '5.00',
+            'link': '',
+            'tags': ['Quick', 'Vegan'],
+            'ingredients': ['Salt'],
+        })
+        self.assertEqual(records[1]['title'], 'Second')
+
+    def test_export_csv(self):
+        """Test recipes are exported as CSV with lists of names"""
+        sample_recipe(self.user, tags=['Vegan'], title='Soup, hot')
+
+        response = self.client.get(EXPORT_URL, {'format': 'csv'})
+        content = b''.join(response.streaming_content).decode()
+
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['title'], 'Soup, hot')
+        self.assertEqual(json.loads(rows[0]['tags']), ['Vegan'])
+
+    def test_export_import_round_trip(self):
+        """Test an export imports into another account"""
+        sample_recipe(self.user, tags=['Vegan', 'Quick'],
+                      ingredients=['Salt'], title='First')
+        sample_recipe(self.user, tags=['Quick'], title='Second')
+        content = b''.join(self.client.get(
+            EXPORT_URL, {'format': 'ndjson'}
+        ).streaming_content)
+
+        user2 = get_user_model().objects.create_user(
+            'other@gmail.com',
+            'password'
+        )
+        Tag.objects.create(user=user2, name='Quick')
+        self.client.force_authenticate(user2)
+        with override_settings(RECIPE_IMPORT_BATCH_SIZE=1):
+            response = self.client.post(
+                IMPORT_URL, content, content_type='application/x-ndjson'
+            )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 2)
+        recipe = Recipe.objects.get(user=user2, title='First')
+        self.assertEqual(
+            sorted(recipe.tags.values_list('name', flat=True)),
+            ['Quick', 'Vegan']
+        )
+        # the existing tag was reused
+        self.assertEqual(Tag.objects.filter(user=user2).count(), 2)
+
+    def test_import_csv_reports_invalid_rows(self):
+        """Test invalid rows are skipped and reported by line"""
+        content = (
+            'title,time_minutes,price,link,tags,ingredients\r\n'
+            'Good,5,1.50,,"[""Vegan""]",[]\r\n'
+            'Bad,soon,1.50,,[],[]\r\n'
+        ).encode()
+
+        response = self.client.post(
+            IMPORT_URL, content, content_type='text/csv'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['failed'], 1)
+        self.assertEqual(response.data['errors'][0]['line'], 3)
+        self.assertIn('time_minutes', response.data['errors'][0]['errors'])
+        self.assertTrue(Recipe.objects.filter(title='Good').exists())
+
+    def test_import_unsupported_type(self):
+        """Test importing anything but NDJSON or CSV is refused"""
+        response = self.client.post(IMPORT_URL, {'title': 'x'})
+
+        self.assertEqual(
+            response.status_code, status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+        )
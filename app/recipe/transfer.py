@@ -0,0 +1,232 @@
+import codecs
+import csv
+import json
+from itertools import islice
+
+from django.db import transaction
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework import renderers, serializers
+
+from core.models import Recipe
+from core.search import refresh_search_vectors
+from core.versions import bump_data_version
+from recipe.bulk import bulk_insert
+from recipe.renderers import dumps
+from recipe.serializers import save_missing_related
+
+
+# Export and import of a user's recipes
+# > one recipe per line, with its tags and ingredients given by name
+#   so the file can be imported into another account
+# > NDJSON: one JSON object per line
+# > CSV: the tags and ingredients columns hold a JSON array of names
+
+EXPORT_COLUMNS = ('id', 'title', 'time_minutes', 'price', 'link')
+RELATIONS = ('tags', 'ingredients')
+CSV_HEADER = EXPORT_COLUMNS + RELATIONS
+
+# most line errors reported back by an import
+MAX_REPORTED_ERRORS = 100
+
+
+class NDJSONRenderer(renderers.BaseRenderer):
+    """Newline delimited JSON, used by ?format=ndjson"""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # only used for errors, exports are streamed
+        return dumps(data) + b'\n'
+
+
+class CSVRenderer(renderers.BaseRenderer):
+    """CSV, used by ?format=csv"""
+    media_type = 'text/csv'
+    format = 'csv'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # only used for errors, exports are streamed
+        return 'detail\r\n"{}"\r\n'.format(
+            str(data).replace('"', '""')
+        ).encode()
+
+
+def export_records(queryset, chunk_size):
+    """Yield every recipe of a queryset as a dict, chunk by chunk"""
+    rows = queryset.values(*EXPORT_COLUMNS).iterator(chunk_size=chunk_size)
+    for chunk in iter(lambda: list(islice(rows, chunk_size)), []):
+        ids = [row['id'] for row in chunk]
+        names = {}
+        for relation in RELATIONS:
+            # the names of the related objects of the whole chunk
+            names[relation] = {pk: [] for pk in ids}
+            through = getattr(Recipe, relation).through
+            target = Recipe._meta.get_field(relation).m2m_reverse_field_name()
+            for pk, name in through.objects.filter(
+                    recipe_id__in=ids).order_by(f'{target}__name').values_list(
+                    'recipe_id', f'{target}__name'):
+                names[relation][pk].append(name)
+
+        for row in chunk:
+            row['price'] = str(row['price'])
+            for relation in RELATIONS:
+                row[relation] = names[relation][row['id']]
+            yield row
+
+
+def ndjson_lines(records):
+    """Yield the records as NDJSON lines"""
+    for record in records:
+        yield dumps(record) + b'\n'
+
+
+class _Echo:
+    """File-like object returning what is written, for csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(records):
+    """Yield the records as CSV lines, after a header"""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_HEADER).encode()
+    for record in records:
+        yield writer.writerow(
+            [record[column] for column in EXPORT_COLUMNS] +
+            [json.dumps(record[relation], ensure_ascii=False)
+             for relation in RELATIONS]
+        ).encode()
+
+
+def parse_ndjson(lines):
+    """Yield (line number, record or error) for each NDJSON line"""
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield number, _('Invalid JSON')
+            continue
+        if not isinstance(record, dict):
+            yield number, _('Expected a JSON object')
+            continue
+        yield number, record
+
+
+def parse_csv(lines):
+    """Yield (line number, record or error) for each CSV row"""
+    reader = csv.DictReader(codecs.iterdecode(lines, 'utf-8'))
+    for record in reader:
+        # the line the row ended on, a quoted value may span lines
+        number = reader.line_num
+        try:
+            for relation in RELATIONS:
+                record[relation] = json.loads(record.get(relation) or '[]')
+        except ValueError:
+            yield number, {relation: [_('Expected a JSON array of names')]}
+            continue
+        yield number, record
+
+
+PARSERS = {
+    'ndjson': parse_ndjson,
+    'csv': parse_csv,
+}
+
+
+class ImportRecordSerializer(serializers.ModelSerializer):
+    """Validate one imported recipe, tags and ingredients by name"""
+    tags = serializers.ListField(
+        child=serializers.CharField(max_length=255), default=list
+    )
+    ingredients = serializers.ListField(
+        child=serializers.CharField(max_length=255), default=list
+    )
+
+    class Meta:
+        model = Recipe
+        fields = ('title', 'time_minutes', 'price', 'link') + RELATIONS
+
+
+def import_records(user, records, batch_size):
+    """Create recipes from parsed records, batch_size at a time
+
+    Records come from one of the PARSERS so the file is read as it is
+    imported. Each batch is written with a few bulk queries in its own
+    transaction, invalid records are skipped and reported.
+    """
+    result = {'created': 0, 'failed': 0, 'errors': []}
+    records = iter(records)
+    for batch in iter(lambda: list(islice(records, batch_size)), []):
+        valid = []
+        for number, record in batch:
+            serializer = None
+            if isinstance(record, dict):
+                serializer = ImportRecordSerializer(data=record)
+            if serializer is not None and serializer.is_valid():
+                valid.append(serializer.validated_data)
+                continue
+
+            result['failed'] += 1
+            if len(result['errors']) < MAX_REPORTED_ERRORS:
+                result['errors'].append({
+                    'line': number,
+                    'errors': serializer.errors if serializer else record,
+                })
+
+        if valid:
+            with transaction.atomic():
+                write_batch(user, valid, batch_size)
+            result['created'] += len(valid)
+    return result
+
+
+def write_batch(user, items, batch_size):
+    """Insert a batch of validated recipes and their relations"""
+    models = {
+        relation: Recipe._meta.get_field(relation).related_model
+        for relation in RELATIONS
+    }
+    # names become unsaved objects, created or looked up all at once
+    related = [
+        {
+            relation: [
+                models[relation](name=name.strip())
+                for name in dict.fromkeys(item[relation]) if name.strip()
+            ]
+            for relation in RELATIONS
+        }
+        for item in items
+    ]
+    save_missing_related(user, [
+        objs for item in related for objs in item.values()
+    ])
+
+    recipes = bulk_insert(Recipe, [
+        Recipe(
+            user=user,
+            title=item['title'],
+            time_minutes=item['time_minutes'],
+            price=item['price'],
+            link=item.get('link', ''),
+        )
+        for item in items
+    ], batch_size)
+
+    for relation in RELATIONS:
+        through = getattr(Recipe, relation).through
+        target = Recipe._meta.get_field(relation).m2m_reverse_field_name()
+        through.objects.bulk_create([
+            through(recipe_id=recipe.pk, **{f'{target}_id': obj.pk})
+            for recipe, item in zip(recipes, related)
+            for obj in item[relation]
+        ], batch_size=batch_size)
+
+    # bulk writes send no signals
+    refresh_search_vectors(recipe.pk for recipe in recipes)
+    bump_data_version(user.pk)
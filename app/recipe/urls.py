@@ -35,5 +35,9 @@ urlpatterns = [
     # ../recipe/tags/
     # ../recipe/ingredients/
     # ../recipe/recipes/
-    path('', include(router.urls))
+    path('', include(router.urls)),
+    # ../recipe/sync/
+    path('sync/', views.SyncView.as_view(), name='sync'),
+    # ../recipe/stats/
+    path('stats/', views.StatsView.as_view(), name='stats'),
 ]
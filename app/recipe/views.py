@@ -10,28 +10,54 @@
 #   we do not want to the create, update, delete functions
 # > we can achive this be a combination of the
 # generic viewset and the list model mixins
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.http import StreamingHttpResponse
+from django.db.models import Count, Prefetch
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags
+from django.utils.translation import gettext_lazy as _
+
 from rest_framework import viewsets, mixins, status
-from rest_framework.authentication import TokenAuthentication
 from rest_framework.decorators import action
+from rest_framework.exceptions import UnsupportedMediaType, ValidationError
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
 
 # import the Tag model class
+from core.images import enqueue_recipe_image
 from core.models import Tag, Ingredient, Recipe
+from core.storage import release_files
+from core.versions import get_data_version
+from core.uploadhandlers import StreamingImageUploadHandler
 
 # import the serializer
-from recipe import serializers
+from recipe import filters, serializers, stats, sync, transfer
+from recipe.bulk import BulkModelMixin, duplicate_message
+from recipe.cache import CachedListMixin
+from recipe.fastlist import FastListMixin
+from user.authentication import CachedTokenAuthentication
+from recipe.pagination import (
+    RecipeCursorPagination,
+    RecipeAttrCursorPagination,
+)
 
 
 # Create your views here.
-class BaseRecipeAttrViewSet(viewsets.GenericViewSet,
+class BaseRecipeAttrViewSet(CachedListMixin,
+                            FastListMixin,
+                            viewsets.GenericViewSet,
                             mixins.ListModelMixin,
-                            mixins.CreateModelMixin,):
+                            mixins.CreateModelMixin,
+                            BulkModelMixin,):
     """Base viewset for user owned recipe attributes"""
     # requires authentication to access the Tag
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
+    # opt-in keyset pagination, enabled with ?cursor= or ?page_size=
+    pagination_class = RecipeAttrCursorPagination
 
     # override get_queryset() mtd for ListModelMixin
     # to filter object by the authenticated user
@@ -41,8 +67,24 @@ class BaseRecipeAttrViewSet(viewsets.GenericViewSet,
         # 'queryset = Tag.objects.all()'
         # or 'queryset = Ingredient.objects.all()'
         # then the filtering is performed in the overriden mtd
-        # then order by tag name
-        return self.queryset.filter(user=self.request.user).order_by('-name')
+        # then order by tag name, names are unique per user
+        # > recipe_count is counted by the same query, with a GROUP BY
+        #   on the join with the recipe tags or ingredients table
+        queryset = self.queryset.filter(
+            user=self.request.user
+        ).annotate(recipe_count=Count('recipe')).order_by('-name')
+
+        # ?assigned_only=1 only returns the ones used by a recipe
+        if self._params_to_bool('assigned_only'):
+            queryset = queryset.filter(recipe_count__gt=0)
+        return queryset
+
+    def _params_to_bool(self, name):
+        """Return the value of a 0 or 1 query param"""
+        value = self.request.query_params.get(name, '0')
+        if value not in ('0', '1'):
+            raise ValidationError({name: _('Must be 0 or 1')})
+        return value == '1'
 
     # overide perform_create for CreateModelMixin
     # it allows us to hook into the create proceswe do a create object
@@ -52,7 +94,15 @@ class BaseRecipeAttrViewSet(viewsets.GenericViewSet,
     def perform_create(self, serializer):
         """Create a new Object e.g. Tag or Ingredient
         """
-        serializer.save(user=self.request.user)
+        # the (user, name) unique constraint rejects a duplicate name
+        # > cheaper than checking for it with a query beforehand
+        try:
+            with transaction.atomic():
+                serializer.save(user=self.request.user)
+        except IntegrityError:
+            raise ValidationError({'name': [duplicate_message(
+                serializer.Meta.model, 'name'
+            )]})
 
 # Create your views here.
 
@@ -75,7 +125,8 @@ class IngredientViewSet(BaseRecipeAttrViewSet):
     serializer_class = serializers.IngredientSerializer
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(CachedListMixin, FastListMixin, viewsets.ModelViewSet,
+                    BulkModelMixin):
     """Manage recipes in the database"""
 
     # add serializer class
@@ -86,15 +137,65 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
     # add athentication classes
     # so that user must be authenticated to be permited to have access
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (CachedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
+    # opt-in keyset pagination, enabled with ?cursor= or ?page_size=
+    pagination_class = RecipeCursorPagination
+
+    # query plan for each action
+    # > the serializers read recipe.tags and recipe.ingredients
+    #   for every recipe, which is one query per recipe per relation
+    # > prefetching them loads the relation for the whole page
+    #   in one extra query each, whatever the number of recipes
+    # > list only renders the ids so only the ids are loaded
+    #   while retrieve renders the nested tag and ingredient objects
+    # > related objects are ordered by id so the output is stable
+    # > ?expand=tags on the list loads the whole tags instead
+    action_prefetches = {
+        'list': (
+            Prefetch('tags', queryset=Tag.objects.only('id').order_by('id')),
+            Prefetch(
+                'ingredients',
+                queryset=Ingredient.objects.only('id').order_by('id')
+            ),
+        ),
+        'retrieve': (
+            Prefetch('tags', queryset=Tag.objects.order_by('id')),
+            Prefetch(
+                'ingredients',
+                queryset=Ingredient.objects.order_by('id')
+            ),
+            'image_renditions',
+        ),
+    }
+    expand_prefetches = {
+        'tags': Prefetch('tags', queryset=Tag.objects.order_by('id')),
+        'ingredients': Prefetch(
+            'ingredients',
+            queryset=Ingredient.objects.order_by('id')
+        ),
+    }
+    # actions taking ?fields= and ?expand=
+    sparse_actions = ('list', 'retrieve')
 
     # create a private function
     # to convert ids to tags
 
     def _params_to_ints(self, qs):
         """Convert a list of string IDs to a list of integers"""
-        return [int(str_id) for str_id in qs.split(',')]
+        try:
+            return [int(str_id) for str_id in qs.split(',')]
+        except ValueError:
+            raise ValidationError(_('IDs must be a comma separated list'))
+
+    def _params_to_mode(self, name):
+        """Return the match mode ('any' or 'all') for a filter param"""
+        mode = self.request.query_params.get(name, 'any')
+        if mode not in filters.MATCH_MODES:
+            raise ValidationError(
+                {name: _('Must be one of: any, all')}
+            )
+        return mode
 
     # override get_queryset()
     def get_queryset(self):
@@ -113,22 +214,93 @@ class RecipeViewSet(viewsets.ModelViewSet):
             # converts all the tag string ids to tag int ids
             tag_ids = self._params_to_ints(tags)
 
-            # tags__id__in: django syntax for filtering on FK objects
-            # we have a 'tags' field in our recipe queryset
-            # that has a FK to the tags table that has an 'id'
-            # if you want to filter by the remot table you do 'tags__id'
-            # then you can apply another function like 'in'
-            # to become 'tags__id__in'
-            # which then means return all of the tags
-            # where the id is in this list that we provide
-            queryset = queryset.filter(tags__id__in=tag_ids)
+            # ?tags_mode=any (default) returns recipes with any of the tags
+            # ?tags_mode=all returns recipes that have all of the tags
+            # > each filter is one subquery on the through table
+            #   instead of a JOIN, so a recipe matching two tags
+            #   is still returned once
+            queryset = filters.filter_by_related(
+                queryset, 'tags', tag_ids, self._params_to_mode('tags_mode')
+            )
         if ingredients:
             ingredient_ids = self._params_to_ints(ingredients)
-            queryset = queryset.filter(ingredients__id__in=ingredient_ids)
+            queryset = filters.filter_by_related(
+                queryset,
+                'ingredients',
+                ingredient_ids,
+                self._params_to_mode('ingredients_mode')
+            )
 
         # limit the object to the authenticated user
         # return self.queryset.filter(user=self.request.user)
-        return queryset.filter(user=self.request.user)
+        # newest recipes first, matching the cursor pagination ordering
+        queryset = queryset.filter(user=self.request.user).order_by('-id')
+
+        # ?search= full-text searches the title, tags and ingredients
+        # and orders the results by relevance
+        # > note that cursor pagination keeps ordering by id
+        search = self.request.query_params.get('search', '').strip()
+        if search:
+            queryset = filters.search_recipes(queryset, search)
+
+        # ?fields= only loads the columns of the requested fields
+        # e.g. ?fields=id,title leaves out link, image etc.
+        fields, _expand = self.get_sparse_params()
+        if fields is not None:
+            columns = {
+                field.name for field in Recipe._meta.concrete_fields
+                if field.name in fields
+            }
+            queryset = queryset.only('id', *columns)
+
+        # add the prefetches planned for the current action
+        return queryset.prefetch_related(*self.get_prefetches())
+
+    def get_prefetches(self):
+        """Return the related lookups to prefetch for the current action"""
+        fields, expand = self.get_sparse_params()
+        prefetches = []
+        for lookup in self.action_prefetches.get(self.action, ()):
+            name = getattr(lookup, 'prefetch_to', lookup)
+            # relations left out of the response are not loaded at all
+            if fields is not None and name not in fields:
+                continue
+            prefetches.append(self.expand_prefetches.get(name, lookup)
+                              if name in expand else lookup)
+        return prefetches
+
+    def _params_to_names(self, name, allowed):
+        """Convert a comma separated list of names, checking each one"""
+        value = self.request.query_params.get(name, '')
+        names = [n.strip() for n in value.split(',') if n.strip()]
+        unknown = [n for n in names if n not in allowed]
+        if unknown:
+            raise ValidationError({
+                name: [_('Unknown field(s): %s') % ', '.join(unknown)]
+            })
+        return names
+
+    def get_sparse_params(self):
+        """Return the ?fields= (None for all) and ?expand= of a request"""
+        if self.action not in self.sparse_actions:
+            return None, ()
+        if not hasattr(self, '_sparse_params'):
+            serializer_class = self.get_serializer_class()
+            fields = self._params_to_names(
+                'fields', serializer_class.Meta.fields
+            )
+            expand = self._params_to_names(
+                'expand', serializer_class.expandable
+            )
+            self._sparse_params = (fields or None, expand)
+        return self._sparse_params
+
+    def get_serializer_context(self):
+        """Pass the requested fields and expansions to the serializer"""
+        context = super().get_serializer_context()
+        fields, expand = self.get_sparse_params()
+        context.update(fields=fields, expand=expand)
+        return context
 
     # override get_serializer_class()
     def get_serializer_class(self):
@@ -158,6 +330,64 @@ class RecipeViewSet(viewsets.ModelViewSet):
         # to that model once it has been created
         serializer.save(user=self.request.user)
 
+    # ../recipes/export/?format=ndjson or ?format=csv
+    # > the format param picks the renderer, which only sets the
+    #   content type here as the response is streamed
+    @action(methods=['GET'], detail=False, url_path='export',
+            renderer_classes=[transfer.NDJSONRenderer, transfer.CSVRenderer])
+    def export(self, request):
+        """Stream the user's recipes with their tags and ingredients"""
+        # the ?tags= / ?ingredients= / ?search= filters apply too
+        queryset = self.get_queryset().prefetch_related(None).order_by('id')
+        records = transfer.export_records(
+            queryset, settings.RECIPE_STREAM_CHUNK_SIZE
+        )
+
+        renderer = request.accepted_renderer
+        if renderer.format == 'csv':
+            lines = transfer.csv_lines(records)
+        else:
+            lines = transfer.ndjson_lines(records)
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type += f'; charset={renderer.charset}'
+
+        response = StreamingHttpResponse(lines, content_type=content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename="recipes.{renderer.format}"'
+        )
+        return response
+
+    # ../recipes/import/ with an NDJSON or CSV body, as exported
+    @action(methods=['POST'], detail=False, url_path='import',
+            url_name='import')
+    def import_recipes(self, request):
+        """Create recipes from an NDJSON or CSV export"""
+        formats = {
+            transfer.NDJSONRenderer.media_type: 'ndjson',
+            transfer.CSVRenderer.media_type: 'csv',
+        }
+        media_type = request.content_type.split(';')[0].strip()
+        if media_type not in formats:
+            raise UnsupportedMediaType(request.content_type)
+        parse = transfer.PARSERS[formats[media_type]]
+
+        # the body is read line by line from the underlying request
+        # instead of request.data, which would load all of it
+        result = transfer.import_records(
+            request.user,
+            parse(request._request),
+            settings.RECIPE_IMPORT_BATCH_SIZE
+        )
+
+        if result['created']:
+            response_status = status.HTTP_201_CREATED
+        elif result['failed']:
+            response_status = status.HTTP_400_BAD_REQUEST
+        else:
+            response_status = status.HTTP_200_OK
+        return Response(result, status=response_status)
+
     # override the upload_image()
     # -methods=[]: mtd your action will use, 'GET', 'POST', 'PUT', 'PATCH'
     # -detail=True: means use only the detail url to upload images
@@ -168,18 +398,53 @@ class RecipeViewSet(viewsets.ModelViewSet):
         """Upload an image to a recipe"""
         # retrieve the recipe object, based on the ID/PK
         recipe = self.get_object()
+        old_image = recipe.image.name
+
+        # stream the upload to disk chunk by chunk, checking the size
+        # limits as it arrives, instead of the default handlers
+        # > must be set before request.data is first read
+        handler = StreamingImageUploadHandler(
+            request._request,
+            storage=Recipe._meta.get_field('image').storage
+        )
+        request._request.upload_handlers = [handler]
+
         serializer = self.get_serializer(
             recipe,
             data=request.data
         )
 
+        # the handler dropped the file for being too big or not an image
+        if handler.error:
+            return Response(
+                {'image': [handler.error]},
+                status=(
+                    status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+                    if handler.too_large else status.HTTP_400_BAD_REQUEST
+                )
+            )
+
         # check if serializer is valied
         if serializer.is_valid():
-            serializer.save()
-            # return good response
+            # the stored file stays locked until the recipe
+            # referencing it is committed, see core.storage.lock_files
+            with transaction.atomic():
+                recipe = serializer.save()
+                # the replaced image is deleted unless another recipe
+                # has the same image (files are stored by content)
+                if old_image and old_image != recipe.image.name:
+                    storage = recipe.image.storage
+                    transaction.on_commit(
+                        lambda: release_files(storage, [old_image])
+                    )
+                # only the original is stored here, the resized
+                # renditions are created by a background worker
+                # (core/images.py)
+                enqueue_recipe_image(recipe)
+            # 202 as the processing is still to happen
             return Response(
                 serializer.data,
-                status=status.HTTP_200_OK
+                status=status.HTTP_202_ACCEPTED
             )
 
         # else return invalied response
@@ -187,3 +452,55 @@ class RecipeViewSet(viewsets.ModelViewSet):
             serializer.errors,
             status=status.HTTP_400_BAD_REQUEST
         )
+
+
+class SyncView(APIView):
+    """Return the recipes, tags and ingredients changed since a sync
+
+    GET ../sync/ returns everything and a token, then
+    GET ../sync/?since=<token> only what was created, changed or
+    deleted since the sync that returned the token.
+    """
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request):
+        try:
+            data = sync.changes_since(
+                request.user, request.query_params.get('since')
+            )
+        except sync.InvalidSyncToken:
+            raise ValidationError({'since': [_('Invalid sync token')]})
+        return Response(data)
+
+
+class StatsView(APIView):
+    """Return statistics on the user's recipes
+
+    Usage counts of the tags and ingredients, time and price
+    histograms and the tags and ingredients most used together,
+    so clients do not have to download every recipe to get them.
+    """
+    authentication_classes = (CachedTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request):
+        # computed for each request without a shared cache, the
+        # versions are not reliable otherwise, see core.versions
+        if not settings.LIST_CACHE_ENABLED:
+            return Response(stats.compute_stats(request.user))
+
+        version = get_data_version(request.user.pk)
+        etag = f'"stats-{request.user.pk}-{version}"'
+
+        # the client already has these statistics
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match and etag in parse_etags(if_none_match):
+            response = Response(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = Response(stats.get_stats(request.user, version))
+
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Authorization',))
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
@@ -0,0 +1,2 @@
+# use UserConfig so that its ready() hook registers our signals
+default_app_config = 'user.apps.UserConfig'
@@ -0,0 +1,159 @@
+import hashlib
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from core.instrumentation import registry
+
+
+class TokenCache:
+    """Cache of the users authenticated by each token
+
+    An in-process LRU with a TTL, or a shared Django cache when one is
+    configured so that every worker process benefits from a lookup and
+    sees a revoked token at once. Users are stored pickled so every
+    request gets its own copy.
+    """
+
+    def __init__(self, max_size, ttl, alias=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.alias = alias
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def cache_key(key):
+        """Return the cache key of a token, never the token itself"""
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return f'auth-token:{digest}'
+
+    @property
+    def shared(self):
+        """Return the shared cache, or None if it is not configured"""
+        return caches[self.alias] if self.alias else None
+
+    def get(self, key):
+        """Return the cached user of a token, or None"""
+        cache_key = self.cache_key(key)
+        if self.shared:
+            # no local copy in front of the shared cache: a token
+            # revoked in another process would keep working here
+            # until the copy expired
+            blob = self.shared.get(cache_key)
+        else:
+            blob = None
+            now = time.monotonic()
+            with self._lock:
+                entry = self._entries.get(cache_key)
+                if entry is not None and entry[0] > now:
+                    # most recently used entries are kept at the end
+                    self._entries.move_to_end(cache_key)
+                    blob = entry[1]
+
+        with self._lock:
+            if blob is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return pickle.loads(blob)
+
+    def set(self, key, user):
+        """Cache the user authenticated by a token"""
+        cache_key = self.cache_key(key)
+        blob = pickle.dumps(user)
+        if self.shared:
+            self.shared.set(cache_key, blob, self.ttl)
+        else:
+            self._store(cache_key, blob)
+
+    def _store(self, cache_key, blob):
+        with self._lock:
+            self._entries[cache_key] = (time.monotonic() + self.ttl, blob)
+            self._entries.move_to_end(cache_key)
+            # evict the least recently used entries
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *keys):
+        """Remove tokens from the cache"""
+        cache_keys = [self.cache_key(key) for key in keys]
+        with self._lock:
+            for cache_key in cache_keys:
+                self._entries.pop(cache_key, None)
+        if self.shared:
+            self.shared.delete_many(cache_keys)
+
+    def invalidate_user(self, user):
+        """Remove the tokens of a user from the cache"""
+        keys = Token.objects.filter(user=user).values_list('key', flat=True)
+        self.invalidate(*keys)
+
+    def clear(self):
+        """Remove every token and reset the counters"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """Return the hit and miss counters"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'size': len(self._entries),
+            }
+
+
+token_cache = TokenCache(
+    max_size=settings.TOKEN_AUTH_CACHE_MAX_SIZE,
+    ttl=settings.TOKEN_AUTH_CACHE_TTL,
+    alias=settings.TOKEN_AUTH_CACHE_ALIAS,
+)
+
+# exported by ../metrics/, see core.instrumentation
+registry.add_source(
+    'token_cache_hits_total', 'counter',
+    'API tokens found in the token cache.',
+    lambda: token_cache.stats()['hits'],
+)
+registry.add_source(
+    'token_cache_misses_total', 'counter',
+    'API tokens looked up in the database.',
+    lambda: token_cache.stats()['misses'],
+)
+registry.add_source(
+    'token_cache_entries', 'gauge',
+    'API tokens in the token cache.',
+    lambda: token_cache.stats()['size'],
+)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """Token authentication that caches the user of each token
+
+    Saves the SELECT joining authtoken_token to core_user on every
+    request. Entries are dropped when the token is deleted or the
+    user is saved (see user.signals), and expire after a TTL so other
+    processes pick up those changes too.
+    """
+
+    def authenticate_credentials(self, key):
+        user = token_cache.get(key)
+        if user is None:
+            # checks the token exists and the user is active
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(key, user)
+            return user, token
+
+        # the token is only used as request.auth, no need to load it
+        token = Token(key=key, user=user)
+        return user, token
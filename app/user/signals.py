@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from user.authentication import token_cache
+
+
+# Drop cached token lookups when they may be out of date
+# > saving a user covers password changes (UserSerializer.update)
+#   and users being deactivated
+# > deleting a token is how a user is logged out
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def user_saved(sender, instance, created, **kwargs):
+    """Remove the cached tokens of a saved user"""
+    if not created:
+        token_cache.invalidate_user(instance)
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    """Remove a deleted token from the cache"""
+    token_cache.invalidate(instance.key)
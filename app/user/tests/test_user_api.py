@@ -1,10 +1,14 @@
 from django.test import TestCase
 from django.contrib.auth import get_user_model
+from django.core.cache import caches
 from django.urls import reverse
 
+from rest_framework.authtoken.models import Token
 from rest_framework.test import APIClient
 from rest_framework import status
 
+from user.authentication import TokenCache, token_cache
+
 # URL for creating users
 # ../user/create/
 CREATE_USER_URL = reverse('user:create')
@@ -210,3 +214,82 @@ class PrivateUserApiTests(TestCase):
         self.assertEqual(self.user.name, payload['name'])
         self.assertTrue(self.user.check_password(payload['password']))
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class TokenAuthenticationCacheTests(TestCase):
+    """Test the cache of authenticated tokens"""
+
+    def setUp(self):
+        token_cache.clear()
+        self.user = create_user(
+            email='test@gmail.com',
+            password='abcd1234',
+            name='name'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_token_lookup_cached(self):
+        """Test the token is only looked up in the database once"""
+        with self.assertNumQueries(1):
+            response = self.client.get(ME_URL)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(ME_URL)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['email'], self.user.email)
+
+        stats = token_cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_invalid_token_not_cached(self):
+        """Test an unknown token is rejected every time"""
+        self.client.credentials(HTTP_AUTHORIZATION='Token unknown')
+
+        for _ in range(2):
+            response = self.client.get(ME_URL)
+            self.assertEqual(
+                response.status_code, status.HTTP_401_UNAUTHORIZED
+            )
+
+    def test_deleted_token_invalidated(self):
+        """Test a deleted token is rejected even after being cached"""
+        self.client.get(ME_URL)
+
+        self.token.delete()
+        response = self.client.get(ME_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_password_change_invalidates(self):
+        """Test changing the password drops the cached user"""
+        self.client.get(ME_URL)
+
+        self.client.patch(ME_URL, {'password': 'newpassword123'})
+
+        self.assertEqual(token_cache.stats()['size'], 0)
+        response = self.client.get(ME_URL)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_deactivated_user_rejected(self):
+        """Test a deactivated user can no longer use a cached token"""
+        self.client.get(ME_URL)
+
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get(ME_URL)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_token_revoked_in_another_process(self):
+        """Test a shared cache entry removed elsewhere is seen at once"""
+        shared_cache = TokenCache(max_size=10, ttl=30, alias='default')
+        shared_cache.set(self.token.key, self.user)
+        self.assertEqual(shared_cache.get(self.token.key), self.user)
+
+        # what invalidate() does in the process deleting the token
+        caches['default'].delete(TokenCache.cache_key(self.token.key))
+
+        self.assertIsNone(shared_cache.get(self.token.key))
@@ -1,8 +1,9 @@
-from rest_framework import generics, authentication, permissions
+from rest_framework import generics, permissions
 from rest_framework.authtoken.views import ObtainAuthToken
 from rest_framework.settings import api_settings
 # import your serializer
 from user.serializers import UserSerializer, AuthTokenSerializer
+from user.authentication import CachedTokenAuthentication
 
 
 class CreateUserView(generics.CreateAPIView):
@@ -32,7 +33,8 @@ class ManageUserView(generics.RetrieveUpdateAPIView):
     # add the authentication so that user must be authenticated
     # i.e. user do not need to have any special permisions
     # they have to be logged in
-    authentication_classes = (authentication.TokenAuthentication, )
+    # > the user of each token is cached, see user/authentication.py
+    authentication_classes = (CachedTokenAuthentication, )
     permission_classes = (permissions.IsAuthenticated, )
 
     # override this method